@@ -0,0 +1,273 @@
+"""
+Benchmark do motor de matching da Cotação Pronta.
+
+Gera tabela mestre e cotação sintéticas (reprodutíveis pela semente) a partir
+das marcas de ``MARCAS_POR_CATEGORIA``, mede leitura e matching e grava um
+relatório JSON para comparar entre commits.
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_matching --linhas 5000 50000 --itens 100 2000 --saida bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.excel_processor import ler_cotacao, ler_tabela_mestre
+from services.matching_engine import MARCAS_POR_CATEGORIA, SABORES_CALDO, processar_cotacao
+
+RELATORIO_VERSAO = 1
+
+MEDIDAS = {
+    "peso": ["90G", "180G", "200G", "350G", "500G", "1KG", "2KG", "5KG"],
+    "volume": ["200ML", "300ML", "500ML", "900ML", "1L", "1.5L", "2L", "5L"],
+    "pacote": ["C4", "C8", "C12", "C16", "C30"],
+}
+VARIANTES = sorted(
+    {"TRAD", "ZERO", "INTEGRAL", "LIGHT", "ORIG", "MORANGO", "CHOCOLATE", "BAUNILHA",
+     "LIMAO", "LAVANDA", "NEUTRO", "FLORAL", "COCO", "UVA", "LARANJA"} | set(SABORES_CALDO)
+)
+# Grafias que aparecem nas cotações dos clientes para a mesma medida
+GRAFIAS_MEDIDA = {"G": ("G", " G", "GR", " GRS"), "KG": ("KG", " KG", "K"), "ML": ("ML", " ML", "MLS"), "L": ("L", "LT", " LITRO")}
+
+
+def _ean13(rng):
+    corpo = "789" + "".join(str(rng.randrange(10)) for _ in range(9))
+    soma = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(corpo))
+    return corpo + str((10 - soma % 10) % 10)
+
+
+def _medida_da_categoria(categoria, rng):
+    if categoria.startswith(("PAPEL", "FRAL", "HASTE", "ABSORV")):
+        return rng.choice(MEDIDAS["pacote"])
+    if categoria in {"AGUA COCO", "LEITE COCO", "REFR", "SUCO", "VIN", "VINHO", "VODKA", "WHISKY",
+                     "CERV", "BEB", "DET", "AMAC", "SANITARIA", "OLEO", "AZEITE", "SH", "COND"}:
+        return rng.choice(MEDIDAS["volume"])
+    return rng.choice(MEDIDAS["peso"])
+
+
+def gerar_tabela_mestre(n_linhas, semente=1):
+    """Linhas {"nome", "ean", "preco"} com nomes únicos e preços únicos."""
+    rng = random.Random(semente)
+    categorias = sorted(c for c, marcas in MARCAS_POR_CATEGORIA.items() if marcas)
+    marcas_por_categoria = {c: sorted(MARCAS_POR_CATEGORIA[c]) for c in categorias}
+    linhas, nomes, precos = [], set(), set()
+    tentativas = 0
+    while len(linhas) < n_linhas and tentativas < n_linhas * 20:
+        tentativas += 1
+        categoria = rng.choice(categorias)
+        partes = [categoria, rng.choice(marcas_por_categoria[categoria])]
+        if rng.random() < 0.7:
+            partes.append(rng.choice(VARIANTES))
+        partes.append(_medida_da_categoria(categoria, rng))
+        nome = " ".join(partes)
+        if nome in nomes:
+            continue
+        preco = round(rng.uniform(1, 120), 2)
+        while preco in precos:
+            preco = round(preco + 0.01, 2)
+        nomes.add(nome)
+        precos.add(preco)
+        linhas.append({"nome": nome, "ean": _ean13(rng) if rng.random() < 0.7 else None, "preco": preco})
+    return linhas
+
+
+def _variar_nome(nome, rng):
+    palavras = nome.split()
+    medida = palavras[-1]
+    for unidade in ("KG", "ML", "G", "L"):
+        if medida.endswith(unidade) and medida[:-len(unidade)].replace(".", "").isdigit():
+            palavras[-1] = medida[:-len(unidade)].replace(".", ",") + rng.choice(GRAFIAS_MEDIDA[unidade])
+            break
+    if len(palavras) > 3 and rng.random() < 0.3:
+        palavras.pop(rng.randrange(2, len(palavras) - 1))
+    if rng.random() < 0.3:
+        meio = palavras[1:-1]
+        rng.shuffle(meio)
+        palavras = [palavras[0]] + meio + [palavras[-1]]
+    nome = " ".join(palavras)
+    return nome.lower() if rng.random() < 0.2 else nome
+
+
+def gerar_cotacao(tabela, n_itens, semente=2, taxa_ean=0.4, taxa_ausentes=0.1):
+    """
+    Itens derivados de linhas da tabela (com o preço esperado) e uma fração
+    de itens que não existem nela (esperado None).
+    """
+    rng = random.Random(semente)
+    itens = []
+    for i in range(n_itens):
+        if rng.random() < taxa_ausentes:
+            categoria = rng.choice(sorted(MARCAS_POR_CATEGORIA))
+            nome = f"{categoria} PRODUTO INEXISTENTE {rng.randrange(10_000)} {rng.choice(MEDIDAS['peso'])}"
+            itens.append({"ean": "", "nome": nome, "linha": i + 2, "esperado": None})
+            continue
+        origem = rng.choice(tabela)
+        ean = origem["ean"] if origem["ean"] and rng.random() < taxa_ean else ""
+        itens.append({"ean": ean, "nome": _variar_nome(origem["nome"], rng), "linha": i + 2, "esperado": origem["preco"]})
+    return itens
+
+
+def salvar_tabela_xlsx(tabela, caminho, prazo=28):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(["PRODUTO", "EAN", "7", str(prazo)])
+    for linha in tabela:
+        ws.append([linha["nome"], linha["ean"], round(linha["preco"] * 0.97, 2), linha["preco"]])
+    wb.save(caminho)
+
+
+def salvar_cotacao_xlsx(itens, caminho):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(["EAN", "DESCRICAO", "PRECO"])
+    for item in itens:
+        ws.append([item["ean"] or None, item["nome"], None])
+    wb.save(caminho)
+
+
+def _cronometrar(funcao, repeticoes):
+    melhor, resultado = None, None
+    for _ in range(max(1, repeticoes)):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return round(melhor, 4), resultado
+
+
+def _resolucao(resultados):
+    """Quantos itens cada camada resolveu, pelo prefixo do tipo."""
+    contagem = {"EAN": 0, "SIMILAR": 0, "APROX": 0, "SEM_MATCH": 0}
+    for res in resultados:
+        tipo = (res.get("tipo") or "SEM_MATCH").split()[0]
+        contagem[tipo] = contagem.get(tipo, 0) + 1
+    return contagem
+
+
+def _qualidade(itens, resultados):
+    com_origem = [(item, res) for item, res in zip(itens, resultados) if item["esperado"] is not None]
+    casados = [(item, res) for item, res in com_origem if res["preco"] is not None]
+    corretos = sum(1 for item, res in casados if res["preco"] == item["esperado"])
+    falsos = sum(1 for item, res in zip(itens, resultados) if item["esperado"] is None and res["preco"] is not None)
+    return {
+        "cobertura": round(len(casados) / len(com_origem), 4) if com_origem else None,
+        "precisao": round(corretos / len(casados), 4) if casados else None,
+        "falsos_positivos_ausentes": falsos,
+    }
+
+
+def rodar_cenario(n_linhas, n_itens, semente=1, repeticoes=1, prazo=28):
+    tabela = gerar_tabela_mestre(n_linhas, semente=semente)
+    itens = gerar_cotacao(tabela, n_itens, semente=semente + 1)
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_matching_")
+    caminho_tabela = os.path.join(tmp_dir, "tabela.xlsx")
+    caminho_cotacao = os.path.join(tmp_dir, "cotacao.xlsx")
+    try:
+        salvar_tabela_xlsx(tabela, caminho_tabela, prazo=prazo)
+        salvar_cotacao_xlsx(itens, caminho_cotacao)
+
+        t_tabela, (precos_dict, precos_nome_lista) = _cronometrar(
+            lambda: ler_tabela_mestre(caminho_tabela, prazo=prazo), repeticoes
+        )
+        t_cotacao, (itens_lidos, _) = _cronometrar(lambda: ler_cotacao(caminho_cotacao), repeticoes)
+    finally:
+        for caminho in (caminho_tabela, caminho_cotacao):
+            if os.path.exists(caminho):
+                os.unlink(caminho)
+        os.rmdir(tmp_dir)
+
+    norms_cache = [item["norm"] for item in precos_nome_lista]
+    entrada = [{"ean": item["ean"], "nome": item["nome"], "linha": item["linha"]} for item in itens]
+    t_ean, res_ean = _cronometrar(
+        lambda: processar_cotacao(entrada, precos_dict, precos_nome_lista, modo="ean", norms_cache=norms_cache),
+        repeticoes,
+    )
+    metricas = {}
+
+    def _completo():
+        metricas.clear()
+        return processar_cotacao(
+            entrada, precos_dict, precos_nome_lista, modo="completo", norms_cache=norms_cache, metricas=metricas
+        )
+
+    t_completo, res_completo = _cronometrar(_completo, repeticoes)
+
+    return {
+        "linhas_tabela": len(tabela),
+        "itens_cotacao": len(itens),
+        "itens_lidos": len(itens_lidos),
+        "tempos_s": {
+            "ler_tabela_mestre": t_tabela,
+            "ler_cotacao": t_cotacao,
+            "processar_cotacao_ean": t_ean,
+            "processar_cotacao_completo": t_completo,
+        },
+        "itens_por_s_completo": round(len(itens) / t_completo, 1) if t_completo else None,
+        "resolucao_ean": _resolucao(res_ean),
+        "resolucao_completo": _resolucao(res_completo),
+        "resolucao_camadas_completo": metricas.get("resolucao", {}),
+        "etapas_ms_completo": metricas.get("etapas_ms", {}),
+        "qualidade_completo": _qualidade(itens, res_completo),
+    }
+
+
+def _commit_atual():
+    try:
+        saida = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10,
+        )
+        return saida.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def gerar_relatorio(linhas, itens, semente=1, repeticoes=1):
+    cenarios = []
+    for n_linhas in linhas:
+        for n_itens in itens:
+            print(f"[BENCH] tabela={n_linhas} cotacao={n_itens}", file=sys.stderr)
+            cenarios.append(rodar_cenario(n_linhas, n_itens, semente=semente, repeticoes=repeticoes))
+    return {
+        "versao": RELATORIO_VERSAO,
+        "commit": _commit_atual(),
+        "python": platform.python_version(),
+        "semente": semente,
+        "repeticoes": repeticoes,
+        "cenarios": cenarios,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do motor de matching")
+    parser.add_argument("--linhas", type=int, nargs="+", default=[5000, 50000], help="tamanhos da tabela mestre")
+    parser.add_argument("--itens", type=int, nargs="+", default=[100, 2000], help="tamanhos da cotação")
+    parser.add_argument("--semente", type=int, default=1)
+    parser.add_argument("--repeticoes", type=int, default=1, help="repete cada medição e fica com a menor")
+    parser.add_argument("--saida", help="arquivo JSON do relatório (padrão: stdout)")
+    args = parser.parse_args(argv)
+
+    relatorio = gerar_relatorio(args.linhas, args.itens, semente=args.semente, repeticoes=args.repeticoes)
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from firebase_admin import auth as firebase_auth, firestore
 from pydantic import BaseModel as pydantic_BaseModel
 
+from services.match_cache import estatisticas as estatisticas_match_cache
 from services.security_audit import AUDIT_COLLECTION, audit_event
 
 logger = logging.getLogger(__name__)
@@ -391,12 +392,14 @@ def _compact_recent_event(event: dict) -> dict:
 def _cotacao_session_summary(session: dict) -> dict:
     resultados = session.get("resultados") if isinstance(session.get("resultados"), list) else []
     itens = session.get("itens") if isinstance(session.get("itens"), list) else []
-    total = len(itens) or len(resultados)
-    preenchidos = sum(
-        1
-        for item in resultados
-        if isinstance(item, dict) and item.get("preco") is not None
-    )
+    total = session.get("total_itens") or len(itens) or len(resultados)
+    preenchidos = session.get("preenchidos")
+    if preenchidos is None:
+        preenchidos = sum(
+            1
+            for item in resultados
+            if isinstance(item, dict) and item.get("preco") is not None
+        )
 
     return {
         "createdAt": _iso(session.get("created_at") or session.get("createdAt")),
@@ -1142,7 +1145,18 @@ async def _mongo_cotacao_activity_for_users(database, uids: list[str], since: da
         sessions = await (
             database.cotacao_sessoes.find(
                 {"user_id": {"$in": uids}, "created_at": {"$gte": since}},
-                {"_id": 1, "user_id": 1, "created_at": 1, "tabela_id": 1, "prazo": 1, "modo": 1, "itens": 1, "resultados": 1},
+                {
+                    "_id": 1,
+                    "user_id": 1,
+                    "created_at": 1,
+                    "tabela_id": 1,
+                    "prazo": 1,
+                    "modo": 1,
+                    "total_itens": 1,
+                    "preenchidos": 1,
+                    "itens": 1,
+                    "resultados": 1,
+                },
             )
             .sort("created_at", -1)
             .limit(MAX_RECENT_USERS_LIMIT * 10)
@@ -1637,6 +1651,12 @@ async def billing_overview(
     return report
 
 
+@router.get("/match-cache-stats")
+async def match_cache_stats(admin_uid: str = Depends(_require_admin)):
+    """Consultas e acertos do cache de resultados da cotação desde que esta instância subiu."""
+    return estatisticas_match_cache()
+
+
 @router.get("/recent-users")
 async def recent_users(
     days: int = Query(4, ge=1, le=MAX_LOOKBACK_DAYS),
@@ -9,12 +9,18 @@ import logging
 import uuid
 import asyncio
 import multiprocessing
+import queue as queue_module
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 from io import BytesIO
 
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Body, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import Response
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from motor.motor_asyncio import AsyncIOMotorGridFSBucket
 from pydantic import BaseModel, Field
 from pymongo import UpdateOne
@@ -28,15 +34,60 @@ from services.excel_processor import (
     ler_tabela_mestre,
     gerar_excel_resultado,
     processar_arquivo_cotacao,
-    gerar_excel_multiprazos,
+    extrair_linhas_base,
+    gerar_excel_de_dados,
     detectar_prazos_disponiveis,
     normalizar_coluna_preco,
 )
 from services.matching_engine import limpar_ean, normalizar_nome
+from services.cotacao_executor import (
+    ExecutorOcupado,
+    configurar_executor,
+    executar,
+    executar_em_partes,
+    gravar_referencia_indice,
+    remover_indices_de_outras_versoes,
+    remover_referencias_tabela,
+    tarefa_compilar_tabela,
+    tarefa_ler_cotacao,
+    usa_processos,
+)
+from services.extracao_cache import (
+    buscar_linhas_base,
+    desserializar_linhas_base,
+    guardar_linhas_base,
+    hash_conteudo,
+    serializar_linhas_base,
+)
+from services.tabela_indice import (
+    carregar_indice_tabela,
+    excluir_indices,
+    salvar_indice,
+    selecionar_prazo,
+)
 from services.subscription_access import ensure_subscription_access
 from services.email_verification_access import ensure_email_verified_for_required_user
 from services.upload_validation import PDF_CONTENT_TYPES, XLSX_CONTENT_TYPES, validate_upload
 from services.security_audit import audit_event
+from services.sessao_cotacao import (
+    baixar_blob_para_arquivo,
+    desserializar_sessao,
+    guardar_blob_deduplicado,
+    serializar_sessao,
+)
+from services.match_cache import buscar_resultados, guardar_resultados, hash_tabela
+from services.job_eventos import assinar as assinar_eventos_job
+from services.job_eventos import formatar_sse
+from services.job_eventos import publicar as publicar_evento_job
+from services.job_leases import (
+    COTACAO_JOB_MAX_TENTATIVAS,
+    INSTANCIA_ID,
+    candidatos,
+    lease_expirado,
+    liberar_lease,
+    manter_lease,
+    reivindicar_job,
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -47,6 +98,7 @@ db = None
 # Keep strong references to background tasks so Python's GC doesn't collect them
 _background_tasks: set = set()
 _running_job_ids: set = set()
+_running_por_tipo: dict = {"preview": set(), "tabela_prazos": set()}
 
 
 def _utc_datetime(value: datetime) -> datetime:
@@ -61,6 +113,15 @@ MAX_TABELA_PRAZOS_BYTES = 25 * 1024 * 1024
 PRAZOS_DETECCAO_VERSAO = 2
 MAX_ACTIVE_PREVIEW_JOBS_PER_USER = int(os.environ.get("MAX_ACTIVE_PREVIEW_JOBS_PER_USER", "1"))
 MAX_RUNNING_COTACAO_JOBS = int(os.environ.get("MAX_RUNNING_COTACAO_JOBS", "3"))
+# Vagas desta instância por tipo de job (o total continua limitado por MAX_RUNNING_COTACAO_JOBS)
+COTACAO_JOBS_POR_INSTANCIA = {
+    "preview": int(os.environ.get("COTACAO_PREVIEW_JOBS_POR_INSTANCIA", str(MAX_RUNNING_COTACAO_JOBS))),
+    "tabela_prazos": int(os.environ.get("COTACAO_TABELA_PRAZOS_JOBS_POR_INSTANCIA", str(MAX_RUNNING_COTACAO_JOBS))),
+}
+COTACAO_DISPATCH_INTERVAL_SECONDS = int(os.environ.get("COTACAO_DISPATCH_INTERVAL_SECONDS", "5"))
+# SSE: job de outra instância não publica aqui, então o estado é relido no Mongo
+COTACAO_SSE_VERIFICACAO_SECONDS = int(os.environ.get("COTACAO_SSE_VERIFICACAO_SECONDS", "5"))
+COTACAO_SSE_MAX_SECONDS = int(os.environ.get("COTACAO_SSE_MAX_SECONDS", "900"))
 COTACAO_EXTENSION_SITES_COM_FRACIONAMENTO = {"bubble-catalog-fornecedor", "easy-cotacao-web", "syspan-cotacao"}
 COTACAO_EXTENSION_SITES_FRACIONAMENTO_PADRAO_1 = {"easy-cotacao-web", "syspan-cotacao"}
 COTACAO_CLEANUP_INTERVAL_SECONDS = int(os.environ.get("COTACAO_CLEANUP_INTERVAL_SECONDS", "3600"))
@@ -79,43 +140,84 @@ COTACAO_ORPHAN_GRIDFS_TTL_SECONDS = int(
     os.environ.get("COTACAO_ORPHAN_GRIDFS_TTL_SECONDS", str(COTACAO_TEMP_ARTIFACT_TTL_SECONDS))
 )
 COTACAO_CLEANUP_BATCH_SIZE = int(os.environ.get("COTACAO_CLEANUP_BATCH_SIZE", "500"))
+COTACAO_INDICE_CACHE_MAX_BYTES = int(
+    os.environ.get("COTACAO_INDICE_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+# Confirmações de outra instância só aparecem aqui depois do TTL
+COTACAO_APRENDIZADO_CACHE_TTL_SECONDS = int(os.environ.get("COTACAO_APRENDIZADO_CACHE_TTL_SECONDS", "300"))
+COTACAO_APRENDIZADO_CACHE_MAX_TABELAS = int(os.environ.get("COTACAO_APRENDIZADO_CACHE_MAX_TABELAS", "512"))
 _storage_cleanup_task = None
-
-
-def _gerar_excel_multiprazos_worker(caminho_base, prazos, queue):
+_dispatcher_task = None
+_dispatcher_acordar: asyncio.Event | None = None
+# formato da tabela de prazos -> (nome do arquivo, content type)
+TABELA_PRAZOS_SAIDAS = {
+    "xlsx": ("tabela_com_prazos.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("tabela_com_prazos.csv", "text/csv; charset=utf-8"),
+}
+COTACAO_OCUPADO_MSG = "Servidor ocupado processando outras cotações. Tente novamente em instantes."
+SESSAO_EXPIRADA_MSG = "Sessão expirada ou não encontrada. Processe a cotação novamente."
+
+# Pool de processos do matching com a mesma capacidade do limite de jobs
+configurar_executor(MAX_RUNNING_COTACAO_JOBS)
+
+# Índices de tabela mestre já carregados neste worker:
+# (tabela_id, grid_id, prazo) -> {"precos", "precos_nome_lista", "meta_por_ean", "norms_cache", "bytes"}
+_indices_cache: OrderedDict = OrderedDict()
+_indices_cache_locks: dict = {}
+# Aprendizado confirmado por (user_id, tabela_id) -> (expira_em, {produto_cotacao_norm: preco})
+_aprendizado_cache: OrderedDict = OrderedDict()
+
+
+def _extrair_linhas_base_worker(caminho_base, queue):
     try:
-        resultado_path = gerar_excel_multiprazos(caminho_base, prazos)
-        queue.put({"ok": True, "path": resultado_path})
+        rows_data = extrair_linhas_base(caminho_base, lambda update: queue.put({"progress": update}))
+        queue.put({"ok": True, "linhas": serializar_linhas_base(rows_data)})
     except Exception as e:
         queue.put({"ok": False, "error": str(e), "type": type(e).__name__})
 
 
-def _gerar_excel_multiprazos_pdf_isolado(caminho_base, prazos, timeout_seconds=150):
-    """Gera tabela de PDF em processo separado para poder encerrar parser travado."""
+def _extrair_linhas_pdf_isolado(caminho_base, timeout_seconds=150, progress_callback=None):
+    """Lê o PDF em processo separado para poder encerrar parser travado."""
     metodo = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
     ctx = multiprocessing.get_context(metodo)
     queue = ctx.Queue()
     process = ctx.Process(
-        target=_gerar_excel_multiprazos_worker,
-        args=(caminho_base, prazos, queue),
+        target=_extrair_linhas_base_worker,
+        args=(caminho_base, queue),
     )
     process.start()
-    process.join(timeout_seconds)
 
-    if process.is_alive():
-        process.terminate()
-        process.join(5)
-        raise TimeoutError(
-            "Processamento demorou demais. Esse PDF travou a leitura no servidor; converta para Excel (.xlsx) ou use um PDF menor."
-        )
-
-    if queue.empty():
+    # O resultado (linhas) pode passar do buffer do pipe: lê antes do join
+    prazo = time.monotonic() + timeout_seconds
+    result = None
+    while result is None and time.monotonic() < prazo:
+        try:
+            mensagem = queue.get(timeout=0.5)
+        except queue_module.Empty:
+            if process.is_alive():
+                continue
+            try:
+                mensagem = queue.get(timeout=0.5)
+            except queue_module.Empty:
+                break
+        if "progress" not in mensagem:
+            result = mensagem
+        elif progress_callback:
+            progress_callback(mensagem["progress"])
+
+    if result is None:
+        if process.is_alive():
+            process.terminate()
+            process.join(5)
+            raise TimeoutError(
+                "Processamento demorou demais. Esse PDF travou a leitura no servidor; converta para Excel (.xlsx) ou use um PDF menor."
+            )
         raise RuntimeError("Processo de leitura do PDF terminou sem retornar resultado.")
 
-    result = queue.get()
+    process.join(5)
     if not result.get("ok"):
         raise ValueError(result.get("error") or "Erro ao ler PDF")
-    return result["path"]
+    return desserializar_linhas_base(result["linhas"])
 
 
 def init_cotacao(database):
@@ -151,13 +253,15 @@ async def _upload_grid_file(bucket, filename: str, content: bytes, content_type:
         raise HTTPException(500, f"Erro ao salvar arquivo no servidor: {type(e).__name__}: {str(e)}")
 
 
-def _aprendizado_query(user_id: str, tabela_id: str, nomes_norm):
-    return {
+def _aprendizado_query(user_id: str, tabela_id: str, nomes_norm=None):
+    query = {
         "user_id": user_id,
         "tabela_id": str(tabela_id),
-        "produto_cotacao_norm": {"$in": nomes_norm},
         "confirmado": True,
     }
+    if nomes_norm is not None:
+        query["produto_cotacao_norm"] = {"$in": nomes_norm}
+    return query
 
 
 def _aprendizado_key(user_id: str, tabela_id: str, nome_norm: str):
@@ -168,6 +272,45 @@ def _aprendizado_key(user_id: str, tabela_id: str, nome_norm: str):
     }
 
 
+async def _salvar_sessao_cotacao(session_id, uid, conteudo, suffix, itens, resultados, **campos):
+    """Grava a sessão do preview: planilha deduplicada no GridFS, itens e resultados compactados."""
+    agora = datetime.now(timezone.utc)
+    # Blob reaproveitado não pode estar perto de sair na limpeza de órfãos
+    reusar_desde = agora - timedelta(seconds=max(COTACAO_ORPHAN_GRIDFS_TTL_SECONDS - 3600, 0))
+    grid_id, sha256 = await guardar_blob_deduplicado(
+        db,
+        _bucket(),
+        conteudo,
+        f"cotacao{suffix}",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        reusar_desde,
+    )
+    dados = await asyncio.to_thread(serializar_sessao, itens, resultados)
+    await db.cotacao_sessoes.insert_one({
+        "_id": session_id,
+        "user_id": uid,
+        **campos,
+        "cotacao_suffix": suffix,
+        "cotacao_grid_id": grid_id,
+        "cotacao_sha256": sha256,
+        "dados": dados,
+        "total_itens": len(itens),
+        "preenchidos": sum(1 for res in resultados if res.get("preco") is not None),
+        "created_at": agora,
+    })
+
+
+async def _carregar_sessao_cotacao(session_id: str, uid: str):
+    """Devolve ``(sessao, itens, resultados)``; sessões antigas ainda trazem tudo inline."""
+    sessao = await db.cotacao_sessoes.find_one({"_id": session_id, "user_id": uid})
+    if not sessao:
+        return None, None, None
+    if sessao.get("dados") is None:
+        return sessao, sessao["itens"], sessao["resultados"]
+    itens, resultados = await asyncio.to_thread(desserializar_sessao, bytes(sessao["dados"]))
+    return sessao, itens, resultados
+
+
 def _resultados_para_preview(itens, resultados):
     """Converte itens + resultados do matching para formato de preview da UI."""
     preview = []
@@ -248,7 +391,7 @@ def _cotacao_diagnostics(itens, resultados, limit=20):
     return diagnostics
 
 
-def _cotacao_audit_metadata(*, source, tabela_id, prazo=None, modo=None, session_id=None, job_id=None, stats=None, diagnostics=None):
+def _cotacao_audit_metadata(*, source, tabela_id, prazo=None, modo=None, session_id=None, job_id=None, stats=None, diagnostics=None, metricas=None):
     stats = stats or {}
     total = int(stats.get("total") or 0)
     sem_match = int(stats.get("sem_match") or 0)
@@ -270,13 +413,234 @@ def _cotacao_audit_metadata(*, source, tabela_id, prazo=None, modo=None, session
     }
     if diagnostics:
         metadata["diagnostics"] = list(diagnostics)[:20]
+    if metricas:
+        metadata.update(_metricas_audit_metadata(metricas))
     return metadata
 
 
+@contextmanager
+def _etapa(metricas, nome):
+    """Soma em ``metricas["etapas_ms"][nome]`` o tempo do bloco."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        etapas = metricas.setdefault("etapas_ms", {})
+        etapas[nome] = round(etapas.get(nome, 0) + (time.perf_counter() - inicio) * 1000, 1)
+
+
+def _metricas_audit_metadata(metricas):
+    return {
+        "etapasMs": dict(metricas.get("etapas_ms") or {}),
+        "resolucaoCamadas": dict(metricas.get("resolucao") or {}),
+        "nomesDistintos": metricas.get("nomes_distintos"),
+        "aprendidos": metricas.get("aprendidos"),
+        "cacheHits": metricas.get("cache_hits"),
+        "cpuS": metricas.get("cpu_s"),
+    }
+
+
 def _bucket():
     return AsyncIOMotorGridFSBucket(db)
 
 
+def _indice_cache_key(doc: dict, prazo):
+    return (str(doc["_id"]), str(doc["grid_id"]), int(prazo))
+
+
+def _estimar_bytes_indice(indice: dict) -> int:
+    """Estimativa grosseira do peso em memória (strings + overhead de dict/float)."""
+    total = sys.getsizeof(indice["precos"])
+    for ean in indice["precos"]:
+        total += sys.getsizeof(ean) + 24
+    for item in indice["precos_nome_lista"]:
+        total += sys.getsizeof(item) + 24 + 8
+        for campo in ("orig", "norm", "ord", "ean", "fracionamento"):
+            valor = item.get(campo)
+            if valor:
+                total += sys.getsizeof(valor)
+    total += len(indice["precos_nome_lista"]) * 8
+    total += len(indice["meta_por_ean"]) * 200
+    return total
+
+
+def _indice_cache_bytes() -> int:
+    return sum(entrada["bytes"] for entrada in _indices_cache.values())
+
+
+def _indice_cache_put(chave, indice: dict) -> dict:
+    entrada = {
+        **indice,
+        "norms_cache": [item["norm"] for item in indice["precos_nome_lista"]],
+    }
+    entrada["bytes"] = _estimar_bytes_indice(indice)
+    if entrada["bytes"] > COTACAO_INDICE_CACHE_MAX_BYTES:
+        return entrada
+
+    _indices_cache.pop(chave, None)
+    _indices_cache[chave] = entrada
+    total = _indice_cache_bytes()
+    while total > COTACAO_INDICE_CACHE_MAX_BYTES and _indices_cache:
+        _, removida = _indices_cache.popitem(last=False)
+        total -= removida["bytes"]
+    return entrada
+
+
+def _invalidar_cache_tabela(tabela_id) -> int:
+    chaves = [chave for chave in _indices_cache if chave[0] == str(tabela_id)]
+    for chave in chaves:
+        _indices_cache.pop(chave, None)
+    for chave in [chave for chave in _aprendizado_cache if chave[1] == str(tabela_id)]:
+        _aprendizado_cache.pop(chave, None)
+    return len(chaves)
+
+
+async def _carregar_indice(doc: dict, prazo):
+    """Índice da tabela mestre com LRU por worker na frente do artefato do GridFS."""
+    chave = _indice_cache_key(doc, prazo)
+    entrada = _indices_cache.get(chave)
+    if entrada is not None:
+        _indices_cache.move_to_end(chave)
+        return entrada
+
+    lock = _indices_cache_locks.setdefault(chave, asyncio.Lock())
+    try:
+        async with lock:
+            entrada = _indices_cache.get(chave)
+            if entrada is not None:
+                _indices_cache.move_to_end(chave)
+                return entrada
+            indice = await carregar_indice_tabela(db, _bucket(), doc, prazo)
+            return _indice_cache_put(chave, indice)
+    finally:
+        if not lock.locked():
+            _indices_cache_locks.pop(chave, None)
+
+
+async def _indice_para_tarefa(doc: dict, prazo, indice: dict):
+    """
+    O que as tarefas do executor recebem: o próprio índice com threads; com
+    processos, a referência ao arquivo que os workers mantêm carregado.
+    """
+    if not usa_processos():
+        return indice
+    if "ref" not in indice:
+        indice["ref"] = await asyncio.to_thread(
+            gravar_referencia_indice, _indice_cache_key(doc, prazo), indice, doc["grid_id"], prazo
+        )
+    return indice["ref"]
+
+
+async def _mapa_aprendizado(uid: str, tabela_id) -> dict:
+    """Preços confirmados pelo usuário na tabela, por nome normalizado (cache com TTL)."""
+    chave = (uid, str(tabela_id))
+    entrada = _aprendizado_cache.get(chave)
+    if entrada is not None and entrada[0] > time.monotonic():
+        _aprendizado_cache.move_to_end(chave)
+        return entrada[1]
+
+    mapa = {}
+    async for doc in db.cotacao_aprendizado.find(
+        _aprendizado_query(uid, tabela_id),
+        {"produto_cotacao_norm": 1, "preco": 1},
+    ):
+        if doc.get("preco") is not None:
+            mapa[doc["produto_cotacao_norm"]] = doc["preco"]
+    _aprendizado_cache[chave] = (time.monotonic() + COTACAO_APRENDIZADO_CACHE_TTL_SECONDS, mapa)
+    _aprendizado_cache.move_to_end(chave)
+    while len(_aprendizado_cache) > COTACAO_APRENDIZADO_CACHE_MAX_TABELAS:
+        _aprendizado_cache.popitem(last=False)
+    return mapa
+
+
+def _atualizar_cache_aprendizado(uid, tabela_id, itens, resultados, aprovacoes):
+    """Aplica no cache o que ``_build_aprendizado_ops`` acabou de gravar."""
+    entrada = _aprendizado_cache.get((uid, str(tabela_id)))
+    if entrada is None:
+        return
+    mapa = entrada[1]
+    for item, res, aprovado in zip(itens, resultados, aprovacoes):
+        if res.get("preco") is None or res.get("tipo") == "EAN":
+            continue
+        nome_norm = normalizar_nome(item["nome"])
+        if aprovado:
+            mapa[nome_norm] = res["preco"]
+        else:
+            mapa.pop(nome_norm, None)
+
+
+async def _casar_com_aprendizado(
+    uid, tabela_id, indice, indice_tarefa, itens, modo, metricas, com_meta=False, cache=None, **opcoes
+):
+    """
+    Matching em camadas: aprendizado do usuário (nome já confirmado para a
+    tabela sai como APRENDIDO), depois o cache de resultados quando ``cache``
+    = ``(hash da tabela, prazo)``, e só o resto vai para o motor.
+    Devolve ``(resultados, meta_por_ean)`` na ordem dos itens.
+    """
+    resultados = [None] * len(itens)
+    pendentes = list(range(len(itens)))
+    fora_do_motor = []
+    if modo != "ean" and itens:
+        with _etapa(metricas, "aprendizado"):
+            mapa = await _mapa_aprendizado(uid, tabela_id)
+            pendentes = []
+            for i, item in enumerate(itens):
+                preco = mapa.get(normalizar_nome(item["nome"])) if mapa else None
+                if preco is None:
+                    pendentes.append(i)
+                    continue
+                resultados[i] = {"linha": item.get("linha", 0), "preco": preco, "tipo": "APRENDIDO"}
+                fora_do_motor.append(i)
+        metricas["aprendidos"] = len(itens) - len(pendentes)
+
+    # No modo EAN o motor é só um dicionário: o cache custaria mais que o match
+    if cache is not None and modo == "ean":
+        cache = None
+    if pendentes and cache is not None:
+        try:
+            with _etapa(metricas, "cache_resultados"):
+                encontrados = await buscar_resultados(db, *cache, modo, [itens[i] for i in pendentes])
+        except Exception as e:
+            logger.warning("[MATCH_CACHE] consulta falhou: %s", type(e).__name__)
+            encontrados = {}
+        for pos, res in encontrados.items():
+            resultados[pendentes[pos]] = res
+            fora_do_motor.append(pendentes[pos])
+        metricas["cache_hits"] = len(encontrados)
+        pendentes = [i for pos, i in enumerate(pendentes) if pos not in encontrados]
+
+    meta_por_ean = {}
+    if com_meta:
+        meta_indice = indice.get("meta_por_ean") or {}
+        for i in fora_do_motor:
+            ean = limpar_ean(itens[i].get("ean", ""))
+            if ean in meta_indice:
+                meta_por_ean[ean] = meta_indice[ean]
+
+    if pendentes:
+        itens_motor = itens if len(pendentes) == len(itens) else [itens[i] for i in pendentes]
+        (resultados_motor, meta_motor, metricas_tarefa), cpu_s = await executar_em_partes(
+            indice_tarefa, itens_motor, modo, com_meta=com_meta, **opcoes
+        )
+        _mesclar_metricas(metricas, metricas_tarefa, cpu_s)
+        meta_por_ean.update(meta_motor)
+        for i, res in zip(pendentes, resultados_motor):
+            resultados[i] = res
+        if cache is not None:
+            try:
+                await guardar_resultados(db, *cache, modo, itens_motor, resultados_motor)
+            except Exception as e:
+                logger.warning("[MATCH_CACHE] gravação falhou: %s", type(e).__name__)
+    return resultados, meta_por_ean
+
+
+def _mesclar_metricas(metricas: dict, metricas_tarefa: dict, cpu_s):
+    metricas.setdefault("etapas_ms", {}).update(metricas_tarefa.pop("etapas_ms", {}))
+    metricas.update(metricas_tarefa)
+    metricas["cpu_s"] = round(metricas.get("cpu_s", 0) + cpu_s, 4)
+
+
 def _track_background_task(task, job_id=None):
     _background_tasks.add(task)
 
@@ -284,6 +648,9 @@ def _track_background_task(task, job_id=None):
         _background_tasks.discard(done_task)
         if job_id:
             _running_job_ids.discard(job_id)
+            for ids in _running_por_tipo.values():
+                ids.discard(job_id)
+            _acordar_dispatcher()
 
     task.add_done_callback(_cleanup)
 
@@ -312,7 +679,11 @@ def _should_cleanup_cotacao_job(job: dict, now: datetime | None = None) -> bool:
         return age >= COTACAO_COMPLETED_JOB_TTL_SECONDS
 
     if status in {"queued", "processing"}:
-        return job.get("_id") not in _running_job_ids and age >= COTACAO_STALE_ACTIVE_JOB_TTL_SECONDS
+        return (
+            job.get("_id") not in _running_job_ids
+            and lease_expirado(job, now)
+            and age >= COTACAO_STALE_ACTIVE_JOB_TTL_SECONDS
+        )
 
     return False
 
@@ -344,7 +715,11 @@ async def _delete_tabela_mestre_doc(tabela: dict) -> int:
     if not tabela or not tabela.get("_id"):
         return 0
 
+    _invalidar_cache_tabela(tabela["_id"])
+    # Só na exclusão: renomear não muda o conteúdo e jobs em curso já têm a referência
+    remover_referencias_tabela(tabela["_id"])
     await _delete_grid_file(tabela.get("grid_id"))
+    await excluir_indices(_bucket(), tabela)
     result = await db.tabelas_mestre.delete_one({"_id": tabela["_id"]})
     if result.deleted_count:
         await db.cotacao_aprendizado.delete_many({
@@ -357,22 +732,27 @@ async def _delete_tabela_mestre_doc(tabela: dict) -> int:
 async def _referenced_cotacao_grid_ids() -> set[str]:
     referenced: set[str] = set()
 
-    async for doc in db.tabelas_mestre.find({"grid_id": {"$exists": True}}, {"grid_id": 1}):
+    async for doc in db.tabelas_mestre.find({"grid_id": {"$exists": True}}, {"grid_id": 1, "indices": 1}):
         if doc.get("grid_id"):
             referenced.add(str(doc["grid_id"]))
+        for indice_id in (doc.get("indices") or {}).values():
+            referenced.add(str(indice_id))
 
     async for job in db.cotacao_jobs.find({}, {"input_grid_id": 1, "grid_id": 1}):
         for field in ("input_grid_id", "grid_id"):
             if job.get(field):
                 referenced.add(str(job[field]))
 
+    async for sessao in db.cotacao_sessoes.find({"cotacao_grid_id": {"$exists": True}}, {"cotacao_grid_id": 1}):
+        referenced.add(str(sessao["cotacao_grid_id"]))
+
     return referenced
 
 
 async def cleanup_cotacao_storage_once(now: datetime | None = None) -> dict:
     """Remove apenas artefatos temporários antigos da Cotação Pronta."""
     if db is None:
-        return {"jobs": 0, "sessions": 0, "tables": 0, "orphan_files": 0}
+        return {"jobs": 0, "sessions": 0, "tables": 0, "orphan_files": 0, "index_files": 0}
 
     now = now or datetime.now(timezone.utc)
     completed_cutoff = now - timedelta(seconds=COTACAO_COMPLETED_JOB_TTL_SECONDS)
@@ -381,7 +761,7 @@ async def cleanup_cotacao_storage_once(now: datetime | None = None) -> dict:
     table_cutoff = now - timedelta(seconds=COTACAO_TABELA_MESTRE_TTL_SECONDS)
     orphan_cutoff = now - timedelta(seconds=COTACAO_ORPHAN_GRIDFS_TTL_SECONDS)
 
-    stats = {"jobs": 0, "sessions": 0, "tables": 0, "orphan_files": 0}
+    stats = {"jobs": 0, "sessions": 0, "tables": 0, "orphan_files": 0, "index_files": 0}
 
     job_query = {
         "$or": [
@@ -403,7 +783,7 @@ async def cleanup_cotacao_storage_once(now: datetime | None = None) -> dict:
     active_tabela_ids = await _active_cotacao_tabela_ids()
     async for tabela in db.tabelas_mestre.find(
         {"data_upload": {"$lt": table_cutoff}},
-        {"_id": 1, "grid_id": 1, "user_id": 1, "data_upload": 1},
+        {"_id": 1, "grid_id": 1, "indices": 1, "user_id": 1, "data_upload": 1},
     ).sort("data_upload", 1).limit(COTACAO_CLEANUP_BATCH_SIZE):
         if str(tabela["_id"]) in active_tabela_ids or not _should_cleanup_tabela_mestre(tabela, now):
             continue
@@ -420,6 +800,8 @@ async def cleanup_cotacao_storage_once(now: datetime | None = None) -> dict:
         if await _delete_grid_file(file_id):
             stats["orphan_files"] += 1
 
+    stats["index_files"] = await asyncio.to_thread(remover_indices_de_outras_versoes)
+
     if any(stats.values()):
         logger.info("[COTACAO_CLEANUP] artefatos temporarios removidos: %s", stats)
 
@@ -454,40 +836,131 @@ def start_cotacao_storage_cleanup():
     return _storage_cleanup_task
 
 
-def _can_start_cotacao_job():
-    return len(_running_job_ids) < MAX_RUNNING_COTACAO_JOBS
+def _can_start_cotacao_job(tipo):
+    return (
+        len(_running_job_ids) < MAX_RUNNING_COTACAO_JOBS
+        and len(_running_por_tipo[tipo]) < COTACAO_JOBS_POR_INSTANCIA[tipo]
+    )
 
 
-def _start_tabela_prazos_job(job_id):
+def _start_job(job_id, tipo, processar):
     if job_id in _running_job_ids:
         return None
-    if not _can_start_cotacao_job():
+    if not _can_start_cotacao_job(tipo):
         logger.info(
-            "[Job %s] Aguardando fila: limite global de %s processamentos ativos atingido",
+            "[Job %s] Aguardando fila: sem vaga para %s nesta instância",
             job_id,
-            MAX_RUNNING_COTACAO_JOBS,
+            tipo,
         )
         return None
     _running_job_ids.add(job_id)
-    task = asyncio.create_task(_processar_tabela_prazos(job_id))
+    _running_por_tipo[tipo].add(job_id)
+    task = asyncio.create_task(processar(job_id))
     _track_background_task(task, job_id=job_id)
     return task
 
 
+def _start_tabela_prazos_job(job_id):
+    return _start_job(job_id, "tabela_prazos", _processar_tabela_prazos)
+
+
 def _start_preview_job(job_id):
-    if job_id in _running_job_ids:
-        return None
-    if not _can_start_cotacao_job():
-        logger.info(
-            "[Job %s] Aguardando fila: limite global de %s processamentos ativos atingido",
-            job_id,
-            MAX_RUNNING_COTACAO_JOBS,
+    return _start_job(job_id, "preview", _processar_preview_job)
+
+
+async def _executar_com_lease(job_id, tipo, processar):
+    """Reivindica o job no Mongo e o processa renovando o lease; outra instância pode ter vencido."""
+    try:
+        job = await reivindicar_job(db, job_id, tipo)
+    except Exception as e:
+        logger.warning("[Job %s] Falha ao reivindicar job: %s", job_id, e)
+        return
+    if not job:
+        return
+
+    if job.get("tentativas", 1) > COTACAO_JOB_MAX_TENTATIVAS:
+        logger.warning("[Job %s] Desistindo após %s tentativas", job_id, job.get("tentativas"))
+        await db.cotacao_jobs.update_one(
+            {"_id": job_id},
+            {
+                "$set": {"status": "error", "active": False, "error": "Servidor reiniciou durante o processamento. Tente novamente."},
+                "$unset": {"lease_owner": "", "lease_until": ""},
+            },
         )
+        return
+
+    trabalho = asyncio.create_task(processar(job))
+    heartbeat = asyncio.create_task(manter_lease(db, job_id))
+
+    def _lease_perdido(tarefa):
+        # Outra instância pode reivindicar o job: para antes de gravar resultado
+        if not tarefa.cancelled():
+            trabalho.cancel()
+
+    heartbeat.add_done_callback(_lease_perdido)
+    try:
+        await trabalho
+    except asyncio.CancelledError:
+        if not heartbeat.done() or heartbeat.cancelled():
+            raise
+        logger.warning("[Job %s] Processamento interrompido: lease perdido", job_id)
+    finally:
+        heartbeat.cancel()
+        # Status final já está no Mongo; as conexões SSE leem o resultado de lá
+        publicar_evento_job(job_id, {"status": "fim"})
+        try:
+            await liberar_lease(db, job_id)
+        except Exception as e:
+            logger.warning("[Job %s] Falha ao liberar lease: %s", job_id, e)
+
+
+def _acordar_dispatcher():
+    if _dispatcher_acordar is not None:
+        _dispatcher_acordar.set()
+
+
+async def despachar_cotacao_jobs_once() -> int:
+    """Inicia jobs na fila (ou com lease vencido) até preencher as vagas desta instância."""
+    iniciados = 0
+    for tipo, iniciar in (("preview", _start_preview_job), ("tabela_prazos", _start_tabela_prazos_job)):
+        vagas = min(
+            COTACAO_JOBS_POR_INSTANCIA[tipo] - len(_running_por_tipo[tipo]),
+            MAX_RUNNING_COTACAO_JOBS - len(_running_job_ids),
+        )
+        for job_id in await candidatos(db, tipo, vagas, ignorar=set(_running_job_ids)):
+            if iniciar(job_id):
+                iniciados += 1
+    return iniciados
+
+
+async def _cotacao_dispatcher_loop(interval_seconds: int):
+    while True:
+        _dispatcher_acordar.clear()
+        try:
+            await despachar_cotacao_jobs_once()
+        except Exception:
+            logger.exception("[COTACAO_DISPATCH] falha ao despachar jobs")
+        try:
+            await asyncio.wait_for(_dispatcher_acordar.wait(), timeout=interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_cotacao_dispatcher():
+    global _dispatcher_task, _dispatcher_acordar
+    if COTACAO_DISPATCH_INTERVAL_SECONDS <= 0:
+        logger.info("[COTACAO_DISPATCH] desativado por configuracao")
         return None
-    _running_job_ids.add(job_id)
-    task = asyncio.create_task(_processar_preview_job(job_id))
-    _track_background_task(task, job_id=job_id)
-    return task
+    if _dispatcher_task and not _dispatcher_task.done():
+        return _dispatcher_task
+    _dispatcher_acordar = asyncio.Event()
+    _dispatcher_task = asyncio.create_task(_cotacao_dispatcher_loop(COTACAO_DISPATCH_INTERVAL_SECONDS))
+    _track_background_task(_dispatcher_task)
+    logger.info(
+        "[COTACAO_DISPATCH] vagas por instância: %s",
+        COTACAO_JOBS_POR_INSTANCIA,
+    )
+    return _dispatcher_task
 
 
 async def _preview_ativo_do_usuario(uid: str):
@@ -505,10 +978,12 @@ async def _preview_ativo_do_usuario(uid: str):
 
 
 async def resume_cotacao_jobs():
-    """Devolve jobs incompletos para a fila após restart."""
+    """Devolve para a fila jobs incompletos sem lease válido (a instância dona caiu)."""
     now = datetime.now(timezone.utc)
     async for job in db.cotacao_jobs.find({"status": {"$in": ["queued", "processing"]}}):
         job_id = job["_id"]
+        if job.get("status") == "processing" and not lease_expirado(job, now):
+            continue
         created_at = _utc_datetime(job.get("created_at", now))
         age = (now - created_at).total_seconds()
         if age > 15 * 60:
@@ -525,7 +1000,7 @@ async def resume_cotacao_jobs():
             continue
         await db.cotacao_jobs.update_one(
             {"_id": job_id},
-            {"$set": {"status": "queued"}, "$unset": {"started_at": ""}},
+            {"$set": {"status": "queued"}, "$unset": {"started_at": "", "lease_owner": "", "lease_until": ""}},
         )
         logger.info("[Job %s] Recolocado na fila após restart", job_id)
 
@@ -586,10 +1061,14 @@ async def upload_tabela(
     tmp.close()
 
     try:
-        prazos_disponiveis = detectar_prazos_disponiveis(tmp.name)
-        prazo_padrao = prazos_disponiveis[-1]  # maior prazo como padrão
-        precos_dict, precos_lista = ler_tabela_mestre(tmp.name, prazo=prazo_padrao)
-        qtd = len(precos_lista)
+        # Maior prazo como padrão
+        (prazos_disponiveis, prazo_padrao, tabela_prazos), _ = await executar(tarefa_compilar_tabela, tmp.name)
+        indice_padrao = selecionar_prazo(tabela_prazos, prazo_padrao)
+        qtd = len(indice_padrao["precos_nome_lista"])
+    except ExecutorOcupado:
+        os.unlink(tmp.name)
+        await bucket.delete(grid_id)
+        raise HTTPException(503, COTACAO_OCUPADO_MSG)
     except Exception as e:
         os.unlink(tmp.name)
         await bucket.delete(grid_id)
@@ -606,6 +1085,7 @@ async def upload_tabela(
         "filename": filename,
         "ext": _excel_suffix(filename),
         "grid_id": grid_id,
+        "conteudo_sha256": await asyncio.to_thread(hash_conteudo, conteudo),
         "prazo": prazo_padrao,
         "prazos_disponiveis": prazos_disponiveis,
         "prazos_deteccao_versao": PRAZOS_DETECCAO_VERSAO,
@@ -613,6 +1093,14 @@ async def upload_tabela(
         "data_upload": datetime.now(timezone.utc),
     }
     result = await collection.insert_one(doc)
+    _invalidar_cache_tabela(result.inserted_id)
+    _indice_cache_put(_indice_cache_key(doc, prazo_padrao), indice_padrao)
+
+    # Índice de todos os prazos compilado já na subida, da mesma leitura.
+    try:
+        await salvar_indice(db, bucket, doc, tabela_prazos)
+    except Exception as e:
+        logger.warning("[TABELA_INDICE] falha ao gravar indice no upload: %s", type(e).__name__)
 
     return {
         "id": str(result.inserted_id),
@@ -652,16 +1140,17 @@ async def listar_tabelas(credentials: HTTPAuthorizationCredentials = Depends(sec
                 tmp_path = tmp.name
                 updates = {}
                 if prazos_precisam_reindexar or not prazos_disponiveis:
-                    prazos_disponiveis = await asyncio.to_thread(detectar_prazos_disponiveis, tmp_path)
+                    prazos_disponiveis, _ = await executar(detectar_prazos_disponiveis, tmp_path, limitar=False)
                     updates.update({
                         "prazos_disponiveis": prazos_disponiveis,
                         "prazos_deteccao_versao": PRAZOS_DETECCAO_VERSAO,
                     })
                 if qtd_produtos <= 0:
-                    _, precos_lista = await asyncio.to_thread(
+                    (_, precos_lista), _ = await executar(
                         ler_tabela_mestre,
                         tmp_path,
                         prazo=prazo,
+                        limitar=False,
                     )
                     qtd_produtos = len(precos_lista)
                     if qtd_produtos > 0:
@@ -703,6 +1192,7 @@ async def renomear_tabela(
     )
     if result.matched_count == 0:
         raise HTTPException(404, "Tabela não encontrada")
+    _invalidar_cache_tabela(oid)
     return {"ok": True}
 
 
@@ -834,9 +1324,6 @@ async def preview_cotacao(
     Executa matching e retorna JSON com resultados para revisão.
     Não gera Excel — salva sessão no MongoDB para uso posterior pelo /confirmar.
     """
-    from services.excel_processor import ler_cotacao
-    from services.matching_engine import processar_cotacao_com_ia
-
     uid = await get_user_id(credentials)
     oid = _object_id_or_400(tabela_id)
     modo = str(modo or "ean").strip().lower()
@@ -867,65 +1354,50 @@ async def preview_cotacao(
         max_bytes=MAX_COTACAO_PREVIEW_BYTES,
     )
 
-    grid_out = await _bucket().open_download_stream(doc["grid_id"])
-    conteudo_mestre = await grid_out.read()
-
-    tmp_mestre = tempfile.NamedTemporaryFile(delete=False, suffix=_tabela_suffix(doc))
-    tmp_mestre.write(conteudo_mestre)
-    tmp_mestre.close()
-
     tmp_cotacao = tempfile.NamedTemporaryFile(delete=False, suffix=_excel_suffix(filename))
     tmp_cotacao.write(conteudo_cotacao)
     tmp_cotacao.close()
 
     try:
         prazo_efetivo = prazo if prazo > 0 else doc.get("prazo", 28)
-
-        def _processar_sync():
-            pd, pl = ler_tabela_mestre(tmp_mestre.name, prazo=prazo_efetivo)
-            its, _ = ler_cotacao(tmp_cotacao.name, coluna_preco=coluna_preco)
-            res = processar_cotacao_com_ia(its, pd, pl, modo=modo)
-            return pd, pl, its, res
-
-        precos_dict, precos_lista, itens, resultados = await asyncio.to_thread(_processar_sync)
-
-        if modo != "ean":
-            # Sobrescrever matches com dados aprendidos do usuário (uma query batched)
-            nomes_norm = [normalizar_nome(item["nome"]) for item in itens]
-            cursor = db.cotacao_aprendizado.find(_aprendizado_query(uid, tabela_id, nomes_norm))
-            aprendizado_map = {doc["produto_cotacao_norm"]: doc async for doc in cursor}
-
-            for i, item in enumerate(itens):
-                learned = aprendizado_map.get(normalizar_nome(item["nome"]))
-                if learned:
-                    resultados[i]["preco"] = learned["preco"]
-                    resultados[i]["tipo"] = "APRENDIDO"
+        indice = await _carregar_indice(doc, prazo_efetivo)
+        (itens, _), _ = await executar(tarefa_ler_cotacao, tmp_cotacao.name, coluna_preco)
+        resultados, _ = await _casar_com_aprendizado(
+            uid,
+            tabela_id,
+            indice,
+            await _indice_para_tarefa(doc, prazo_efetivo, indice),
+            itens,
+            modo,
+            {},
+            cache=(hash_tabela(doc), prazo_efetivo),
+        )
 
         preview_items = _resultados_para_preview(itens, resultados)
 
         # Salvar sessão para uso pelo /confirmar
         session_id = str(uuid.uuid4())
-        await db.cotacao_sessoes.insert_one({
-            "_id": session_id,
-            "user_id": uid,
-            "tabela_id": tabela_id,
-            "prazo": prazo_efetivo,
-            "cotacao_suffix": _excel_suffix(filename),
-            "cotacao_bytes": conteudo_cotacao,
-            "itens": itens,
-            "resultados": resultados,
-            "created_at": datetime.now(timezone.utc),
-        })
+        await _salvar_sessao_cotacao(
+            session_id,
+            uid,
+            conteudo_cotacao,
+            _excel_suffix(filename),
+            itens,
+            resultados,
+            tabela_id=tabela_id,
+            prazo=prazo_efetivo,
+        )
 
+    except ExecutorOcupado:
+        raise HTTPException(503, COTACAO_OCUPADO_MSG)
     except Exception as e:
         logger.error(f"Erro no preview: {e}")
         raise HTTPException(500, f"Erro ao processar: {str(e)}")
     finally:
-        for p in [tmp_mestre.name, tmp_cotacao.name]:
-            try:
-                os.unlink(p)
-            except OSError:
-                pass
+        try:
+            os.unlink(tmp_cotacao.name)
+        except OSError:
+            pass
 
     return {"session_id": session_id, "itens": preview_items}
 
@@ -1043,21 +1515,14 @@ async def _preview_job_foi_cancelado(job_id):
 
 
 async def _processar_preview_job(job_id):
-    from services.excel_processor import ler_cotacao
-    from services.matching_engine import processar_cotacao_com_ia
+    await _executar_com_lease(job_id, "preview", _executar_preview_job)
+
 
-    tmp_mestre = None
+async def _executar_preview_job(job):
+    job_id = job["_id"]
     tmp_cotacao = None
+    metricas = {}
     try:
-        job = await db.cotacao_jobs.find_one({"_id": job_id})
-        if not job or job.get("type") != "preview":
-            return
-
-        await db.cotacao_jobs.update_one(
-            {"_id": job_id},
-            {"$set": {"status": "processing", "started_at": datetime.now(timezone.utc)}},
-        )
-
         doc = await db.tabelas_mestre.find_one({
             "_id": ObjectId(job["tabela_id"]),
             "user_id": job["user_id"],
@@ -1065,69 +1530,89 @@ async def _processar_preview_job(job_id):
         if not doc:
             raise ValueError("Tabela mestre não encontrada")
 
-        grid_out = await _bucket().open_download_stream(doc["grid_id"])
-        conteudo_mestre = await grid_out.read()
-
-        cotacao_out = await _bucket().open_download_stream(job["input_grid_id"])
-        conteudo_cotacao = await cotacao_out.read()
+        with _etapa(metricas, "download_gridfs"):
+            cotacao_out = await _bucket().open_download_stream(job["input_grid_id"])
+            conteudo_cotacao = await cotacao_out.read()
 
-        tmp_mestre = tempfile.NamedTemporaryFile(delete=False, suffix=_tabela_suffix(doc))
-        tmp_mestre.write(conteudo_mestre)
-        tmp_mestre.close()
-
-        tmp_cotacao = tempfile.NamedTemporaryFile(delete=False, suffix=job.get("input_suffix", ".xlsx"))
-        tmp_cotacao.write(conteudo_cotacao)
-        tmp_cotacao.close()
+        with _etapa(metricas, "escrita_temp"):
+            tmp_cotacao = tempfile.NamedTemporaryFile(delete=False, suffix=job.get("input_suffix", ".xlsx"))
+            tmp_cotacao.write(conteudo_cotacao)
+            tmp_cotacao.close()
 
         prazo_efetivo = job.get("prazo") if job.get("prazo", 0) > 0 else doc.get("prazo", 28)
         modo = str(job.get("modo", "ean") or "ean").strip().lower()
+        with _etapa(metricas, "tabela_mestre"):
+            indice = await _carregar_indice(doc, prazo_efetivo)
+            indice_tarefa = await _indice_para_tarefa(doc, prazo_efetivo, indice)
+
+        async def _progresso(partes_prontas, total_partes, itens_prontos, total_itens):
+            progress = {
+                "stage": "matching",
+                "chunks_done": partes_prontas,
+                "total_chunks": total_partes,
+                "rows": itens_prontos,
+                "total_rows": total_itens,
+            }
+            publicar_evento_job(job_id, {"status": "processing", "progress": progress})
+            await db.cotacao_jobs.update_one(
+                {"_id": job_id},
+                {"$set": {
+                    "progress": progress,
+                    "progress_updated_at": datetime.now(timezone.utc),
+                }},
+            )
 
-        def _processar_sync():
-            pd, pl = ler_tabela_mestre(tmp_mestre.name, prazo=prazo_efetivo)
-            its, _ = ler_cotacao(tmp_cotacao.name, coluna_preco=job.get("coluna_preco"))
-            res = processar_cotacao_com_ia(its, pd, pl, modo=modo)
-            return its, res
+        async def _ler_e_casar():
+            # Jobs já são limitados por MAX_RUNNING_COTACAO_JOBS: não disputam a fila.
+            (itens_job, metricas_leitura), cpu_s = await executar(
+                tarefa_ler_cotacao, tmp_cotacao.name, job.get("coluna_preco"), limitar=False
+            )
+            _mesclar_metricas(metricas, metricas_leitura, cpu_s)
+            resultados_job, _ = await _casar_com_aprendizado(
+                job["user_id"],
+                job["tabela_id"],
+                indice,
+                indice_tarefa,
+                itens_job,
+                modo,
+                metricas,
+                cache=(hash_tabela(doc), prazo_efetivo),
+                progresso=_progresso,
+                limitar=False,
+            )
+            return itens_job, resultados_job
 
-        itens, resultados = await asyncio.wait_for(
-            asyncio.to_thread(_processar_sync),
-            timeout=540,
-        )
+        itens, resultados = await asyncio.wait_for(_ler_e_casar(), timeout=540)
 
         if await _preview_job_foi_cancelado(job_id):
             await _cleanup_job_input(job)
             await db.cotacao_jobs.delete_one({"_id": job_id})
             return
 
-        if modo != "ean":
-            nomes_norm = [normalizar_nome(item["nome"]) for item in itens]
-            cursor = db.cotacao_aprendizado.find(_aprendizado_query(job["user_id"], job["tabela_id"], nomes_norm))
-            aprendizado_map = {doc["produto_cotacao_norm"]: doc async for doc in cursor}
-
-            for i, item in enumerate(itens):
-                learned = aprendizado_map.get(normalizar_nome(item["nome"]))
-                if learned:
-                    resultados[i]["preco"] = learned["preco"]
-                    resultados[i]["tipo"] = "APRENDIDO"
+        session_id = str(uuid.uuid4())
+        with _etapa(metricas, "sessao"):
+            await _salvar_sessao_cotacao(
+                session_id,
+                job["user_id"],
+                conteudo_cotacao,
+                job.get("input_suffix", ".xlsx"),
+                itens,
+                resultados,
+                tabela_id=job["tabela_id"],
+                prazo=prazo_efetivo,
+                modo=modo,
+            )
 
-        if await _preview_job_foi_cancelado(job_id):
-            await _cleanup_job_input(job)
-            await db.cotacao_jobs.delete_one({"_id": job_id})
+        # Só quem ainda tem o lease conclui o job; senão outra instância o refaz
+        concluido = await db.cotacao_jobs.update_one(
+            {"_id": job_id, "lease_owner": INSTANCIA_ID},
+            {"$set": {"status": "done", "active": False, "session_id": session_id, "metricas": metricas}},
+        )
+        if not concluido.matched_count:
+            logger.warning("[Job %s] Lease perdido; resultado descartado", job_id)
+            await db.cotacao_sessoes.delete_one({"_id": session_id})
             return
-
-        preview_items = _resultados_para_preview(itens, resultados)
-        session_id = str(uuid.uuid4())
-        await db.cotacao_sessoes.insert_one({
-            "_id": session_id,
-            "user_id": job["user_id"],
-            "tabela_id": job["tabela_id"],
-            "prazo": prazo_efetivo,
-            "modo": modo,
-            "cotacao_suffix": job.get("input_suffix", ".xlsx"),
-            "cotacao_bytes": conteudo_cotacao,
-            "itens": itens,
-            "resultados": resultados,
-            "created_at": datetime.now(timezone.utc),
-        })
+        await _cleanup_job_input(job)
 
         stats = _stats_resultados(itens, resultados)
         await audit_event(
@@ -1143,39 +1628,81 @@ async def _processar_preview_job(job_id):
                 job_id=job_id,
                 stats=stats,
                 diagnostics=_cotacao_diagnostics(itens, resultados),
+                metricas=metricas,
             ),
         )
-
-        await _cleanup_job_input(job)
-        await db.cotacao_jobs.update_one(
-            {"_id": job_id},
-            {"$set": {"status": "done", "active": False, "session_id": session_id, "itens": preview_items}},
-        )
     except asyncio.TimeoutError:
         if await _preview_job_foi_cancelado(job_id):
             return
+        # wait_for só descarta as partes ainda na fila do pool de processos; as
+        # que já estão rodando vão até o fim. Grava o que já foi medido.
         await db.cotacao_jobs.update_one(
-            {"_id": job_id},
-            {"$set": {"status": "error", "active": False, "error": "Processamento demorou demais. Tente novamente com uma cotação menor ou em modo rápido."}},
+            {"_id": job_id, "lease_owner": INSTANCIA_ID},
+            {"$set": {"status": "error", "active": False, "error": "Processamento demorou demais. Tente novamente com uma cotação menor ou em modo rápido.", "metricas": dict(metricas)}},
         )
     except Exception as e:
         if await _preview_job_foi_cancelado(job_id):
             return
         logger.error(f"Erro no preview async (job {job_id}): {e}")
         await db.cotacao_jobs.update_one(
-            {"_id": job_id},
-            {"$set": {"status": "error", "active": False, "error": f"Erro ao processar: {str(e)}"}},
+            {"_id": job_id, "lease_owner": INSTANCIA_ID},
+            {"$set": {"status": "error", "active": False, "error": f"Erro ao processar: {str(e)}", "metricas": dict(metricas)}},
         )
     finally:
-        for tmp in [tmp_mestre, tmp_cotacao]:
-            if not tmp:
-                continue
+        if tmp_cotacao:
             try:
-                os.unlink(tmp.name)
+                os.unlink(tmp_cotacao.name)
             except OSError:
                 pass
 
 
+async def _stream_eventos_job(job_id: str, verificar, finalizar=None):
+    """
+    Gera o SSE de um job: eventos ``progress`` enquanto processa e um único
+    evento final (``done`` ou ``error``). ``verificar()`` lê o estado no Mongo
+    sem alterá-lo e só é chamado no início, no fim e quando nada chega pela
+    instância. ``finalizar(evento)`` limpa o job depois que o evento final foi
+    entregue; se a conexão cai antes, o job fica para o polling.
+    """
+    prazo = time.monotonic() + COTACAO_SSE_MAX_SECONDS
+    ultimo_progresso = None
+    with assinar_eventos_job(job_id) as fila:
+        evento = await verificar()
+        while True:
+            if evento.get("status") != "processing":
+                yield formatar_sse(evento, evento.get("status"))
+                if finalizar is not None:
+                    await finalizar(evento)
+                return
+            progresso = evento.get("progress")
+            if progresso and progresso != ultimo_progresso:
+                ultimo_progresso = progresso
+                yield formatar_sse(evento, "progress")
+
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                yield formatar_sse({"status": "processing"}, "timeout")
+                return
+            # Job desta instância publica o fim; a releitura é só salvaguarda
+            espera = COTACAO_SSE_VERIFICACAO_SECONDS * (6 if job_id in _running_job_ids else 1)
+            try:
+                evento = await asyncio.wait_for(fila.get(), timeout=min(espera, restante))
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                evento = await verificar()
+                continue
+            if evento.get("status") != "processing":
+                evento = await verificar()
+
+
+def _resposta_sse(eventos):
+    return StreamingResponse(
+        eventos,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 async def _get_preview_job_status_for_user(job_id: str, uid: str):
     job = await db.cotacao_jobs.find_one({"_id": job_id, "user_id": uid, "type": "preview"})
     if not job:
@@ -1188,11 +1715,7 @@ async def _get_preview_job_status_for_user(job_id: str, uid: str):
     if job["status"] == "processing":
         started_at = _utc_datetime(job.get("started_at") or job.get("created_at"))
         age = (datetime.now(timezone.utc) - started_at).total_seconds()
-        if job_id not in _running_job_ids and age > 15:
-            await db.cotacao_jobs.update_one(
-                {"_id": job_id},
-                {"$set": {"status": "queued"}, "$unset": {"started_at": ""}},
-            )
+        if lease_expirado(job) and age > 15:
             _start_preview_job(job_id)
         elif age > 540:
             await db.cotacao_jobs.update_one(
@@ -1200,7 +1723,7 @@ async def _get_preview_job_status_for_user(job_id: str, uid: str):
                 {"$set": {"status": "error", "active": False, "error": "Processamento demorou demais. Tente novamente com uma cotação menor ou em modo rápido."}},
             )
             raise HTTPException(500, "Processamento demorou demais. Tente novamente com uma cotação menor ou em modo rápido.")
-        return {"status": "processing"}
+        return {"status": "processing", "progress": job.get("progress")}
 
     if job["status"] == "error":
         await _cleanup_job_input(job)
@@ -1212,9 +1735,47 @@ async def _get_preview_job_status_for_user(job_id: str, uid: str):
         await db.cotacao_jobs.delete_one({"_id": job_id})
         raise HTTPException(499, "Processamento cancelado")
 
-    result = {"session_id": job["session_id"], "itens": job["itens"]}
+    itens_preview = await _itens_preview_do_job(job, uid)
+    await db.cotacao_jobs.delete_one({"_id": job_id})
+    if itens_preview is None:
+        raise HTTPException(404, SESSAO_EXPIRADA_MSG)
+    return {"session_id": job["session_id"], "itens": itens_preview}
+
+
+async def _itens_preview_do_job(job, uid):
+    # O job só referencia a sessão; os itens do preview saem de lá
+    if job.get("itens") is not None:
+        return job["itens"]
+    _, itens, resultados = await _carregar_sessao_cotacao(job["session_id"], uid)
+    if itens is None:
+        return None
+    return _resultados_para_preview(itens, resultados)
+
+
+async def _evento_preview_job(job_id: str, uid: str) -> dict:
+    """Estado do preview para o SSE, só lendo; a limpeza fica para depois do evento final."""
+    job = await db.cotacao_jobs.find_one({"_id": job_id, "user_id": uid, "type": "preview"})
+    if not job:
+        return {"status": "error", "code": 404, "detail": "Job não encontrado"}
+    if job["status"] in ("queued", "processing"):
+        return {"status": "processing", "progress": job.get("progress")}
+    if job["status"] == "error":
+        return {"status": "error", "code": 500, "detail": job.get("error", "Erro ao processar cotação")}
+    if job["status"] == "canceled":
+        return {"status": "error", "code": 499, "detail": "Processamento cancelado"}
+    itens_preview = await _itens_preview_do_job(job, uid)
+    if itens_preview is None:
+        return {"status": "error", "code": 404, "detail": SESSAO_EXPIRADA_MSG}
+    return {"status": "done", "session_id": job["session_id"], "itens": itens_preview}
+
+
+async def _finalizar_preview_job(job_id: str, uid: str):
+    job = await db.cotacao_jobs.find_one({"_id": job_id, "user_id": uid, "type": "preview"})
+    if not job or job["status"] in ("queued", "processing"):
+        return
+    if job["status"] != "done":
+        await _cleanup_job_input(job)
     await db.cotacao_jobs.delete_one({"_id": job_id})
-    return result
 
 
 @router.get("/preview-jobs/{job_id}")
@@ -1236,6 +1797,23 @@ async def get_preview_job_status_simple(
     return await _get_preview_job_status_for_user(job_id, uid)
 
 
+@router.get("/preview-jobs/{job_id}/events")
+async def get_preview_job_events(
+    job_id: str,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
+    """SSE do preview; o evento ``done`` traz ``session_id`` e ``itens`` uma única vez."""
+    uid = await get_user_id(credentials)
+
+    async def _verificar():
+        return await _evento_preview_job(job_id, uid)
+
+    async def _finalizar(_evento):
+        await _finalizar_preview_job(job_id, uid)
+
+    return _resposta_sse(_stream_eventos_job(job_id, _verificar, _finalizar))
+
+
 async def _cancelar_preview_job_for_user(job_id: str, uid: str):
     job = await db.cotacao_jobs.find_one({"_id": job_id, "user_id": uid, "type": "preview"})
     if not job:
@@ -1252,6 +1830,7 @@ async def _cancelar_preview_job_for_user(job_id: str, uid: str):
     else:
         await db.cotacao_jobs.delete_one({"_id": job_id, "user_id": uid, "type": "preview"})
         _running_job_ids.discard(job_id)
+    publicar_evento_job(job_id, {"status": "canceled"})
 
     return {"status": "canceled"}
 
@@ -1283,9 +1862,12 @@ async def gerar_tabela_prazos(
     pct_28: float = Form(0.0),
     pct_35: float = Form(0.0),
     pct_42: float = Form(0.0),
+    formato: str = Form("xlsx"),
     credentials: HTTPAuthorizationCredentials = Depends(security),
 ):
     uid = await get_user_id(credentials)
+    if formato not in TABELA_PRAZOS_SAIDAS:
+        raise HTTPException(400, "Formato de saída inválido. Use xlsx ou csv.")
 
     conteudo = await arquivo.read()
     filename = validate_upload(
@@ -1322,6 +1904,7 @@ async def gerar_tabela_prazos(
             "35": pct_35,
             "42": pct_42,
         },
+        "formato": formato,
     })
 
     _start_tabela_prazos_job(job_id)
@@ -1329,33 +1912,25 @@ async def gerar_tabela_prazos(
 
 
 async def _processar_tabela_prazos(job_id):
-    try:
-        job = await db.cotacao_jobs.find_one({"_id": job_id})
-        if not job:
-            logger.warning("[Job %s] Job não encontrado para processamento", job_id)
-            return
+    await _executar_com_lease(job_id, "tabela_prazos", _gerar_tabela_prazos_do_job)
+
 
+async def _gerar_tabela_prazos_do_job(job):
+    job_id = job["_id"]
+    try:
         grid_out = await _bucket().open_download_stream(job["input_grid_id"])
         conteudo = await grid_out.read()
         ext = job.get("ext", ".xlsx")
         prazos_raw = job.get("prazos") or {}
         prazos = {int(k): float(v or 0) for k, v in prazos_raw.items()}
-
-        await db.cotacao_jobs.update_one(
-            {"_id": job_id},
-            {"$set": {"status": "processing", "started_at": datetime.now(timezone.utc)}},
-        )
-
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
-        tmp.write(conteudo)
-        tmp.close()
-
-        logger.info(f"[Job {job_id}] Iniciando processamento ({ext}, {len(conteudo)} bytes)")
+        formato = job.get("formato") or "xlsx"
+        nome_saida, content_type_saida = TABELA_PRAZOS_SAIDAS[formato]
 
         loop = asyncio.get_running_loop()
 
         def _progress_threadsafe(update):
             async def _write_progress():
+                publicar_evento_job(job_id, {"status": "processing", "progress": update})
                 await db.cotacao_jobs.update_one(
                     {"_id": job_id},
                     {"$set": {
@@ -1369,19 +1944,40 @@ async def _processar_tabela_prazos(job_id):
             except RuntimeError as e:
                 logger.warning("[Job %s] Falha ao agendar progresso: %s", job_id, e)
 
-        if ext == ".pdf":
-            _progress_threadsafe({"stage": "extracting_pdf_text", "rows": 0})
-            resultado_path = await asyncio.to_thread(
-                _gerar_excel_multiprazos_pdf_isolado,
-                tmp.name,
-                prazos,
-                150,
-            )
+        # Mesmo arquivo com outros percentuais: a extração não muda
+        sha256 = await asyncio.to_thread(hash_conteudo, conteudo)
+        try:
+            rows_data = await buscar_linhas_base(db, sha256)
+        except Exception as e:
+            logger.warning("[Job %s] Cache de extração indisponível: %s", job_id, e)
+            rows_data = None
+
+        if rows_data is not None:
+            logger.info(f"[Job {job_id}] Extração reaproveitada do cache ({len(rows_data)} produtos)")
         else:
-            resultado_path = await asyncio.wait_for(
-                asyncio.to_thread(gerar_excel_multiprazos, tmp.name, prazos, _progress_threadsafe),
-                timeout=540,
-            )
+            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
+            tmp.write(conteudo)
+            tmp.close()
+
+            logger.info(f"[Job {job_id}] Iniciando processamento ({ext}, {len(conteudo)} bytes)")
+
+            if ext == ".pdf":
+                _progress_threadsafe({"stage": "extracting_pdf_text", "rows": 0})
+                rows_data = await asyncio.to_thread(
+                    _extrair_linhas_pdf_isolado, tmp.name, 150, _progress_threadsafe
+                )
+            else:
+                rows_data = await asyncio.wait_for(
+                    asyncio.to_thread(extrair_linhas_base, tmp.name, _progress_threadsafe),
+                    timeout=540,
+                )
+            try:
+                await guardar_linhas_base(db, sha256, rows_data)
+            except Exception as e:
+                logger.warning("[Job %s] Falha ao gravar cache de extração: %s", job_id, e)
+
+        _progress_threadsafe({"stage": "writing_excel", "rows": len(rows_data)})
+        resultado_path = await asyncio.to_thread(gerar_excel_de_dados, rows_data, prazos, formato)
 
         latest_job = await db.cotacao_jobs.find_one({"_id": job_id})
         if not latest_job or latest_job.get("status") == "canceled":
@@ -1402,25 +1998,28 @@ async def _processar_tabela_prazos(job_id):
         bucket = _bucket()
         grid_id = await _upload_grid_file(
             bucket,
-            "tabela_com_prazos.xlsx",
+            nome_saida,
             resultado_bytes,
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            content_type_saida,
         )
 
-        await db.cotacao_jobs.update_one(
-            {"_id": job_id},
+        concluido = await db.cotacao_jobs.update_one(
+            {"_id": job_id, "lease_owner": INSTANCIA_ID},
             {"$set": {"status": "done", "grid_id": grid_id}},
         )
+        if not concluido.matched_count:
+            logger.warning("[Job %s] Lease perdido; resultado descartado", job_id)
+            await _delete_grid_file(grid_id)
     except asyncio.TimeoutError:
         logger.error(f"[Job {job_id}] Timeout ao gerar tabela de prazos")
         await db.cotacao_jobs.update_one(
-            {"_id": job_id},
+            {"_id": job_id, "lease_owner": INSTANCIA_ID},
             {"$set": {"status": "error", "error": "Processamento demorou demais. Esse PDF travou a leitura no servidor; converta para Excel (.xlsx) ou use um PDF menor."}},
         )
     except Exception as e:
         logger.error(f"Erro ao gerar tabela (job {job_id}): {e}")
         await db.cotacao_jobs.update_one(
-            {"_id": job_id},
+            {"_id": job_id, "lease_owner": INSTANCIA_ID},
             {"$set": {"status": "error", "error": str(e)}},
         )
     finally:
@@ -1430,16 +2029,9 @@ async def _processar_tabela_prazos(job_id):
             pass
 
 
-@router.get("/jobs/{job_id}")
-async def get_job_status(
-    job_id: str,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-):
-    uid = await get_user_id(credentials)
-    job = await db.cotacao_jobs.find_one({"_id": job_id, "user_id": uid})
-    if not job:
-        raise HTTPException(404, "Job não encontrado")
-
+async def _status_job_tabela(job: dict):
+    """Trata os estados não concluídos do job de tabela de prazos; None quando está pronto."""
+    job_id = job["_id"]
     if job["status"] == "queued":
         _start_tabela_prazos_job(job_id)
         return {"status": "processing"}
@@ -1447,11 +2039,7 @@ async def get_job_status(
     if job["status"] == "processing":
         age_base = _utc_datetime(job.get("started_at") or job["created_at"])
         age = (datetime.now(timezone.utc) - age_base).total_seconds()
-        if job_id not in _running_job_ids and age > 15:
-            await db.cotacao_jobs.update_one(
-                {"_id": job_id},
-                {"$set": {"status": "queued"}, "$unset": {"started_at": ""}},
-            )
+        if lease_expirado(job) and age > 15:
             _start_tabela_prazos_job(job_id)
             return {"status": "processing"}
         max_age = 210 if job.get("ext") == ".pdf" else 480
@@ -1473,6 +2061,26 @@ async def get_job_status(
         await db.cotacao_jobs.delete_one({"_id": job_id})
         raise HTTPException(500, job.get("error", "Erro ao processar tabela"))
 
+    if job["status"] == "canceled":
+        raise HTTPException(499, "Processamento cancelado")
+
+    return None
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
+    uid = await get_user_id(credentials)
+    job = await db.cotacao_jobs.find_one({"_id": job_id, "user_id": uid})
+    if not job:
+        raise HTTPException(404, "Job não encontrado")
+
+    status = await _status_job_tabela(job)
+    if status is not None:
+        return status
+
     # Done — stream result from GridFS
     grid_id = job["grid_id"]
     grid_out = await _bucket().open_download_stream(grid_id)
@@ -1491,13 +2099,46 @@ async def get_job_status(
             pass
     await db.cotacao_jobs.delete_one({"_id": job_id})
 
+    nome_saida, content_type_saida = TABELA_PRAZOS_SAIDAS[job.get("formato") or "xlsx"]
     return Response(
         content=resultado_bytes,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=tabela_com_prazos.xlsx"},
+        media_type=content_type_saida,
+        headers={"Content-Disposition": f"attachment; filename={nome_saida}"},
     )
 
 
+@router.get("/jobs/{job_id}/events")
+async def get_job_events(
+    job_id: str,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
+    """SSE do job de tabela de prazos; no evento ``done`` o arquivo é baixado em ``GET /jobs/{job_id}``."""
+    uid = await get_user_id(credentials)
+
+    async def _verificar():
+        # Só lê: o arquivo sai (e o job é apagado) no GET /jobs/{job_id}
+        job = await db.cotacao_jobs.find_one({"_id": job_id, "user_id": uid})
+        if not job:
+            return {"status": "error", "code": 404, "detail": "Job não encontrado"}
+        if job["status"] in ("queued", "processing"):
+            return {"status": "processing", "progress": job.get("progress")}
+        if job["status"] == "error":
+            return {"status": "error", "code": 500, "detail": job.get("error", "Erro ao processar tabela")}
+        if job["status"] == "canceled":
+            return {"status": "error", "code": 499, "detail": "Processamento cancelado"}
+        return {"status": "done", "formato": job.get("formato") or "xlsx"}
+
+    async def _finalizar(evento):
+        if evento.get("code") != 500:
+            return
+        job = await db.cotacao_jobs.find_one({"_id": job_id, "user_id": uid, "status": "error"})
+        if job:
+            await _cleanup_job_input(job)
+            await db.cotacao_jobs.delete_one({"_id": job_id})
+
+    return _resposta_sse(_stream_eventos_job(job_id, _verificar, _finalizar))
+
+
 @router.delete("/jobs/{job_id}")
 async def cancelar_job_tabela_prazos(
     job_id: str,
@@ -1519,6 +2160,7 @@ async def cancelar_job_tabela_prazos(
     else:
         await db.cotacao_jobs.delete_one({"_id": job_id, "user_id": uid})
         _running_job_ids.discard(job_id)
+    publicar_evento_job(job_id, {"status": "canceled"})
 
     return {"status": "canceled"}
 
@@ -1592,6 +2234,7 @@ async def _salvar_aprendizado_confirmacao(uid, tabela_id, itens, resultados, apr
         )
         if ops:
             await db.cotacao_aprendizado.bulk_write(ops, ordered=False)
+            _atualizar_cache_aprendizado(uid, tabela_id, itens, resultados, aprovacoes)
     except Exception as e:
         logger.error(f"Erro ao salvar aprendizado em segundo plano: {e}")
 
@@ -1607,13 +2250,9 @@ async def confirmar_cotacao(
     """
     uid = await get_user_id(credentials)
 
-    sessao = await db.cotacao_sessoes.find_one({"_id": payload.session_id, "user_id": uid})
+    sessao, itens, resultados = await _carregar_sessao_cotacao(payload.session_id, uid)
     if not sessao:
-        raise HTTPException(404, "Sessão expirada ou não encontrada. Processe a cotação novamente.")
-
-    itens = sessao["itens"]
-    resultados = sessao["resultados"]
-    cotacao_bytes = sessao["cotacao_bytes"]
+        raise HTTPException(404, SESSAO_EXPIRADA_MSG)
 
     if len(payload.aprovacoes) != len(itens):
         raise HTTPException(400, "Número de aprovações não corresponde ao número de itens.")
@@ -1635,13 +2274,14 @@ async def confirmar_cotacao(
 
     try:
         tmp_cotacao = tempfile.NamedTemporaryFile(delete=False, suffix=sessao.get("cotacao_suffix", ".xlsx"))
-        tmp_cotacao.write(cotacao_bytes)
-        tmp_cotacao.close()
+        if sessao.get("cotacao_grid_id") is not None:
+            tmp_cotacao.close()
+            await baixar_blob_para_arquivo(_bucket(), sessao["cotacao_grid_id"], tmp_cotacao.name)
+        else:
+            tmp_cotacao.write(sessao["cotacao_bytes"])
+            tmp_cotacao.close()
 
         caminho_resultado = gerar_excel_resultado(tmp_cotacao.name, itens, resultados_filtrados)
-        with open(caminho_resultado, "rb") as f:
-            resultado_bytes = f.read()
-        os.unlink(caminho_resultado)
     except Exception as e:
         logger.error(f"Erro ao gerar Excel no confirmar: {e}")
         raise HTTPException(500, f"Erro ao gerar Excel: {str(e)}")
@@ -1693,14 +2333,16 @@ async def confirmar_cotacao(
         request=request,
     )
 
-    return Response(
-        content=resultado_bytes,
+    # Arquivo sai em streaming e é apagado depois do envio
+    return FileResponse(
+        caminho_resultado,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={
             "Content-Disposition": "attachment; filename=cotacao_preenchida.xlsx",
             "X-Stats": json.dumps(stats),
             "X-Sem-Match": json.dumps(sem_match[:50]),
-        }
+        },
+        background=BackgroundTask(os.unlink, caminho_resultado),
     )
 
 
@@ -1822,8 +2464,6 @@ async def match_cotatudo(
     Recebe itens extraídos do Cotatudo pela extensão Chrome,
     faz matching com a tabela mestre e retorna preços para preencher.
     """
-    from services.matching_engine import processar_cotacao_com_ia
-
     uid = await get_user_id(credentials)
     oid = _object_id_or_400(payload.tabela_id)
     modo = str(payload.modo or "ean").strip().lower()
@@ -1834,13 +2474,6 @@ async def match_cotatudo(
     audit_meta = _cotatudo_base_metadata(payload, doc)
     audit_meta["itensRecebidos"] = len(payload.itens)
 
-    grid_out = await _bucket().open_download_stream(doc["grid_id"])
-    conteudo_mestre = await grid_out.read()
-
-    tmp_mestre = tempfile.NamedTemporaryFile(delete=False, suffix=_tabela_suffix(doc))
-    tmp_mestre.write(conteudo_mestre)
-    tmp_mestre.close()
-
     try:
         prazo_efetivo = payload.prazo if payload.prazo > 0 else doc.get("prazo", 28)
         site = str(payload.site or "").strip()
@@ -1859,21 +2492,23 @@ async def match_cotatudo(
             )
             return {"precos": [], "mantidos": [], "stats": stats}
 
-        def _match_sync():
-            if usa_fracionamento:
-                pd, pl, meta_por_ean = ler_tabela_mestre(tmp_mestre.name, prazo=prazo_efetivo, incluir_meta=True)
-            else:
-                pd, pl = ler_tabela_mestre(tmp_mestre.name, prazo=prazo_efetivo)
-                meta_por_ean = {}
-            return pd, pl, meta_por_ean, processar_cotacao_com_ia(itens_para_match, pd, pl, modo=modo)
-
-        precos_dict, precos_lista, meta_por_ean, resultados = await asyncio.to_thread(_match_sync)
-
-        aprendizado_map = {}
-        if modo != "ean":
-            nomes_norm = [normalizar_nome(it["nome"]) for it in itens_para_match]
-            cursor = db.cotacao_aprendizado.find(_aprendizado_query(uid, payload.tabela_id, nomes_norm))
-            aprendizado_map = {d["produto_cotacao_norm"]: d async for d in cursor}
+        metricas = {}
+        with _etapa(metricas, "tabela_mestre"):
+            indice = await _carregar_indice(doc, prazo_efetivo)
+            indice_tarefa = await _indice_para_tarefa(doc, prazo_efetivo, indice)
+
+        with _etapa(metricas, "executor"):
+            resultados, meta_por_ean = await _casar_com_aprendizado(
+                uid,
+                payload.tabela_id,
+                indice,
+                indice_tarefa,
+                itens_para_match,
+                modo,
+                metricas,
+                com_meta=usa_fracionamento,
+                cache=(hash_tabela(doc), prazo_efetivo),
+            )
 
         precos = []
         mantidos = []
@@ -1883,11 +2518,6 @@ async def match_cotatudo(
 
         for i, item in enumerate(itens_para_match):
             res = resultados[i]
-            if modo != "ean":
-                learned = aprendizado_map.get(normalizar_nome(item["nome"]))
-                if learned:
-                    res["preco"] = learned["preco"]
-                    res["tipo"] = "APRENDIDO"
 
             if res.get("preco") is not None:
                 current_price = item.get("current_price")
@@ -1930,7 +2560,13 @@ async def match_cotatudo(
             "cotatudo_extension_match_completed",
             uid=uid,
             status="success",
-            metadata={**audit_meta, **stats, "precosRetornados": len(precos), "diagnostics": diagnostics},
+            metadata={
+                **audit_meta,
+                **stats,
+                **_metricas_audit_metadata(metricas),
+                "precosRetornados": len(precos),
+                "diagnostics": diagnostics,
+            },
             request=request,
         )
 
@@ -1941,6 +2577,15 @@ async def match_cotatudo(
             "stats": stats,
         }
 
+    except ExecutorOcupado:
+        await audit_event(
+            "cotatudo_extension_match_failed",
+            uid=uid,
+            status="error",
+            metadata={**audit_meta, "error": "executor_ocupado", "errorType": "ExecutorOcupado"},
+            request=request,
+        )
+        raise HTTPException(503, COTACAO_OCUPADO_MSG)
     except Exception as e:
         logger.error(f"Erro no match-cotatudo: {e}")
         await audit_event(
@@ -1951,8 +2596,3 @@ async def match_cotatudo(
             request=request,
         )
         raise HTTPException(500, f"Erro ao processar: {str(e)}")
-    finally:
-        try:
-            os.unlink(tmp_mestre.name)
-        except OSError:
-            pass
@@ -11,7 +11,6 @@ import json
 import uuid
 import asyncio
 import logging
-import tempfile
 import unicodedata
 import requests
 import ipaddress
@@ -1514,7 +1513,7 @@ async def listar_tabelas_vitrine(uid: str = Depends(get_user_id)):
 
 @router.get("/tabelas/{tabela_id}/itens")
 async def listar_itens_tabela_vitrine(tabela_id: str, prazo: int = 7, uid: str = Depends(get_user_id)):
-    from services.excel_processor import ler_tabela_mestre
+    from services.tabela_indice import carregar_indice_tabela
 
     try:
         oid = ObjectId(tabela_id)
@@ -1529,23 +1528,12 @@ async def listar_itens_tabela_vitrine(tabela_id: str, prazo: int = 7, uid: str =
     if prazo not in prazos_disponiveis:
         prazo = prazos_disponiveis[0]
 
-    grid_out = await _tabelas_bucket().open_download_stream(doc["grid_id"])
-    conteudo = await grid_out.read()
-
-    suffix = doc.get("ext") or ".xlsx"
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    tmp.write(conteudo)
-    tmp.close()
     try:
-        _, precos_nome_lista = await asyncio.to_thread(ler_tabela_mestre, tmp.name, prazo=prazo)
+        indice = await carregar_indice_tabela(_db, _tabelas_bucket(), doc, prazo)
+        precos_nome_lista = indice["precos_nome_lista"]
     except Exception:
         logger.exception("[vitrine/tabelas] erro ao ler tabela %s", tabela_id)
         raise HTTPException(400, "Erro ao ler a tabela")
-    finally:
-        try:
-            os.unlink(tmp.name)
-        except OSError:
-            pass
 
     # Prioridade das fotos: escolha humana (aprendida) > aprovada em massa > candidata automática
     todos_eans = [item.get("ean") for item in precos_nome_lista if item.get("ean")]
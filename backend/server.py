@@ -21,7 +21,16 @@ from routes.asaas import router as asaas_router
 from routes.admin import router as admin_router, init_admin
 from routes.license import router as license_router
 from routes.ia import router as ia_router
-from routes.cotacao import router as cotacao_router, init_cotacao, resume_cotacao_jobs, start_cotacao_storage_cleanup
+from routes.cotacao import (
+    router as cotacao_router,
+    init_cotacao,
+    resume_cotacao_jobs,
+    start_cotacao_storage_cleanup,
+    start_cotacao_dispatcher,
+    COTACAO_TEMP_ARTIFACT_TTL_SECONDS,
+)
+from services.cotacao_executor import encerrar_executor
+from services.match_cache import MATCH_CACHE_TTL_SECONDS
 from routes.whatsapp import router as whatsapp_router, init_whatsapp
 from routes.users import router as users_router, init_users
 from routes.vitrine import router as vitrine_router, init_vitrine
@@ -311,6 +320,17 @@ async def startup_event():
             "created_at",
             expireAfterSeconds=86400
         )
+        await db.cotacao_extracoes.create_index(
+            "created_at",
+            expireAfterSeconds=COTACAO_TEMP_ARTIFACT_TTL_SECONDS
+        )
+        await db["fs.files"].create_index(
+            [("metadata.sha256", 1), ("uploadDate", -1)]
+        )
+        await db.cotacao_match_cache.create_index(
+            "created_at",
+            expireAfterSeconds=MATCH_CACHE_TTL_SECONDS
+        )
         await db.cotacao_jobs.create_index(
             [("user_id", 1), ("type", 1), ("active", 1)],
             unique=True,
@@ -319,6 +339,9 @@ async def startup_event():
         await db.cotacao_jobs.create_index(
             [("status", 1), ("created_at", 1)]
         )
+        await db.cotacao_jobs.create_index(
+            [("status", 1), ("lease_until", 1)]
+        )
         await db.cotacao_jobs.create_index(
             [("user_id", 1), ("type", 1), ("status", 1)]
         )
@@ -349,11 +372,15 @@ async def startup_event():
         logger.info("✅ Índices MongoDB criados")
     except Exception as e:
         logger.warning(f"⚠️  Índices MongoDB: {e}")
-    # Retomar jobs de tabela de prazos após restart do servidor
+    # Devolver para a fila jobs de instâncias que caíram; o despacho os retoma
     try:
         await resume_cotacao_jobs()
     except Exception as e:
         logger.warning(f"⚠️  Retomada de jobs de cotação: {e}")
+    try:
+        start_cotacao_dispatcher()
+    except Exception as e:
+        logger.warning(f"⚠️  Despacho de jobs de cotação: {e}")
     try:
         start_cotacao_storage_cleanup()
     except Exception as e:
@@ -364,5 +391,6 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    encerrar_executor()
     client.close()
     logger.info("Mongo client closed")
@@ -0,0 +1,385 @@
+"""Executor dos trabalhos pesados da Cotação Pronta.
+
+Leitura de planilhas e matching são CPU puro; em ``asyncio.to_thread`` o GIL
+faz uma cotação "completo" grande travar o worker inteiro, inclusive os
+matches rápidos por EAN da extensão. Aqui eles rodam num pool de processos
+(``spawn``) com capacidade ``MAX_RUNNING_COTACAO_JOBS`` e fila limitada.
+
+Cada processo mantém os índices de tabela mestre que já usou (LRU). O índice
+vai para o worker como referência a um arquivo em disco (mesmo formato do
+artefato do GridFS), não pelo pickle de cada tarefa.
+
+Uma cotação grande no modo "completo" é dividida em partes casadas em
+paralelo (``executar_em_partes``); o resultado volta na ordem original.
+
+``COTACAO_EXECUTOR=threads`` volta ao comportamento antigo (threads).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import glob
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from services.excel_processor import detectar_prazos_disponiveis, ler_cotacao, ler_grade_planilha
+from services import matching_engine
+from services.matching_engine import limpar_ean, processar_cotacao_com_ia
+from services.tabela_indice import (
+    INDICE_ASSINATURA,
+    compilar_tabela_prazos,
+    desserializar_indice,
+    serializar_indice,
+)
+
+logger = logging.getLogger(__name__)
+
+COTACAO_EXECUTOR = os.environ.get("COTACAO_EXECUTOR", "processos").strip().lower()
+COTACAO_EXECUTOR_FILA_MAX = int(os.environ.get("COTACAO_EXECUTOR_FILA_MAX", "8"))
+# Processos do pool (0 = um por núcleo, no mínimo a capacidade de jobs)
+COTACAO_EXECUTOR_WORKERS = int(os.environ.get("COTACAO_EXECUTOR_WORKERS", "0"))
+# Itens por parte no matching paralelo de uma cotação
+COTACAO_PARTE_ITENS = int(os.environ.get("COTACAO_PARTE_ITENS", "250"))
+COTACAO_WORKER_INDICES_MAX = int(os.environ.get("COTACAO_WORKER_INDICES_MAX", "4"))
+COTACAO_INDICES_DIR = os.environ.get("COTACAO_INDICES_DIR") or os.path.join(
+    tempfile.gettempdir(), "venpro_indices"
+)
+
+
+class ExecutorOcupado(RuntimeError):
+    """Fila do executor cheia; a rota responde 503."""
+
+
+_pool = None
+_threads = None
+_capacidade = 1
+# Tarefas no executor até terminarem de fato (uma cancelada pode seguir rodando)
+_em_andamento = 0
+_trava_vagas = threading.Lock()
+
+# Só dentro dos processos do pool: arquivo do índice -> índice carregado
+_indices_worker: OrderedDict = OrderedDict()
+
+
+def configurar_executor(capacidade: int):
+    global _capacidade
+    _capacidade = max(1, int(capacidade))
+
+
+def usa_processos() -> bool:
+    return COTACAO_EXECUTOR != "threads"
+
+
+def _workers_pool() -> int:
+    if COTACAO_EXECUTOR_WORKERS > 0:
+        return COTACAO_EXECUTOR_WORKERS
+    return max(_capacidade, os.cpu_count() or 1)
+
+
+def _inicializar_worker():
+    # O pool já tem um processo por núcleo: o cdist de cada parte usa uma thread só
+    matching_engine.MATCH_WORKERS = 1
+
+
+def _obter_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=_workers_pool(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_inicializar_worker,
+        )
+    return _pool
+
+
+def _obter_threads():
+    global _threads
+    if _threads is None:
+        _threads = ThreadPoolExecutor(max_workers=_workers_pool(), thread_name_prefix="cotacao")
+    return _threads
+
+
+def encerrar_executor():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _medir(funcao, args, kwargs, relogio):
+    inicio = relogio()
+    resultado = funcao(*args, **kwargs)
+    return resultado, round(relogio() - inicio, 4)
+
+
+def _rodar_no_processo(funcao, args, kwargs):
+    return _medir(funcao, args, kwargs, time.process_time)
+
+
+def _ocupar_vaga(limitar: bool):
+    global _em_andamento
+    with _trava_vagas:
+        if limitar and _em_andamento >= _capacidade + COTACAO_EXECUTOR_FILA_MAX:
+            raise ExecutorOcupado("Servidor ocupado processando outras cotações")
+        _em_andamento += 1
+
+
+def _liberar_vaga(_futuro=None):
+    # Callback do concurrent.futures: roda na thread do executor
+    global _em_andamento
+    with _trava_vagas:
+        _em_andamento -= 1
+
+
+def _submeter(funcao, args, kwargs):
+    """``concurrent.futures.Future`` da tarefa no pool (ou numa thread); não mexe nas vagas."""
+    try:
+        if not usa_processos():
+            return _obter_threads().submit(_medir, funcao, args, kwargs, time.thread_time)
+        return _obter_pool().submit(_rodar_no_processo, funcao, args, kwargs)
+    except BrokenProcessPool:
+        _pool_quebrado()
+        raise
+
+
+def _pool_quebrado():
+    # Processo morto (OOM, kill): o próximo pedido sobe um pool novo.
+    logger.warning("[COTACAO_EXECUTOR] pool quebrado, recriando na próxima tarefa")
+    encerrar_executor()
+
+
+async def _aguardar(futuro):
+    """Cancelar a espera só descarta a tarefa se ela ainda não começou."""
+    try:
+        return await asyncio.wrap_future(futuro)
+    except BrokenProcessPool:
+        _pool_quebrado()
+        raise
+
+
+async def executar(funcao, *args, limitar=True, **kwargs):
+    """
+    Roda ``funcao(*args, **kwargs)`` fora do event loop e devolve
+    ``(resultado, cpu_segundos)``. Com ``limitar``, recusa (ExecutorOcupado)
+    quando já há ``capacidade + COTACAO_EXECUTOR_FILA_MAX`` tarefas. A vaga
+    só é devolvida quando a tarefa termina no executor, mesmo se quem
+    aguardava foi cancelado.
+    """
+    _ocupar_vaga(limitar)
+    try:
+        futuro = _submeter(funcao, args, kwargs)
+    except BaseException:
+        _liberar_vaga()
+        raise
+    futuro.add_done_callback(_liberar_vaga)
+    return await _aguardar(futuro)
+
+
+def dividir_em_partes(itens, modo, tamanho=None):
+    """
+    Partes contíguas de tamanho parecido (no máximo ``tamanho`` itens). O modo
+    "ean" é só consulta em dicionário e fica numa parte só.
+    """
+    tamanho = max(1, tamanho or COTACAO_PARTE_ITENS)
+    if modo == "ean" or len(itens) <= tamanho:
+        return [itens]
+    n_partes = -(-len(itens) // tamanho)
+    passo = -(-len(itens) // n_partes)
+    return [itens[i:i + passo] for i in range(0, len(itens), passo)]
+
+
+def _somar_metricas(total: dict, parcial: dict):
+    etapas = total.setdefault("etapas_ms", {})
+    for nome, ms in parcial.get("etapas_ms", {}).items():
+        etapas[nome] = round(etapas.get(nome, 0) + ms, 1)
+    resolucao = total.setdefault("resolucao", {})
+    for camada, quantidade in parcial.get("resolucao", {}).items():
+        resolucao[camada] = resolucao.get(camada, 0) + quantidade
+    for chave in ("itens", "nomes_distintos"):
+        if chave in parcial:
+            total[chave] = total.get(chave, 0) + parcial[chave]
+    if "lote" in parcial:
+        total["lote"] = total.get("lote", False) or parcial["lote"]
+
+
+def _liberar_vaga_ao_concluir(futuros):
+    """Devolve uma vaga quando todos os futuros terminam (ou são cancelados)."""
+    if not futuros:
+        _liberar_vaga()
+        return
+    restantes = len(futuros)
+    trava = threading.Lock()
+
+    def _concluido(_futuro):
+        nonlocal restantes
+        with trava:
+            restantes -= 1
+            ultimo = restantes == 0
+        if ultimo:
+            _liberar_vaga()
+
+    for futuro in futuros:
+        futuro.add_done_callback(_concluido)
+
+
+async def executar_em_partes(indice, itens, modo, com_meta=False, progresso=None, limitar=True):
+    """
+    ``tarefa_match`` de uma cotação dividida em partes que rodam em paralelo
+    sobre o mesmo índice. Devolve ``((resultados, meta_por_ean, metricas), cpu_s)``
+    como ``executar(tarefa_match, ...)``, com os resultados na ordem dos itens.
+    ``progresso(partes_prontas, total_partes, itens_prontos, total_itens)`` é
+    aguardado a cada parte concluída.
+
+    A cotação ocupa uma vaga só, devolvida quando a última parte termina no
+    executor, e deixa um processo do pool livre para os matches rápidos.
+    """
+    _ocupar_vaga(limitar)
+    partes = dividir_em_partes(itens, modo)
+    limite = max(1, _workers_pool() - 1)
+    pendentes = list(enumerate(partes))
+    pendentes.reverse()
+    em_voo = {}
+    submetidos = []
+    respostas = [None] * len(partes)
+    prontas = 0
+    itens_prontos = 0
+    try:
+        while pendentes or em_voo:
+            while pendentes and len(em_voo) < limite:
+                i, parte = pendentes.pop()
+                futuro = _submeter(tarefa_match, (indice, parte, modo, com_meta), {})
+                submetidos.append(futuro)
+                em_voo[asyncio.wrap_future(futuro)] = i
+            feitos, _ = await asyncio.wait(em_voo, return_when=asyncio.FIRST_COMPLETED)
+            for feito in feitos:
+                i = em_voo.pop(feito)
+                respostas[i] = feito.result()
+                prontas += 1
+                itens_prontos += len(partes[i])
+                if progresso is not None:
+                    await progresso(prontas, len(partes), itens_prontos, len(itens))
+    except BaseException as e:
+        for feito in em_voo:
+            feito.cancel()
+        if isinstance(e, BrokenProcessPool):
+            _pool_quebrado()
+        raise
+    finally:
+        _liberar_vaga_ao_concluir(submetidos)
+
+    resultados, meta_por_ean, metricas, cpu_s = [], {}, {}, 0.0
+    for (resultados_parte, meta_parte, metricas_parte), cpu_parte in respostas:
+        resultados.extend(resultados_parte)
+        meta_por_ean.update(meta_parte)
+        _somar_metricas(metricas, metricas_parte)
+        cpu_s += cpu_parte
+    if len(partes) > 1:
+        metricas["partes"] = len(partes)
+    return (resultados, meta_por_ean, metricas), round(cpu_s, 4)
+
+
+def caminho_indice(chave) -> str:
+    """chave = (tabela_id, grid_id, prazo), a mesma do cache de índices das rotas."""
+    tabela_id, grid_id, prazo = chave
+    return os.path.join(COTACAO_INDICES_DIR, f"{tabela_id}_{grid_id}_{int(prazo)}_{INDICE_ASSINATURA}.bin")
+
+
+def gravar_referencia_indice(chave, indice: dict, grid_id, prazo) -> dict:
+    """
+    Grava o índice em disco (uma vez por chave) e devolve a referência leve
+    que as tarefas recebem no lugar do índice.
+    """
+    caminho = caminho_indice(chave)
+    if not os.path.exists(caminho):
+        os.makedirs(COTACAO_INDICES_DIR, exist_ok=True)
+        tmp = f"{caminho}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(serializar_indice(indice, grid_id, prazo))
+        os.replace(tmp, caminho)
+    return {"arquivo": caminho, "grid_id": str(grid_id), "prazo": int(prazo)}
+
+
+def remover_referencias_tabela(tabela_id):
+    for caminho in glob.glob(os.path.join(COTACAO_INDICES_DIR, f"{glob.escape(str(tabela_id))}_*.bin")):
+        try:
+            os.unlink(caminho)
+        except OSError:
+            pass
+
+
+def remover_indices_de_outras_versoes() -> int:
+    """Apaga índices em disco de outra ``INDICE_ASSINATURA``; cada mudança de versão deixa um conjunto para trás."""
+    sufixo = f"_{INDICE_ASSINATURA}.bin"
+    removidos = 0
+    for caminho in glob.glob(os.path.join(COTACAO_INDICES_DIR, "*.bin")):
+        if caminho.endswith(sufixo):
+            continue
+        try:
+            os.unlink(caminho)
+            removidos += 1
+        except OSError:
+            pass
+    return removidos
+
+
+def resolver_indice(indice: dict) -> dict:
+    """No worker: índice em memória, carregando a referência em disco só na primeira vez."""
+    if "arquivo" not in indice:
+        return indice
+    arquivo = indice["arquivo"]
+    carregado = _indices_worker.get(arquivo)
+    if carregado is not None:
+        _indices_worker.move_to_end(arquivo)
+        return carregado
+
+    with open(arquivo, "rb") as f:
+        carregado = desserializar_indice(f.read(), indice["grid_id"], indice["prazo"])
+    if carregado is None:
+        raise RuntimeError("Índice da tabela mestre inválido; envie a tabela novamente.")
+    carregado["norms_cache"] = [item["norm"] for item in carregado["precos_nome_lista"]]
+    _indices_worker[arquivo] = carregado
+    while len(_indices_worker) > COTACAO_WORKER_INDICES_MAX:
+        _indices_worker.popitem(last=False)
+    return carregado
+
+
+# ── Tarefas (funções de módulo: precisam ser importáveis no processo filho) ──
+
+def tarefa_compilar_tabela(caminho):
+    """
+    Prazos disponíveis, prazo padrão (o maior) e a tabela colunar de todos
+    os prazos, lendo a planilha uma vez.
+    """
+    grade = ler_grade_planilha(caminho)
+    prazos = detectar_prazos_disponiveis(caminho, grade=grade)
+    return prazos, prazos[-1], compilar_tabela_prazos(caminho, prazos, grade=grade)
+
+
+def tarefa_ler_cotacao(caminho_cotacao, coluna_preco):
+    inicio = time.perf_counter()
+    itens, _ = ler_cotacao(caminho_cotacao, coluna_preco=coluna_preco)
+    return itens, {"etapas_ms": {"leitura_cotacao": round((time.perf_counter() - inicio) * 1000, 1)}}
+
+
+def tarefa_match(indice, itens, modo, com_meta=False):
+    indice = resolver_indice(indice)
+    metricas = {}
+    resultados = processar_cotacao_com_ia(
+        itens, indice["precos"], indice["precos_nome_lista"],
+        modo=modo, norms_cache=indice["norms_cache"], metricas=metricas,
+    )
+    meta_por_ean = {}
+    if com_meta:
+        # Só o que a rota vai consultar, para não serializar a tabela inteira de volta.
+        for item in itens:
+            ean = limpar_ean(item.get("ean", ""))
+            if ean in indice["meta_por_ean"]:
+                meta_por_ean[ean] = indice["meta_por_ean"][ean]
+    return resultados, meta_por_ean, metricas
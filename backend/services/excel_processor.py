@@ -2,18 +2,34 @@
 Processador de Excel — leitura de tabelas mestre e cotações, geração de resultado.
 """
 
+import numpy as np
 import pandas as pd
+from pandas.io.parsers import TextParser
 import openpyxl
 from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles import PatternFill, Font, Alignment, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
 import tempfile
+import time
+from copy import copy
+import csv
+import html
 import os
 import io
+import logging
 import zipfile
+from itertools import chain, islice
 import re as _re
 import unicodedata
 
 from .matching_engine import limpar_ean, normalizar_nome, ordenar_palavras, processar_cotacao_com_ia
+from .pdf_paginas import PDF_EXTRACAO_TIMEOUT_SECONDS, contar_paginas, extrair_paginas
+from .xlsx_patch import PlanilhaXml, copiar_membro_comprimido
+
+logger = logging.getLogger(__name__)
 
 
 def _normalizar_cabecalho(valor) -> str:
@@ -131,22 +147,25 @@ def _parece_ean_real(valor) -> bool:
     return 12 <= len(ean) <= 14
 
 
-def _inferir_coluna_ean_openpyxl(ws, header_row: int, ignorar_cols=None):
+def _inferir_coluna_ean_linhas(linhas, header_row: int, max_column: int, ignorar_cols=None):
+    """``linhas``: valores das linhas da aba a partir da linha 1 (ao menos até header_row + 50)."""
     ignorar_cols = {c for c in (ignorar_cols or set()) if c is not None}
     melhor_col = None
     melhor_score = 0
+    cabecalho = linhas[header_row - 1] if header_row <= len(linhas) else ()
+    amostra = linhas[header_row:header_row + 50]
 
-    for col_idx in range(ws.max_column):
+    for col_idx in range(max_column):
         if col_idx in ignorar_cols:
             continue
-        header_value = ws.cell(row=header_row, column=col_idx + 1).value
+        header_value = _valor_na_linha(cabecalho, col_idx)
         if not _permite_inferir_ean_por_valores(header_value):
             continue
 
         total = 0
         hits = 0
-        for row_idx in range(header_row + 1, min(ws.max_row, header_row + 50) + 1):
-            value = ws.cell(row=row_idx, column=col_idx + 1).value
+        for linha in amostra:
+            value = _valor_na_linha(linha, col_idx)
             if value is None or str(value).strip() == "":
                 continue
             total += 1
@@ -346,38 +365,66 @@ def _coluna_embalagem(colunas, ignorar_cols=None):
     return None
 
 
+_INDENT_RE = _re.compile(rb'indent="(\d+)"')
+
+
+def _styles_com_indent_invalido(styles: bytes) -> bool:
+    return any(int(valor) > 255 for valor in _INDENT_RE.findall(styles))
+
+
+def _corrigir_styles(styles: bytes) -> bytes:
+    return _INDENT_RE.sub(
+        lambda m: b'indent="255"' if int(m.group(1)) > 255 else m.group(0),
+        styles,
+    )
+
+
+def _reescrever_xlsx(origem: bytes, styles: bytes, bruto=True) -> io.BytesIO:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(origem)) as zin, \
+         zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zout:
+        for item in zin.infolist():
+            if item.filename == 'xl/styles.xml':
+                zout.writestr(item, styles, compress_type=zipfile.ZIP_DEFLATED)
+            elif bruto:
+                copiar_membro_comprimido(origem, item, zout)
+            else:
+                zout.writestr(item, zin.read(item.filename))
+    buf.seek(0)
+    return buf
+
+
 def _xlsx_safe_bytes(caminho_arquivo):
     """
     Retorna BytesIO do xlsx com styles.xml corrigido.
     Alguns arquivos gerados por sistemas ERP têm indent > 255 que quebra o openpyxl.
+    Sem indent inválido (o caso comum) devolve os bytes originais; com ele,
+    só o styles.xml é reescrito e os demais membros vão comprimidos como estão.
     """
+    with open(caminho_arquivo, 'rb') as f:
+        origem = f.read()
     try:
-        buf = io.BytesIO()
-        with zipfile.ZipFile(caminho_arquivo) as zin, \
-             zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zout:
-            for item in zin.infolist():
-                data = zin.read(item.filename)
-                if item.filename == 'xl/styles.xml':
-                    try:
-                        styles = data.decode('utf-8', errors='replace')
-                        styles = _re.sub(
-                            r'indent="(\d+)"',
-                            lambda m: 'indent="255"' if int(m.group(1)) > 255 else m.group(0),
-                            styles,
-                        )
-                        data = styles.encode('utf-8')
-                    except Exception:
-                        pass
-                zout.writestr(item, data)
-        buf.seek(0)
-        return buf
+        with zipfile.ZipFile(io.BytesIO(origem)) as zin:
+            styles = zin.read('xl/styles.xml')
     except Exception:
-        # Não é um zip válido ou outro erro — devolve o arquivo original como BytesIO
-        with open(caminho_arquivo, 'rb') as f:
-            return io.BytesIO(f.read())
+        # Não é um zip válido ou não tem styles.xml — devolve o arquivo original
+        return io.BytesIO(origem)
+    if not _styles_com_indent_invalido(styles):
+        return io.BytesIO(origem)
+
+    styles = _corrigir_styles(styles)
+    try:
+        return _reescrever_xlsx(origem, styles)
+    except Exception:
+        try:
+            return _reescrever_xlsx(origem, styles, bruto=False)
+        except Exception:
+            return io.BytesIO(origem)
 
 PREENCHIMENTO_IA = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
 MAX_BLANK_ROWS_AFTER_COTACAO_ITEMS = 200
+# Linhas do topo da aba em que o cabeçalho da cotação é procurado
+COTACAO_LINHAS_CABECALHO = 15
 # Cotacao real sem codigo de barras existe (fica so com nome) — por isso a
 # falta de EAN/preco sozinha nao pode rejeitar a aba. So rejeita quando,
 # alem de faltar os dois, a aba tem linhas demais pra ser um pedido real
@@ -463,12 +510,12 @@ def _match_cotacao_preco(val):
     return bool(_re.search(r"\bVLR\b.*\bCUSTO\b", c_norm))
 
 
-def _ler_cotacao_worksheet(ws, sheet_name=None, exigir_indicio_cotacao=False, coluna_preco=None):
-    """Lê itens de uma aba de cotação preservando linha, coluna de preço e aba."""
-    col_ean = None
-    col_nome = None
-    col_preco = None
-    found_header = None
+def _valor_na_linha(linha, col):
+    return linha[col] if col is not None and col < len(linha) else None
+
+
+def _detectar_cabecalho_cotacao(linhas_iniciais):
+    """(header, col_nome, col_ean, col_preco) a partir das primeiras linhas da aba."""
     best_header = None
     best_score = -1
     fallback_col_ean = None
@@ -477,37 +524,37 @@ def _ler_cotacao_worksheet(ws, sheet_name=None, exigir_indicio_cotacao=False, co
     fallback_header = None
     fallback_col_ean_score = 0
 
-    for row_idx in range(1, min(16, ws.max_row + 1)):
+    for row_idx, linha in enumerate(linhas_iniciais, start=1):
         row_col_ean = None
         row_col_nome = None
         row_col_preco = None
         row_col_ean_score = 0
-        for cell in ws[row_idx]:
-            val = str(cell.value).upper().strip() if cell.value else ""
+        for col_idx, valor in enumerate(linha):
+            val = str(valor).upper().strip() if valor else ""
             if not val:
                 continue
 
             ean_score = _score_coluna_ean(val)
             if ean_score >= 80:
                 if ean_score > row_col_ean_score:
-                    row_col_ean = cell.column - 1
+                    row_col_ean = col_idx
                     row_col_ean_score = ean_score
                 if ean_score > fallback_col_ean_score:
-                    fallback_col_ean = cell.column - 1
+                    fallback_col_ean = col_idx
                     fallback_col_ean_score = ean_score
                     fallback_header = fallback_header or row_idx
                 continue
 
             if row_col_nome is None and _match_cotacao_nome(val):
-                row_col_nome = cell.column - 1
+                row_col_nome = col_idx
             elif row_col_preco is None and _match_cotacao_preco(val):
-                row_col_preco = cell.column - 1
+                row_col_preco = col_idx
 
             if fallback_col_nome is None and _match_cotacao_nome(val):
-                fallback_col_nome = cell.column - 1
+                fallback_col_nome = col_idx
                 fallback_header = row_idx
             elif fallback_col_preco is None and _match_cotacao_preco(val):
-                fallback_col_preco = cell.column - 1
+                fallback_col_preco = col_idx
                 fallback_header = fallback_header or row_idx
 
         if row_col_nome is not None:
@@ -521,52 +568,16 @@ def _ler_cotacao_worksheet(ws, sheet_name=None, exigir_indicio_cotacao=False, co
                 best_header = (row_idx, row_col_nome, row_col_ean, row_col_preco)
 
     if best_header:
-        found_header, col_nome, col_ean, col_preco = best_header
-    else:
-        found_header = fallback_header
-        col_nome = fallback_col_nome
-        col_ean = fallback_col_ean
-        col_preco = fallback_col_preco
-
-    if exigir_indicio_cotacao and found_header is None:
-        return [], 1
-
-    # Em arquivos com abas auxiliares (pedido, resumo etc.), uma coluna
-    # manual só deve ser aplicada à aba que já se parece com cotação.
-    # Isso evita preencher fórmulas de uma aba de pedido por engano.
-    if exigir_indicio_cotacao and coluna_preco is not None and col_preco is None:
-        return [], 1
-
-    if coluna_preco is not None:
-        if coluna_preco >= ws.max_column:
-            raise ValueError(f"A coluna escolhida não existe na aba '{ws.title}'.")
-        col_preco = coluna_preco
-
-    # Cotacao de verdade sem EAN nem preco existe (fica so com nome) e nao
-    # pode ser rejeitada. O que rejeitamos e a aba de catalogo/referencia
-    # interna (ex.: "Codigo Produto/Produto/Comprador") que a planilha do
-    # RCA as vezes traz numa segunda aba com milhares de linhas — essa nao
-    # tem EAN nem preco E e grande demais pra ser um pedido real. So nesse
-    # caso (falta EAN e preco E aba enorme) que a aba e descartada.
-    if (
-        exigir_indicio_cotacao
-        and col_ean is None
-        and col_preco is None
-        and ws.max_row > COTACAO_SHEET_MAX_ROWS_SEM_EAN_PRECO
-    ):
-        return [], 1
+        return best_header
+    return fallback_header, fallback_col_nome, fallback_col_ean, fallback_col_preco
 
-    header_row = found_header or 1
-    if col_ean is None:
-        col_ean = _inferir_coluna_ean_openpyxl(
-            ws,
-            header_row,
-            ignorar_cols={col_nome, col_preco},
-        )
-    if col_nome is None:
-        col_nome = 0
 
-    itens = []
+def _itens_cotacao_das_linhas(linhas, header_row, col_nome, col_ean, col_preco, sheet_name=None):
+    """
+    Gera os itens a partir das linhas abaixo do cabeçalho (``linhas`` começa em
+    header_row + 1), parando após MAX_BLANK_ROWS_AFTER_COTACAO_ITEMS linhas vazias.
+    """
+    encontrou_itens = False
     blank_rows_after_items = 0
     scan_col_limit = max(
         20,
@@ -575,50 +586,163 @@ def _ler_cotacao_worksheet(ws, sheet_name=None, exigir_indicio_cotacao=False, co
         (col_preco or 0) + 1,
     )
 
-    for row_idx in range(header_row + 1, ws.max_row + 1):
-        row = ws[row_idx]
-        ean_val = row[col_ean].value if col_ean is not None and col_ean < len(row) else None
-        nome_val = row[col_nome].value if col_nome < len(row) else None
-        current_price = row[col_preco].value if col_preco is not None and col_preco < len(row) else None
+    for row_idx, row in enumerate(linhas, start=header_row + 1):
+        ean_val = _valor_na_linha(row, col_ean)
+        nome_val = _valor_na_linha(row, col_nome)
+        current_price = _valor_na_linha(row, col_preco)
         nome_presente = bool(
             nome_val
             and str(nome_val).strip()
             and str(nome_val).strip().upper() not in ("NONE", "NAN")
         )
         if nome_presente or limpar_ean(ean_val):
-            itens.append(_cotacao_item(
+            encontrou_itens = True
+            blank_rows_after_items = 0
+            yield _cotacao_item(
                 ean_val,
                 nome_val,
                 row_idx,
                 col_preco,
                 sheet_name=sheet_name,
                 current_price=current_price,
-            ))
-            blank_rows_after_items = 0
-        elif itens:
+            )
+        elif encontrou_itens:
             row_has_value = any(
-                cell.value is not None and str(cell.value).strip() != ""
-                for cell in row[:scan_col_limit]
+                value is not None and str(value).strip() != ""
+                for value in row[:scan_col_limit]
             )
             if row_has_value:
                 blank_rows_after_items = 0
             else:
                 blank_rows_after_items += 1
                 if blank_rows_after_items >= MAX_BLANK_ROWS_AFTER_COTACAO_ITEMS:
-                    break
+                    return
+
+
+def _ler_cotacao_worksheet(ws, sheet_name=None, exigir_indicio_cotacao=False, coluna_preco=None):
+    """
+    Lê itens de uma aba de cotação preservando linha, coluna de preço e aba.
+
+    Percorre as linhas uma vez (``iter_rows``), então funciona com abas
+    ``read_only``: só as primeiras linhas ficam em memória para achar o
+    cabeçalho e inferir o EAN; o resto é lido sob demanda. Nesse modo a
+    dimensão gravada no arquivo não é confiável, e largura/altura da aba
+    saem das linhas lidas.
+    """
+    somente_leitura = bool(getattr(ws.parent, "read_only", False))
+    if somente_leitura:
+        ws.reset_dimensions()
+    linhas = ws.iter_rows(values_only=True)
+    lidas = list(islice(linhas, COTACAO_LINHAS_CABECALHO))
+
+    found_header, col_nome, col_ean, col_preco = _detectar_cabecalho_cotacao(lidas)
 
+    if exigir_indicio_cotacao and found_header is None:
+        return [], 1
+
+    # Em arquivos com abas auxiliares (pedido, resumo etc.), uma coluna
+    # manual só deve ser aplicada à aba que já se parece com cotação.
+    # Isso evita preencher fórmulas de uma aba de pedido por engano.
+    if exigir_indicio_cotacao and coluna_preco is not None and col_preco is None:
+        return [], 1
+
+    header_row = found_header or 1
+    # Linhas usadas na inferência da coluna de EAN (até 50 abaixo do cabeçalho)
+    lidas.extend(islice(linhas, max(0, header_row + 50 - len(lidas))))
+
+    if somente_leitura:
+        max_column = max((len(linha) for linha in lidas), default=0)
+    else:
+        max_column = ws.max_column
+
+    if coluna_preco is not None:
+        # Em read_only, uma coluna além das linhas já lidas gera o mesmo erro
+        # e ler_cotacao repete a leitura carregando a planilha inteira.
+        if coluna_preco >= max_column:
+            raise ValueError(f"A coluna escolhida não existe na aba '{ws.title}'.")
+        col_preco = coluna_preco
+
+    # Cotacao de verdade sem EAN nem preco existe (fica so com nome) e nao
+    # pode ser rejeitada. O que rejeitamos e a aba de catalogo/referencia
+    # interna (ex.: "Codigo Produto/Produto/Comprador") que a planilha do
+    # RCA as vezes traz numa segunda aba com milhares de linhas — essa nao
+    # tem EAN nem preco E e grande demais pra ser um pedido real. So nesse
+    # caso (falta EAN e preco E aba enorme) que a aba e descartada.
+    if exigir_indicio_cotacao and col_ean is None and col_preco is None:
+        if somente_leitura:
+            # Lê só até passar do limite, sem carregar o resto da aba.
+            lidas.extend(islice(linhas, max(0, COTACAO_SHEET_MAX_ROWS_SEM_EAN_PRECO + 1 - len(lidas))))
+            total_linhas = len(lidas)
+        else:
+            total_linhas = ws.max_row
+        if total_linhas > COTACAO_SHEET_MAX_ROWS_SEM_EAN_PRECO:
+            return [], 1
+
+    if col_ean is None:
+        col_ean = _inferir_coluna_ean_linhas(
+            lidas,
+            header_row,
+            max_column,
+            ignorar_cols={col_nome, col_preco},
+        )
+    if col_nome is None:
+        col_nome = 0
+
+    itens = list(_itens_cotacao_das_linhas(
+        chain(lidas[header_row:], linhas),
+        header_row,
+        col_nome,
+        col_ean,
+        col_preco,
+        sheet_name=sheet_name,
+    ))
     return itens, header_row
 
 
-def detectar_prazos_disponiveis(caminho_arquivo) -> list:
+def ler_grade_planilha(caminho_arquivo) -> list:
+    """
+    Lê a primeira aba uma vez, sem cabeçalho: lista de linhas com os valores
+    que o leitor do pandas entrega ao parser ("" nas células vazias).
+    """
+    buf = _xlsx_safe_bytes(caminho_arquivo)
+    return pd.read_excel(buf, header=None, dtype=object, na_filter=False).values.tolist()
+
+
+def _dataframe_da_grade(grade, header):
+    """O mesmo DataFrame de ``pd.read_excel(..., header=header)``, sem reler o arquivo."""
+    return TextParser(grade, header=header, skip_blank_lines=False).read()
+
+
+def _colunas_da_grade(grade, header):
+    """Nomes de coluna para a linha ``header`` (Unnamed: n, duplicadas com .1)."""
+    return _dataframe_da_grade(grade[:header + 1], header).columns
+
+
+def _aparar_colunas_vazias(linhas):
+    """Corta as colunas vazias à direita, como o leitor faz com só essas linhas."""
+    largura = 0
+    for linha in linhas:
+        for idx in range(len(linha) - 1, largura - 1, -1):
+            if linha[idx] != "":
+                largura = idx + 1
+                break
+    return [linha[:largura] for linha in linhas]
+
+
+def detectar_prazos_disponiveis(caminho_arquivo, grade=None) -> list:
     """Detecta quais colunas de prazo (7 a 42 dias) existem no Excel."""
+    if grade is None:
+        try:
+            grade = ler_grade_planilha(caminho_arquivo)
+        except Exception:
+            return [28]
     melhor_encontrados = []
     for header in range(0, 10):
         try:
-            df = pd.read_excel(caminho_arquivo, header=header, nrows=0)
+            colunas = _colunas_da_grade(_aparar_colunas_vazias(grade[:header + 1]), header)
             encontrados = []
             for prazo in [7, 14, 21, 28, 35, 42]:
-                for col in df.columns:
+                for col in colunas:
                     # Normaliza antes de buscar: "preco_14_dias" tem "_" dos
                     # dois lados do numero, e "_" conta como \w no regex, entao
                     # \b(\d+)\b nunca casava direto na coluna crua.
@@ -635,29 +759,26 @@ def detectar_prazos_disponiveis(caminho_arquivo) -> list:
     return sorted(melhor_encontrados) or [28]
 
 
-def ler_tabela_mestre(caminho_arquivo, header_row=None, col_nome=0, col_ean=1, prazo=28, incluir_meta=False):
+def _colunas_tabela_mestre(grade, prazo, dataframes):
     """
-    Lê Excel de tabela de preços mestre. Auto-detecta linha de cabeçalho e coluna do prazo.
-    Retorna: (precos_dict, precos_nome_lista) ou, com incluir_meta=True,
-    (precos_dict, precos_nome_lista, meta_por_ean).
+    Linha de cabeçalho e colunas da tabela mestre para o prazo:
+    (header, col_nome, col_ean, col_preco, col_fracionamento, col_embalagem)
+    ou None. ``dataframes`` guarda o DataFrame de cada header já montado.
     """
-    buf = _xlsx_safe_bytes(caminho_arquivo)
-
-    df_final = None
-    col_nome_final = None
-    col_ean_final = None
-    col_preco_final = None
-    col_fracionamento_final = None
-    col_embalagem_final = None
+    def _dataframe(hdr):
+        if hdr not in dataframes:
+            dataframes[hdr] = _dataframe_da_grade(grade, hdr)
+        return dataframes[hdr]
 
     for hdr in range(0, 12):
         try:
-            buf.seek(0)
-            df = pd.read_excel(buf, header=hdr)
-            if df.empty or len(df.columns) < 2:
+            # Cabeçalho sem nenhuma linha de dados abaixo: DataFrame vazio
+            if len(grade) <= hdr + 1:
+                continue
+            cols = _colunas_da_grade(grade, hdr)
+            if len(cols) < 2:
                 continue
 
-            cols = df.columns
             # Coluna de preço: prazo quando existir; senão preço unitário.
             c_preco = _melhor_coluna_preco(cols, prazo=prazo)
 
@@ -668,86 +789,231 @@ def ler_tabela_mestre(caminho_arquivo, header_row=None, col_nome=0, col_ean=1, p
                     c_nome = cols[i]
                     break
 
+            if c_nome is None or c_preco is None:
+                continue
+
+            df = _dataframe(hdr)
             # Coluna de EAN/GTIN. Prioriza códigos de barras reais e evita COD PRODUTO.
             c_ean = _melhor_coluna_ean(cols)
             if c_ean is None:
                 idx_ean = _inferir_coluna_ean_dataframe(
                     df,
-                    ignorar_cols={
-                        df.columns.get_loc(c_nome) if c_nome is not None else None,
-                        df.columns.get_loc(c_preco) if c_preco is not None else None,
-                    },
+                    ignorar_cols={df.columns.get_loc(c_nome), df.columns.get_loc(c_preco)},
                 )
                 if idx_ean is not None:
                     c_ean = cols[idx_ean]
 
-            if c_nome is not None and c_preco is not None:
-                ignorar_fracionamento = {c_nome, c_ean, c_preco}
-                c_fracionamento = _melhor_coluna_fracionamento(cols, ignorar_cols=ignorar_fracionamento)
-                df_final = df
-                col_nome_final = c_nome
-                col_ean_final = c_ean
-                col_preco_final = c_preco
-                col_fracionamento_final = c_fracionamento
-                col_embalagem_final = _coluna_embalagem(
-                    cols, ignorar_cols=ignorar_fracionamento | {c_fracionamento}
-                )
-                break
+            ignorar_fracionamento = {c_nome, c_ean, c_preco}
+            c_fracionamento = _melhor_coluna_fracionamento(cols, ignorar_cols=ignorar_fracionamento)
+            c_embalagem = _coluna_embalagem(cols, ignorar_cols=ignorar_fracionamento | {c_fracionamento})
+            return hdr, c_nome, c_ean, c_preco, c_fracionamento, c_embalagem
         except Exception:
             continue
 
     # Fallback: last header tried, use last column as price
-    if df_final is None:
+    try:
+        cols = _dataframe(2).columns
+        c_nome = cols[0]
+        c_ean = _melhor_coluna_ean(cols)
+        c_preco = cols[-1]
+        c_fracionamento = _melhor_coluna_fracionamento(cols, ignorar_cols={c_nome, c_ean, c_preco})
+        c_embalagem = _coluna_embalagem(cols, ignorar_cols={c_nome, c_ean, c_preco, c_fracionamento})
+        return 2, c_nome, c_ean, c_preco, c_fracionamento, c_embalagem
+    except Exception:
+        return None
+
+
+def _preco_tabela_mestre(valor):
+    try:
+        preco = float(str(valor).replace(",", ".").replace("R$", "").replace(" ", "").strip())
+    except (ValueError, TypeError):
+        return None
+    if pd.isna(preco) or preco <= 0:
+        return None
+    return preco
+
+
+def _por_valor_distinto(funcao, valores):
+    """``funcao`` uma vez por valor distinto (tipo + valor: True não vira 1)."""
+    cache = {}
+    saida = []
+    for valor in valores:
+        chave = (type(valor), valor)
         try:
-            buf.seek(0)
-            df_final = pd.read_excel(buf, header=2)
-            col_nome_final = df_final.columns[0]
-            col_ean_final = _melhor_coluna_ean(df_final.columns)
-            col_preco_final = df_final.columns[-1]
-            col_fracionamento_final = _melhor_coluna_fracionamento(
-                df_final.columns,
-                ignorar_cols={col_nome_final, col_ean_final, col_preco_final},
-            )
-            col_embalagem_final = _coluna_embalagem(
-                df_final.columns,
-                ignorar_cols={col_nome_final, col_ean_final, col_preco_final, col_fracionamento_final},
-            )
+            resultado = cache[chave]
+        except KeyError:
+            resultado = cache[chave] = funcao(valor)
+        except TypeError:
+            resultado = funcao(valor)
+        saida.append(resultado)
+    return saida
+
+
+def _coluna_numerica(serie) -> bool:
+    return serie.dtype.kind in "iuf"
+
+
+def _precos_da_coluna(serie, valores):
+    """
+    Vetor float (NaN = sem preço) com a regra de ``_preco_tabela_mestre``.
+    Coluna numérica é convertida direto; texto ("25,90", "R$ 3,10") passa
+    pela regra uma vez por valor distinto.
+    """
+    if _coluna_numerica(serie):
+        precos = serie.to_numpy(dtype=float, na_value=np.nan, copy=True)
+    else:
+        precos = np.array(
+            [np.nan if p is None else p for p in _por_valor_distinto(_preco_tabela_mestre, valores)],
+            dtype=float,
+        )
+    with np.errstate(invalid="ignore"):
+        precos[~(precos > 0)] = np.nan
+    return precos
+
+
+def _eans_da_coluna(serie, valores):
+    """``limpar_ean`` da coluna; números viram dígitos sem passar por texto."""
+    if not _coluna_numerica(serie):
+        return np.array(_por_valor_distinto(limpar_ean, valores), dtype=object)
+    numeros = serie.to_numpy(dtype=float, na_value=np.nan)
+    eans = np.full(len(numeros), "", dtype=object)
+    # Acima de 15 dígitos o resultado nunca é EAN; evita estourar o int64
+    validos = np.isfinite(numeros) & (np.abs(numeros) < 1e15)
+    digitos = numeros[validos].astype(np.int64).astype(str)
+    tamanhos = np.char.str_len(digitos)
+    digitos = np.where((tamanhos >= 8) & (tamanhos <= 14), digitos, "")
+    eans[validos] = digitos.astype(object)
+    return eans
+
+
+def _extrair_linhas_tabela_mestre(tabela, df, col_nome, col_ean, col_fracionamento, col_embalagem, cols_preco):
+    """
+    Acrescenta à tabela colunar as linhas do DataFrame, com um preço por prazo
+    de ``cols_preco``. Coluna a coluna: preços, EANs e o filtro de linhas
+    vazias/sem preço são vetoriais; por linha só o nome (normalização em cache).
+    """
+    n_linhas = len(df)
+    if not n_linhas:
+        return
+    # Mesmos valores que df.iterrows() entrega (inclusive o upcast de
+    # planilhas só numéricas), sem montar uma Series por linha.
+    valores = df.to_numpy()
+
+    def _valores(col):
+        return valores[:, df.columns.get_loc(col)]
+
+    if col_ean is not None:
+        eans = _eans_da_coluna(df[col_ean], _valores(col_ean))
+    else:
+        eans = np.full(n_linhas, "", dtype=object)
+    if col_nome is not None:
+        nomes = pd.Series([str(v) for v in _valores(col_nome)], dtype=object)
+    else:
+        nomes = pd.Series([""] * n_linhas, dtype=object)
+    nome_presente = (
+        (nomes != "") & ~nomes.str.strip().str.upper().isin(("NONE", "NAN", ""))
+    ).to_numpy()
+
+    precos_por_prazo = {prazo: _precos_da_coluna(df[col], _valores(col)) for prazo, col in cols_preco.items()}
+    algum_preco = np.zeros(n_linhas, dtype=bool)
+    for precos in precos_por_prazo.values():
+        algum_preco |= ~np.isnan(precos)
+
+    manter = np.flatnonzero((nome_presente | (eans != "")) & algum_preco)
+    if not len(manter):
+        return
+
+    if col_fracionamento is not None:
+        fracionamentos = _por_valor_distinto(_parse_fracionamento, _valores(col_fracionamento)[manter])
+    else:
+        fracionamentos = [None] * len(manter)
+    if col_embalagem is not None:
+        embalagens = _valores(col_embalagem)[manter]
+        fracionamentos = [
+            fracionamento or _qtd_caixa_de_embalagem(embalagem)
+            for fracionamento, embalagem in zip(fracionamentos, embalagens)
+        ]
+
+    nomes_lista = nomes.tolist()
+    for i in manter:
+        if nome_presente[i]:
+            nome_norm = normalizar_nome(nomes_lista[i])
+            tabela["orig"].append(nomes_lista[i])
+            tabela["norm"].append(nome_norm)
+            tabela["ord"].append(ordenar_palavras(nome_norm))
+        else:
+            tabela["orig"].append(None)
+            tabela["norm"].append(None)
+            tabela["ord"].append(None)
+    tabela["ean"].extend(eans[manter].tolist())
+    tabela["fracionamento"].extend(fracionamentos)
+    for prazo, precos_prazo in tabela["precos"].items():
+        if prazo in precos_por_prazo:
+            precos_prazo.extend(None if np.isnan(p) else p for p in precos_por_prazo[prazo][manter].tolist())
+        else:
+            precos_prazo.extend([None] * len(manter))
+
+
+def ler_tabela_mestre_prazos(caminho_arquivo, prazos, grade=None) -> dict:
+    """
+    Lê a tabela mestre uma vez para vários prazos, em colunas: listas
+    "orig"/"norm"/"ord"/"ean"/"fracionamento" compartilhadas e, em
+    "precos", um vetor por prazo (None onde a linha não tem preço válido).
+    ``indice_do_prazo`` monta o índice de um prazo só escolhendo o vetor.
+    """
+    tabela = {
+        "prazos": list(prazos),
+        "orig": [],
+        "norm": [],
+        "ord": [],
+        "ean": [],
+        "fracionamento": [],
+        "precos": {prazo: [] for prazo in prazos},
+    }
+    if grade is None:
+        try:
+            grade = ler_grade_planilha(caminho_arquivo)
         except Exception:
-            return ({}, [], {}) if incluir_meta else ({}, [])
+            return tabela
 
+    # Prazos com as mesmas colunas (o normal) são extraídos numa passada só.
+    dataframes = {}
+    grupos = {}
+    for prazo in prazos:
+        colunas = _colunas_tabela_mestre(grade, prazo, dataframes)
+        if colunas is None:
+            continue
+        hdr, c_nome, c_ean, c_preco, c_fracionamento, c_embalagem = colunas
+        grupos.setdefault((hdr, c_nome, c_ean, c_fracionamento, c_embalagem), {})[prazo] = c_preco
+
+    for (hdr, c_nome, c_ean, c_fracionamento, c_embalagem), cols_preco in grupos.items():
+        _extrair_linhas_tabela_mestre(
+            tabela, dataframes[hdr], c_nome, c_ean, c_fracionamento, c_embalagem, cols_preco
+        )
+    return tabela
+
+
+def indice_do_prazo(tabela, prazo):
+    """(precos_dict, precos_nome_lista, meta_por_ean) de um prazo da tabela colunar."""
     precos = {}
     precos_nome_lista = []
     meta_por_ean = {}
 
-    for _, row in df_final.iterrows():
-        ean_raw = row[col_ean_final] if col_ean_final is not None else None
-        ean = limpar_ean(ean_raw)
-        nome_bruto = str(row[col_nome_final]) if col_nome_final is not None else ""
-        nome_presente = bool(nome_bruto and nome_bruto.strip().upper() not in ("NONE", "NAN", ""))
-        if not nome_presente and not ean:
-            continue
-        fracionamento = _parse_fracionamento(row[col_fracionamento_final]) if col_fracionamento_final is not None else None
-        if not fracionamento and col_embalagem_final is not None:
-            fracionamento = _qtd_caixa_de_embalagem(row[col_embalagem_final])
-
-        try:
-            preco = float(str(row[col_preco_final]).replace(",", ".").replace("R$", "").replace(" ", "").strip())
-            if pd.isna(preco) or preco <= 0:
-                continue
-        except (ValueError, TypeError):
+    for i, preco in enumerate(tabela["precos"].get(prazo) or []):
+        if preco is None:
             continue
-
+        ean = tabela["ean"][i]
+        fracionamento = tabela["fracionamento"][i]
         if ean:
             precos[ean] = preco
             if fracionamento:
                 meta_por_ean[ean] = {"fracionamento": fracionamento}
-        if nome_presente:
-            nome_norm = normalizar_nome(nome_bruto)
+        if tabela["orig"][i] is not None:
             item_nome = {
-                'norm': nome_norm,
-                'ord': ordenar_palavras(nome_norm),
+                'norm': tabela["norm"][i],
+                'ord': tabela["ord"][i],
                 'preco': preco,
-                'orig': nome_bruto,
+                'orig': tabela["orig"][i],
             }
             if fracionamento:
                 item_nome['fracionamento'] = fracionamento
@@ -755,29 +1021,30 @@ def ler_tabela_mestre(caminho_arquivo, header_row=None, col_nome=0, col_ean=1, p
                 item_nome['ean'] = ean
             precos_nome_lista.append(item_nome)
 
-    if incluir_meta:
-        return precos, precos_nome_lista, meta_por_ean
-    return precos, precos_nome_lista
+    return precos, precos_nome_lista, meta_por_ean
 
 
-def ler_cotacao(caminho_arquivo, coluna_preco=None):
+def ler_tabela_mestre(caminho_arquivo, header_row=None, col_nome=0, col_ean=1, prazo=28, incluir_meta=False,
+                      grade=None):
     """
-    Lê Excel de cotação enviado pelo RCA.
-    Corrige automaticamente xlsx com XML inválido (indent > 255).
-    Usa detecção parcial de cabeçalhos para tolerar variações de nome.
-    Retorna: (itens, header_row)
+    Lê Excel de tabela de preços mestre. Auto-detecta linha de cabeçalho e coluna do prazo.
+    A planilha é lida uma vez (``ler_grade_planilha``, ou ``grade`` já lida) e
+    as linhas candidatas a cabeçalho são avaliadas em memória.
+    Retorna: (precos_dict, precos_nome_lista) ou, com incluir_meta=True,
+    (precos_dict, precos_nome_lista, meta_por_ean).
     """
-    # Rotas internas já guardam o índice zero-based; chamadas externas podem
-    # informar a letra/número visível do Excel.
-    if coluna_preco is not None and not isinstance(coluna_preco, int):
-        coluna_preco = normalizar_coluna_preco(coluna_preco)
-    itens = []
-    header_row = 1
+    tabela = ler_tabela_mestre_prazos(caminho_arquivo, [prazo], grade=grade)
+    precos, precos_nome_lista, meta_por_ean = indice_do_prazo(tabela, prazo)
+    if incluir_meta:
+        return precos, precos_nome_lista, meta_por_ean
+    return precos, precos_nome_lista
 
-    # --- Tentativa 1: openpyxl com correção de stylesheet ---
+
+def _ler_cotacao_workbook(buf, itens, coluna_preco, somente_leitura):
+    """Adiciona a ``itens`` os itens de todas as abas; retorna a linha de cabeçalho."""
+    wb = openpyxl.load_workbook(buf, read_only=somente_leitura, data_only=True)
     try:
-        buf = _xlsx_safe_bytes(caminho_arquivo)
-        wb = openpyxl.load_workbook(buf, data_only=True)
+        header_row = 1
         varias_abas = len(wb.worksheets) > 1
         first_header_row = None
         for ws in wb.worksheets:
@@ -794,7 +1061,36 @@ def ler_cotacao(caminho_arquivo, coluna_preco=None):
 
         if first_header_row is not None:
             header_row = first_header_row
+        return header_row
+    finally:
         wb.close()
+
+
+def ler_cotacao(caminho_arquivo, coluna_preco=None):
+    """
+    Lê Excel de cotação enviado pelo RCA.
+    Corrige automaticamente xlsx com XML inválido (indent > 255).
+    Usa detecção parcial de cabeçalhos para tolerar variações de nome.
+    Retorna: (itens, header_row)
+    """
+    # Rotas internas já guardam o índice zero-based; chamadas externas podem
+    # informar a letra/número visível do Excel.
+    if coluna_preco is not None and not isinstance(coluna_preco, int):
+        coluna_preco = normalizar_coluna_preco(coluna_preco)
+    itens = []
+    header_row = 1
+
+    # --- Tentativa 1: openpyxl com correção de stylesheet ---
+    # Primeiro em read_only (linhas lidas sob demanda); se a leitura em
+    # streaming falhar, carrega a planilha inteira como antes.
+    try:
+        buf = _xlsx_safe_bytes(caminho_arquivo)
+        try:
+            header_row = _ler_cotacao_workbook(buf, itens, coluna_preco, somente_leitura=True)
+        except Exception:
+            itens.clear()
+            buf.seek(0)
+            header_row = _ler_cotacao_workbook(buf, itens, coluna_preco, somente_leitura=False)
         if itens:
             return itens, header_row
     except Exception:
@@ -981,11 +1277,27 @@ def gerar_excel_resultado(caminho_original, itens, resultados):
     """
     Gera Excel preenchido com os precos encontrados.
     Itens matched por IA ficam em amarelo.
+    Preenche as celulas direto no XML do xlsx (services.xlsx_patch); se o
+    arquivo nao permitir, usa o openpyxl.
     Fallback: recria com pandas se openpyxl nao conseguir ler.
     Retorna caminho do arquivo gerado.
     """
     try:
         buf = _xlsx_safe_bytes(caminho_original)
+        # Caminho rápido: altera só as células no XML das abas; o resto do
+        # arquivo sai como veio. Arquivo fora do padrão volta ao openpyxl.
+        try:
+            wb = PlanilhaXml(buf.getvalue())
+            _write_resultados_to_workbook(wb, itens, resultados)
+            conteudo = wb.salvar()
+        except Exception as e:
+            logger.debug(f"gerar_excel_resultado: preenchimento direto no XML indisponível ({e})")
+        else:
+            output = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
+            output.write(conteudo)
+            output.close()
+            return output.name
+
         wb = openpyxl.load_workbook(buf)
         _write_resultados_to_workbook(wb, itens, resultados)
 
@@ -1107,15 +1419,21 @@ def _ler_excel_base(caminho_arquivo):
         return col_nome, col_ean, col_preco
 
     def _rows_from_df(df, col_nome, col_ean, col_preco):
+        # Por coluna: preço e EAN uma vez por valor distinto, não por linha.
+        valores = df.to_numpy()
+        n_cols = valores.shape[1] if valores.ndim == 2 else 0
+
+        def _coluna(col, funcao):
+            if col is None or col >= n_cols:
+                return [funcao(None)] * len(valores)
+            return _por_valor_distinto(funcao, valores[:, col])
+
+        nomes = [str(v).strip() for v in valores[:, col_nome]] if col_nome is not None else [""] * len(valores)
+        precos = _coluna(col_preco, _parse_preco)
+        eans = _coluna(col_ean, _parse_ean)
         rows = []
-        for _, row in df.iterrows():
-            nome = str(row.iloc[col_nome]).strip() if col_nome is not None else ""
-            if not nome or nome.upper() in ("NONE", "NAN", ""):
-                continue
-            ean = _parse_ean(row.iloc[col_ean] if col_ean is not None and col_ean < len(row) else None)
-            preco_raw = row.iloc[col_preco] if col_preco is not None and col_preco < len(row) else None
-            preco = _parse_preco(preco_raw)
-            if preco is None:
+        for nome, ean, preco in zip(nomes, eans, precos):
+            if not nome or nome.upper() in ("NONE", "NAN", "") or preco is None:
                 continue
             rows.append({"nome": nome, "ean": ean, "preco_base": preco})
         return rows
@@ -1341,36 +1659,60 @@ def _ler_pdf_base(caminho_pdf, progress_callback=None):
 
         return rows_text
 
-    def _ler_pdf_por_texto(pdf):
-        rows_text = []
-
-        for page_number, page in enumerate(pdf.pages, 1):
-            try:
-                text = page.extract_text() or ""
-            except Exception as e:
-                logger_local.warning(f"extract_text falhou na pagina {page_number}: {e}")
-                text = ""
+    prazo_final = time.monotonic() + PDF_EXTRACAO_TIMEOUT_SECONDS
 
-            rows_text.extend(_ler_texto_bruto(text))
+    def extrair_em_paginas(modo, total_pages, estagio, rotulo, contar_linhas):
+        """Extrai as páginas em paralelo; devolve os valores na ordem do PDF (None = página falhou)."""
+        linhas_vistas = [0]
 
-            if page_number == len(pdf.pages) or page_number % 5 == 0:
+        def ao_avancar(concluidas, _pagina, valor):
+            if valor:
+                linhas_vistas[0] += contar_linhas(valor)
+            if concluidas == total_pages or concluidas % 5 == 0:
                 emit_progress({
-                    "stage": "extracting_pdf_text",
-                    "current_page": page_number,
-                    "total_pages": len(pdf.pages),
-                    "rows": len(rows_text),
+                    "stage": estagio,
+                    "current_page": concluidas,
+                    "total_pages": total_pages,
+                    "rows": linhas_vistas[0],
                 })
 
+        resultados, falhas = extrair_paginas(caminho_pdf, modo, total_pages, ao_avancar, prazo_final)
+        por_motivo = {}
+        for pagina, motivo in sorted(falhas.items()):
+            por_motivo.setdefault(motivo, []).append(str(pagina + 1))
+        for motivo, paginas in por_motivo.items():
+            lista = ",".join(paginas[:10]) + (",..." if len(paginas) > 10 else "")
+            diagnostics.append(f"{rotulo}_paginas_{motivo}={lista}")
+            logger_local.warning(f"{rotulo}: páginas {lista} puladas ({motivo})")
+        return [resultados.get(pagina) for pagina in range(total_pages)]
+
+    def contar_linhas_texto(texto):
+        return len(_ler_texto_bruto(texto))
+
+    def _ler_pdf_por_texto(total_pages, rotulo):
+        textos = extrair_em_paginas(
+            "texto_pdfplumber", total_pages, "extracting_pdf_text", rotulo, contar_linhas_texto,
+        )
+        rows_text = []
+        for text in textos:
+            rows_text.extend(_ler_texto_bruto(text or ""))
         return rows_text
 
+    def _texto_pdfminer(rotulo):
+        total_pages = contar_paginas(caminho_pdf, "texto_pdfminer")
+        textos = extrair_em_paginas(
+            "texto_pdfminer", total_pages, "extracting_pdf_text", rotulo, contar_linhas_texto,
+        )
+        return "".join(text or "" for text in textos)
+
     rows_data = []
     headers_cache = None
+    texto_pdfminer = None
 
     try:
-        from pdfminer.high_level import extract_text
-
         emit_progress({"stage": "extracting_pdf_text", "rows": 0})
-        rows_data = _ler_texto_bruto(extract_text(caminho_pdf) or "")
+        texto_pdfminer = _texto_pdfminer("texto_pdfminer_primeiro")
+        rows_data = _ler_texto_bruto(texto_pdfminer)
         diagnostics.append(f"texto_pdfminer_primeiro={len(rows_data)}_produtos")
         emit_progress({"stage": "extracting_pdf_text", "rows": len(rows_data)})
     except Exception as e:
@@ -1383,84 +1725,79 @@ def _ler_pdf_base(caminho_pdf, progress_callback=None):
         if not rows_data:
             with pdfplumber.open(caminho_pdf) as pdf:
                 total_pages = len(pdf.pages)
-                diagnostics.append(f"pdfplumber_abriu={total_pages}_paginas")
-                emit_progress({"stage": "pdf_opened", "total_pages": total_pages, "rows": 0})
+            diagnostics.append(f"pdfplumber_abriu={total_pages}_paginas")
+            emit_progress({"stage": "pdf_opened", "total_pages": total_pages, "rows": 0})
 
-                try:
-                    rows_data = _ler_pdf_por_texto(pdf)
-                    diagnostics.append(f"texto_pdfplumber_primeiro={len(rows_data)}_produtos")
-                except Exception as e:
-                    logger_local.warning(f"leitura inicial por texto falhou: {e}")
-                    diagnostics.append(f"texto_pdfplumber_primeiro_erro={type(e).__name__}")
-                    rows_data = []
-
-                if not rows_data:
-                    for page_number, page in enumerate(pdf.pages, 1):
+            texto_pdfplumber_lido = False
+            try:
+                rows_data = _ler_pdf_por_texto(total_pages, "texto_pdfplumber_primeiro")
+                texto_pdfplumber_lido = True
+                diagnostics.append(f"texto_pdfplumber_primeiro={len(rows_data)}_produtos")
+            except Exception as e:
+                logger_local.warning(f"leitura inicial por texto falhou: {e}")
+                diagnostics.append(f"texto_pdfplumber_primeiro_erro={type(e).__name__}")
+                rows_data = []
+
+            if not rows_data:
+                tabelas_por_pagina = extrair_em_paginas(
+                    "tabelas_pdfplumber", total_pages, "extracting_pdf", "tables",
+                    lambda tables: sum(max(len(table or []) - 1, 0) for table in tables),
+                )
+                for page_number, tables in enumerate(tabelas_por_pagina, 1):
+                    for table in tables or []:
                         try:
-                            tables = page.extract_tables()
-                        except Exception as e:
-                            logger_local.warning(f"extract_tables falhou na pagina {page_number}: {e}")
-                            diagnostics.append(f"tables_p{page_number}_erro={type(e).__name__}")
-                            tables = []
-                        for table in tables:
-                            try:
-                                if not table or len(table) < 2:
-                                    continue
-
-                                header_idx = None
-                                best_score = 0
-                                for idx, candidate in enumerate(table[:5]):
-                                    headers_test = [normalizar_celula(c).upper() for c in candidate]
-                                    candidate_score = score_header(headers_test)
-                                    if candidate_score > best_score:
-                                        best_score = candidate_score
-                                        header_idx = idx
-
-                                if header_idx is not None and best_score >= 4:
-                                    headers = [normalizar_celula(c).upper() for c in table[header_idx]]
-                                    headers_cache = headers
-                                    data_rows = table[header_idx + 1:]
-                                elif headers_cache:
-                                    headers = headers_cache
-                                    primeira_linha = " ".join(normalizar_celula(c).upper() for c in table[0])
-                                    data_rows = table[1:] if "ELEMENTOS QUE COMPÕEM" in primeira_linha else table
-                                else:
-                                    continue
+                            if not table or len(table) < 2:
+                                continue
 
-                                col_nome, col_ean, col_preco = localizar_colunas(headers)
-
-                                for row in data_rows:
-                                    if not row or len(row) <= col_preco:
-                                        continue
-                                    nome = normalizar_celula(row[col_nome]) if col_nome < len(row) else ""
-                                    if not nome or nome.upper() in ("NONE", "", "PRODUTO", "CÓDIGO", "CODIGO"):
-                                        continue
-                                    ean_raw = normalizar_celula(row[col_ean]) if col_ean is not None and col_ean < len(row) else ""
-                                    preco_raw = normalizar_celula(row[col_preco]) if row[col_preco] else ""
-                                    preco = parse_preco_pdf(preco_raw)
-                                    if preco is None:
-                                        continue
-                                    rows_data.append({
-                                        "nome": nome,
-                                        "ean": limpar_ean(ean_raw),
-                                        "preco_base": preco,
-                                    })
-                            except Exception as e:
-                                logger_local.warning(f"tabela do PDF ignorada na pagina {page_number}: {e}")
+                            header_idx = None
+                            best_score = 0
+                            for idx, candidate in enumerate(table[:5]):
+                                headers_test = [normalizar_celula(c).upper() for c in candidate]
+                                candidate_score = score_header(headers_test)
+                                if candidate_score > best_score:
+                                    best_score = candidate_score
+                                    header_idx = idx
+
+                            if header_idx is not None and best_score >= 4:
+                                headers = [normalizar_celula(c).upper() for c in table[header_idx]]
+                                headers_cache = headers
+                                data_rows = table[header_idx + 1:]
+                            elif headers_cache:
+                                headers = headers_cache
+                                primeira_linha = " ".join(normalizar_celula(c).upper() for c in table[0])
+                                data_rows = table[1:] if "ELEMENTOS QUE COMPÕEM" in primeira_linha else table
+                            else:
                                 continue
-                        if page_number == total_pages or page_number % 5 == 0:
-                            emit_progress({
-                                "stage": "extracting_pdf",
-                                "current_page": page_number,
-                                "total_pages": total_pages,
-                                "rows": len(rows_data),
-                            })
+
+                            col_nome, col_ean, col_preco = localizar_colunas(headers)
+
+                            for row in data_rows:
+                                if not row or len(row) <= col_preco:
+                                    continue
+                                nome = normalizar_celula(row[col_nome]) if col_nome < len(row) else ""
+                                if not nome or nome.upper() in ("NONE", "", "PRODUTO", "CÓDIGO", "CODIGO"):
+                                    continue
+                                ean_raw = normalizar_celula(row[col_ean]) if col_ean is not None and col_ean < len(row) else ""
+                                preco_raw = normalizar_celula(row[col_preco]) if row[col_preco] else ""
+                                preco = parse_preco_pdf(preco_raw)
+                                if preco is None:
+                                    continue
+                                rows_data.append({
+                                    "nome": nome,
+                                    "ean": limpar_ean(ean_raw),
+                                    "preco_base": preco,
+                                })
+                        except Exception as e:
+                            logger_local.warning(f"tabela do PDF ignorada na pagina {page_number}: {e}")
+                            continue
 
                 if not rows_data:
                     diagnostics.append("tabelas=0_produtos")
+                # O texto por página é o mesmo da primeira leitura; só repete se ela falhou
+                if not rows_data and not texto_pdfplumber_lido:
                     emit_progress({"stage": "extracting_pdf_text", "total_pages": total_pages, "rows": 0})
                     try:
-                        rows_data = _ler_pdf_por_texto(pdf)
+                        rows_data = _ler_pdf_por_texto(total_pages, "texto_pdfplumber")
                         diagnostics.append(f"texto_pdfplumber={len(rows_data)}_produtos")
                     except Exception as e:
                         logger_local.warning(f"fallback por texto com pdfplumber falhou: {e}")
@@ -1471,10 +1808,10 @@ def _ler_pdf_base(caminho_pdf, progress_callback=None):
 
     if not rows_data:
         try:
-            from pdfminer.high_level import extract_text
-
             emit_progress({"stage": "extracting_pdf_text", "rows": 0})
-            rows_data = _ler_texto_bruto(extract_text(caminho_pdf) or "")
+            if texto_pdfminer is None:
+                texto_pdfminer = _texto_pdfminer("texto_pdfminer")
+            rows_data = _ler_texto_bruto(texto_pdfminer)
             diagnostics.append(f"texto_pdfminer={len(rows_data)}_produtos")
             emit_progress({"stage": "extracting_pdf_text", "rows": len(rows_data)})
         except Exception as e:
@@ -1490,53 +1827,162 @@ def _ler_pdf_base(caminho_pdf, progress_callback=None):
     return rows_data
 
 
-def _gerar_excel_de_dados(rows_data, percentuais):
-    """Gera Excel com colunas por prazo a partir de dados já extraídos."""
-    wb_out = Workbook()
-    ws_out = wb_out.active
-    ws_out.title = "Tabela de Preços"
-
-    ws_out.cell(1, 1).value = "Tabela de Preços com Prazos — gerada pelo Venpro"
-    ws_out.cell(1, 1).font = Font(bold=True, size=11, color="2D2926")
-
-    prazos = [7, 14, 21, 28, 35, 42]
-    headers = ["PRODUTO", "EAN"] + [f"{p} dias" for p in prazos]
-    header_fill = PatternFill(start_color="B35C44", end_color="B35C44", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=10)
-
-    for col_idx, h in enumerate(headers, 1):
-        cell = ws_out.cell(3, col_idx)
-        cell.value = h
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center")
-
-    for row_idx, item in enumerate(rows_data, 4):
-        ws_out.cell(row_idx, 1).value = item["nome"]
-        ws_out.cell(row_idx, 2).value = item["ean"]
-        for col_offset, prazo in enumerate(prazos, 3):
-            pct = percentuais.get(prazo, 0.0)
-            preco_final = round(item["preco_base"] * (1 + pct / 100), 2)
-            cell = ws_out.cell(row_idx, col_offset)
-            cell.value = preco_final
-            cell.number_format = '#,##0.00'
+PRAZOS_TABELA = (7, 14, 21, 28, 35, 42)
+# formato -> sufixo do arquivo gerado
+FORMATOS_TABELA_PRAZOS = {"xlsx": ".xlsx", "csv": ".csv"}
+
+
+def _estilos_tabela_prazos(wb):
+    """Registra uma vez os estilos nomeados da tabela de prazos."""
+    titulo = NamedStyle(name="venpro_titulo", font=Font(bold=True, size=11, color="2D2926"))
+    cabecalho = NamedStyle(
+        name="venpro_cabecalho",
+        font=Font(bold=True, color="FFFFFF", size=10),
+        fill=PatternFill(start_color="B35C44", end_color="B35C44", fill_type="solid"),
+        alignment=Alignment(horizontal="center"),
+    )
+    preco = NamedStyle(name="venpro_preco", font=copy(DEFAULT_FONT), number_format='#,##0.00')
+    for estilo in (titulo, cabecalho, preco):
+        wb.add_named_style(estilo)
+    return titulo.name, cabecalho.name, preco.name
+
+
+def matriz_precos_prazos(precos_base, percentuais):
+    """
+    Preços de todos os prazos numa operação: vetor de preço base (n) contra os
+    fatores dos prazos (6) -> matriz n x 6, arredondada em centavos.
+    """
+    fatores = np.array([1 + percentuais.get(prazo, 0.0) / 100 for prazo in PRAZOS_TABELA])
+    brutos = np.asarray(precos_base, dtype=float)[:, None] * fatores
+    matriz = np.round(brutos, 2)
+    # np.round arredonda x*100; perto de meio centavo isso pode divergir do
+    # round() do Python, que continua sendo a referência nesses poucos casos
+    centavos = brutos * 100
+    empate = np.abs(centavos - np.floor(centavos) - 0.5) < 1e-6
+    for i, j in zip(*np.nonzero(empate)):
+        matriz[i, j] = round(float(brutos[i, j]), 2)
+    return matriz
+
+
+def _xml_celula_prazos(ref, valor, estilo=""):
+    if valor is None or valor == "":
+        return ""
+    if isinstance(valor, str):
+        valor = ILLEGAL_CHARACTERS_RE.sub("", valor)
+        espaco = ' xml:space="preserve"' if valor != valor.strip() else ""
+        return f'<c r="{ref}"{estilo} t="inlineStr"><is><t{espaco}>{html.escape(valor, quote=False)}</t></is></c>'
+    return f'<c r="{ref}"{estilo}><v>{valor!r}</v></c>'
+
+
+def _escrever_xlsx_prazos(rows_data, matriz, percentuais, destino):
+    """
+    O openpyxl em write-only monta o esqueleto (larguras, título, cabeçalho e
+    estilos nomeados) com uma linha modelo; as linhas de produto são gravadas
+    em XML direto no membro da aba, em fluxo, no lugar da linha modelo.
+    """
+    wb_out = Workbook(write_only=True)
+    ws_out = wb_out.create_sheet("Tabela de Preços")
+    estilo_titulo, estilo_cabecalho, estilo_preco = _estilos_tabela_prazos(wb_out)
 
     ws_out.column_dimensions['A'].width = 48
     ws_out.column_dimensions['B'].width = 16
     for letra in ['C', 'D', 'E', 'F', 'G', 'H']:
         ws_out.column_dimensions[letra].width = 11
 
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-    wb_out.save(tmp.name)
+    titulo = WriteOnlyCell(ws_out, value="Tabela de Preços com Prazos — gerada pelo Venpro")
+    titulo.style = estilo_titulo
+    ws_out.append([titulo])
+    ws_out.append([])
+
+    headers = ["PRODUTO", "EAN"] + [f"{p} dias" for p in PRAZOS_TABELA]
+    cabecalho = []
+    for h in headers:
+        cell = WriteOnlyCell(ws_out, value=h)
+        cell.style = estilo_cabecalho
+        cabecalho.append(cell)
+    ws_out.append(cabecalho)
+
+    modelo = WriteOnlyCell(ws_out, value=0)
+    modelo.style = estilo_preco
+    ws_out.append([None, None, modelo])
+
+    esqueleto = io.BytesIO()
+    wb_out.save(esqueleto)
+    esqueleto = esqueleto.getvalue()
+
+    with zipfile.ZipFile(io.BytesIO(esqueleto)) as zin:
+        item_aba = zin.getinfo("xl/worksheets/sheet1.xml")
+        xml_aba = zin.read(item_aba).decode("utf-8")
+        inicio = xml_aba.index('<row r="4"')
+        fim = xml_aba.index("</sheetData>")
+        id_estilo = _re.search(r'<c r="C4" s="(\d+)"', xml_aba[inicio:fim]).group(1)
+        estilo = f' s="{id_estilo}"'
+        colunas = [get_column_letter(c) for c in range(3, 3 + len(PRAZOS_TABELA))]
+
+        total = 0
+        with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED) as zout:
+            for item in zin.infolist():
+                if item.filename != item_aba.filename:
+                    copiar_membro_comprimido(esqueleto, item, zout)
+                    continue
+                with zout.open(item.filename, "w", force_zip64=True) as f:
+                    f.write(xml_aba[:inicio].encode("utf-8"))
+                    bloco = []
+                    for row_idx, (item_base, precos) in enumerate(zip(rows_data, matriz.tolist()), 4):
+                        celulas = [
+                            _xml_celula_prazos(f"A{row_idx}", item_base["nome"]),
+                            _xml_celula_prazos(f"B{row_idx}", item_base["ean"]),
+                        ]
+                        for letra, preco in zip(colunas, precos):
+                            celulas.append(_xml_celula_prazos(f"{letra}{row_idx}", preco, estilo))
+                        bloco.append(f'<row r="{row_idx}">{"".join(celulas)}</row>')
+                        total += 1
+                        if len(bloco) >= 1000:
+                            f.write("".join(bloco).encode("utf-8"))
+                            bloco = []
+                    f.write("".join(bloco).encode("utf-8"))
+                    f.write(xml_aba[fim:].encode("utf-8"))
+    return total
+
+
+def _escrever_csv_prazos(rows_data, matriz, percentuais, destino):
+    """CSV com ';' e vírgula decimal, como o Excel em pt-BR abre."""
+    total = 0
+    with open(destino, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["PRODUTO", "EAN"] + [f"{p} dias" for p in PRAZOS_TABELA])
+        for item, precos in zip(rows_data, matriz.tolist()):
+            writer.writerow([item["nome"], item["ean"], *(f"{preco:.2f}".replace(".", ",") for preco in precos)])
+            total += 1
+    return total
+
+
+_ESCRITORES_TABELA_PRAZOS = {
+    "xlsx": _escrever_xlsx_prazos,
+    "csv": _escrever_csv_prazos,
+}
+
+
+def gerar_excel_de_dados(rows_data, percentuais, formato="xlsx"):
+    """Gera a tabela com colunas por prazo; rows_data pode ser qualquer iterável."""
+    if formato not in FORMATOS_TABELA_PRAZOS:
+        raise ValueError(f"Formato de saída inválido: {formato}")
+    if not isinstance(rows_data, list):
+        rows_data = list(rows_data)
+    precos_base = np.fromiter((item["preco_base"] for item in rows_data), dtype=float, count=len(rows_data))
+    matriz = matriz_precos_prazos(precos_base, percentuais)
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=FORMATOS_TABELA_PRAZOS[formato])
     tmp.close()
+    try:
+        _ESCRITORES_TABELA_PRAZOS[formato](rows_data, matriz, percentuais, tmp.name)
+    except Exception:
+        os.unlink(tmp.name)
+        raise
     return tmp.name
 
 
-def gerar_excel_multiprazos(caminho_base, percentuais, progress_callback=None):
-    """
-    Orquestrador: aceita Excel (.xlsx/.xls) ou PDF e gera tabela com colunas por prazo.
-    percentuais: {7: 0.0, 14: 2.5, 21: 4.0, 28: 5.5, 35: 6.5, 42: 7.5}
-    """
+def extrair_linhas_base(caminho_base, progress_callback=None):
+    """Lê a tabela base (Excel .xlsx/.xls ou PDF): [{"nome", "ean", "preco_base"}]."""
     if caminho_base.lower().endswith('.pdf'):
         rows_data = _ler_pdf_base(caminho_base, progress_callback=progress_callback)
     else:
@@ -1544,10 +1990,20 @@ def gerar_excel_multiprazos(caminho_base, percentuais, progress_callback=None):
 
     if not rows_data:
         raise ValueError("Nenhum produto encontrado no arquivo enviado")
+    return rows_data
+
+
+def gerar_excel_multiprazos(caminho_base, percentuais, progress_callback=None, formato="xlsx"):
+    """
+    Orquestrador: aceita Excel (.xlsx/.xls) ou PDF e gera tabela com colunas por prazo.
+    percentuais: {7: 0.0, 14: 2.5, 21: 4.0, 28: 5.5, 35: 6.5, 42: 7.5}
+    formato: "xlsx" ou "csv" (ver FORMATOS_TABELA_PRAZOS)
+    """
+    rows_data = extrair_linhas_base(caminho_base, progress_callback=progress_callback)
 
     if progress_callback:
         try:
             progress_callback({"stage": "writing_excel", "rows": len(rows_data)})
         except Exception:
             pass
-    return _gerar_excel_de_dados(rows_data, percentuais)
+    return gerar_excel_de_dados(rows_data, percentuais, formato)
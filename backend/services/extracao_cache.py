@@ -0,0 +1,91 @@
+"""Cache da extração da tabela base da "Tabela de Prazos".
+
+O RCA costuma reenviar o mesmo PDF do fornecedor só para mudar os
+percentuais; a leitura do PDF é a parte cara e não depende deles. As linhas
+extraídas (``extrair_linhas_base``) ficam em ``cotacao_extracoes`` indexadas
+pelo SHA-256 do arquivo, como artefato compacto (JSON + zlib, igual aos
+índices de tabela mestre), com TTL em ``created_at``. Linhas gravadas por
+outra versão do parser são ignoradas.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timezone
+
+from bson import Binary
+
+logger = logging.getLogger(__name__)
+
+# Subir ao mudar a leitura da tabela base (Excel ou PDF) ou o formato salvo
+EXTRACAO_VERSAO = 1
+# Limite de documento do Mongo é 16 MB; acima disso não vale guardar
+EXTRACAO_CACHE_MAX_BYTES = int(os.environ.get("EXTRACAO_CACHE_MAX_BYTES", str(12 * 1024 * 1024)))
+
+
+EXTRACAO_ASSINATURA = f"e{EXTRACAO_VERSAO}"
+
+
+def hash_conteudo(conteudo: bytes) -> str:
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def serializar_linhas_base(rows_data) -> bytes:
+    payload = {
+        "v": EXTRACAO_VERSAO,
+        "assinatura": EXTRACAO_ASSINATURA,
+        "linhas": [[item["nome"], item["ean"], item["preco_base"]] for item in rows_data],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, 6)
+
+
+def desserializar_linhas_base(dados: bytes) -> list | None:
+    """Devolve rows_data ou None quando o artefato não serve para esta versão do parser."""
+    try:
+        payload = json.loads(zlib.decompress(dados).decode("utf-8"))
+    except (zlib.error, ValueError, UnicodeDecodeError):
+        return None
+    if payload.get("v") != EXTRACAO_VERSAO or payload.get("assinatura") != EXTRACAO_ASSINATURA:
+        return None
+    return [
+        {"nome": nome, "ean": ean, "preco_base": preco}
+        for nome, ean, preco in payload.get("linhas") or []
+    ]
+
+
+async def buscar_linhas_base(db, sha256: str) -> list | None:
+    doc = await db.cotacao_extracoes.find_one({"_id": sha256})
+    if not doc:
+        return None
+    rows_data = desserializar_linhas_base(bytes(doc.get("dados") or b""))
+    if not rows_data:
+        return None
+    # Reuso renova o prazo do TTL
+    await db.cotacao_extracoes.update_one(
+        {"_id": sha256},
+        {"$set": {"created_at": datetime.now(timezone.utc)}},
+    )
+    return rows_data
+
+
+async def guardar_linhas_base(db, sha256: str, rows_data) -> bool:
+    dados = serializar_linhas_base(rows_data)
+    if len(dados) > EXTRACAO_CACHE_MAX_BYTES:
+        logger.info("Extração de %s com %s bytes não vai para o cache", sha256[:12], len(dados))
+        return False
+    await db.cotacao_extracoes.replace_one(
+        {"_id": sha256},
+        {
+            "dados": Binary(dados),
+            "linhas": len(rows_data),
+            "assinatura": EXTRACAO_ASSINATURA,
+            "created_at": datetime.now(timezone.utc),
+        },
+        upsert=True,
+    )
+    return True
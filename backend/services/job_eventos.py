@@ -0,0 +1,49 @@
+"""Eventos de progresso dos jobs de cotação para as conexões SSE.
+
+O worker publica aqui cada atualização que grava em ``cotacao_jobs``; quem
+acompanha o job pela mesma instância recebe na hora, sem ler o Mongo. O
+evento final só avisa que o job terminou: o resultado é lido uma vez pelo
+endpoint. Conexões em outra instância dependem da verificação periódica.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from contextlib import contextmanager
+
+EVENTOS_POR_CONEXAO = 64
+
+_assinantes: dict = {}
+
+
+def publicar(job_id: str, evento: dict):
+    """Entrega o evento às conexões do job; chamar no event loop."""
+    for fila in list(_assinantes.get(job_id, ())):
+        if fila.full():
+            # Cliente lento: só interessa o progresso mais recente
+            try:
+                fila.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        fila.put_nowait(evento)
+
+
+@contextmanager
+def assinar(job_id: str):
+    fila = asyncio.Queue(maxsize=EVENTOS_POR_CONEXAO)
+    _assinantes.setdefault(job_id, set()).add(fila)
+    try:
+        yield fila
+    finally:
+        filas = _assinantes.get(job_id)
+        if filas is not None:
+            filas.discard(fila)
+            if not filas:
+                _assinantes.pop(job_id, None)
+
+
+def formatar_sse(evento: dict, nome: str | None = None) -> str:
+    linhas = [f"event: {nome}"] if nome else []
+    linhas.append("data: " + json.dumps(evento, ensure_ascii=False, default=str))
+    return "\n".join(linhas) + "\n\n"
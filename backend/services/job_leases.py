@@ -0,0 +1,122 @@
+"""Leases dos jobs de cotação em ``cotacao_jobs``.
+
+Com mais de uma instância da API, o conjunto de jobs em execução de cada
+processo não basta para saber se um job "processing" ainda tem dono. Quem vai
+processar um job primeiro o reivindica com ``find_one_and_update`` (só um
+vence), gravando ``lease_owner`` e ``lease_until``; enquanto trabalha, renova o
+lease a cada ``COTACAO_LEASE_RENOVACAO_SECONDS``. Job "processing" com lease
+vencido é de uma instância que caiu e pode ser reivindicado de novo.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+COTACAO_LEASE_SECONDS = int(os.environ.get("COTACAO_LEASE_SECONDS", "60"))
+COTACAO_LEASE_RENOVACAO_SECONDS = int(os.environ.get("COTACAO_LEASE_RENOVACAO_SECONDS", "20"))
+# Reivindicações de um mesmo job antes de desistir (job que derruba a instância)
+COTACAO_JOB_MAX_TENTATIVAS = int(os.environ.get("COTACAO_JOB_MAX_TENTATIVAS", "3"))
+INSTANCIA_ID = os.environ.get("COTACAO_INSTANCIA_ID") or (
+    f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+)
+
+FILTROS_TIPO = {
+    "preview": {"type": "preview"},
+    "tabela_prazos": {"type": {"$ne": "preview"}},
+}
+
+
+def filtro_reivindicavel(agora: datetime | None = None) -> dict:
+    agora = agora or datetime.now(timezone.utc)
+    return {
+        "$or": [
+            {"status": "queued"},
+            {
+                "status": "processing",
+                "$or": [
+                    {"lease_until": {"$lt": agora}},
+                    {"lease_until": {"$exists": False}},
+                ],
+            },
+        ]
+    }
+
+
+def lease_expirado(job: dict, agora: datetime | None = None) -> bool:
+    lease_until = job.get("lease_until")
+    if not lease_until:
+        return True
+    if lease_until.tzinfo is None:
+        lease_until = lease_until.replace(tzinfo=timezone.utc)
+    return lease_until < (agora or datetime.now(timezone.utc))
+
+
+async def reivindicar_job(db, job_id: str, tipo: str) -> dict | None:
+    """Passa o job para "processing" em nome desta instância; None se outra já tem o lease."""
+    agora = datetime.now(timezone.utc)
+    return await db.cotacao_jobs.find_one_and_update(
+        {"_id": job_id, **FILTROS_TIPO[tipo], **filtro_reivindicavel(agora)},
+        {
+            "$set": {
+                "status": "processing",
+                "started_at": agora,
+                "lease_owner": INSTANCIA_ID,
+                "lease_until": agora + timedelta(seconds=COTACAO_LEASE_SECONDS),
+            },
+            "$inc": {"tentativas": 1},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def renovar_lease(db, job_id: str) -> bool:
+    result = await db.cotacao_jobs.update_one(
+        {"_id": job_id, "status": "processing", "lease_owner": INSTANCIA_ID},
+        {"$set": {"lease_until": datetime.now(timezone.utc) + timedelta(seconds=COTACAO_LEASE_SECONDS)}},
+    )
+    return result.matched_count > 0
+
+
+async def liberar_lease(db, job_id: str):
+    await db.cotacao_jobs.update_one(
+        {"_id": job_id, "lease_owner": INSTANCIA_ID},
+        {"$unset": {"lease_owner": "", "lease_until": ""}},
+    )
+
+
+async def manter_lease(db, job_id: str):
+    """Heartbeat do job; roda até ser cancelado por quem processa e só retorna se o lease foi perdido."""
+    while True:
+        await asyncio.sleep(COTACAO_LEASE_RENOVACAO_SECONDS)
+        try:
+            if not await renovar_lease(db, job_id):
+                logger.warning("[Job %s] lease perdido por %s", job_id, INSTANCIA_ID)
+                return
+        except Exception as e:
+            logger.warning("[Job %s] falha ao renovar lease: %s", job_id, e)
+
+
+async def candidatos(db, tipo: str, limite: int, ignorar=()) -> list:
+    """Ids de jobs do tipo que podem ser reivindicados, mais antigos primeiro."""
+    if limite <= 0:
+        return []
+    ids = []
+    cursor = db.cotacao_jobs.find(
+        {**FILTROS_TIPO[tipo], **filtro_reivindicavel()},
+        {"_id": 1},
+    ).sort("created_at", 1).limit(limite + len(ignorar))
+    async for job in cursor:
+        if job["_id"] not in ignorar:
+            ids.append(job["_id"])
+            if len(ids) >= limite:
+                break
+    return ids
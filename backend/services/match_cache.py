@@ -0,0 +1,113 @@
+"""Cache persistente de resultados do matching entre requisições.
+
+O comprador manda quase a mesma cotação toda semana e o RCA casa contra a
+mesma tabela mestre. O resultado de um item só depende do conteúdo da tabela,
+do prazo, do modo e do item (EAN e nome normalizado), então fica em
+``cotacao_match_cache`` com ``_id`` derivado dessa chave. Tabela nova (outro
+SHA-256) ou outra versão do parser/motor (``INDICE_ASSINATURA``) geram chaves
+novas; as antigas saem pelo TTL.
+
+Guarda o preço cru do motor: item com preço atual preenchido não entra no
+cache, e na leitura o menor preço é reaplicado como em ``processar_cotacao``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from services.matching_engine import aplicar_menor_preco, limpar_ean, normalizar_nome, preco_atual_do_item
+from services.tabela_indice import INDICE_ASSINATURA
+
+logger = logging.getLogger(__name__)
+
+MATCH_CACHE_TTL_SECONDS = int(os.environ.get("MATCH_CACHE_TTL_SECONDS", str(14 * 24 * 60 * 60)))
+
+# Contadores desta instância para o endpoint de estatísticas
+_estatisticas = {"consultados": 0, "hits": 0, "gravados": 0}
+
+
+def hash_tabela(doc: dict) -> str:
+    """SHA-256 do arquivo da tabela mestre; tabelas antigas usam o grid_id, que também muda a cada upload."""
+    return doc.get("conteudo_sha256") or f"grid:{doc['grid_id']}"
+
+
+def chave_item(item: dict, modo: str) -> str | None:
+    ean = limpar_ean(item.get("ean", ""))
+    if modo == "ean":
+        return f"e:{ean}" if ean else None
+    nome = normalizar_nome(item.get("nome", ""))
+    if not ean and not nome:
+        return None
+    return f"n:{ean}|{nome}"
+
+
+def _id_cache(tabela_hash: str, prazo, modo: str, chave: str) -> str:
+    bruto = f"{INDICE_ASSINATURA}|{tabela_hash}|{int(prazo)}|{modo}|{chave}"
+    return hashlib.sha1(bruto.encode("utf-8")).hexdigest()
+
+
+async def buscar_resultados(db, tabela_hash: str, prazo, modo: str, itens) -> dict:
+    """``{posição em itens: resultado}`` dos itens que já estão no cache."""
+    ids_por_posicao = {}
+    for pos, item in enumerate(itens):
+        chave = chave_item(item, modo)
+        if chave is not None:
+            ids_por_posicao[pos] = _id_cache(tabela_hash, prazo, modo, chave)
+    _estatisticas["consultados"] += len(itens)
+    if not ids_por_posicao:
+        return {}
+
+    guardados = {}
+    async for doc in db.cotacao_match_cache.find(
+        {"_id": {"$in": list(set(ids_por_posicao.values()))}},
+        {"preco": 1, "tipo": 1},
+    ):
+        guardados[doc["_id"]] = doc
+
+    encontrados = {}
+    for pos, id_cache in ids_por_posicao.items():
+        doc = guardados.get(id_cache)
+        if doc is None:
+            continue
+        item = itens[pos]
+        encontrados[pos] = {
+            "linha": item.get("linha", 0),
+            "preco": aplicar_menor_preco(doc.get("preco"), item),
+            "tipo": doc.get("tipo"),
+        }
+    _estatisticas["hits"] += len(encontrados)
+    return encontrados
+
+
+async def guardar_resultados(db, tabela_hash: str, prazo, modo: str, itens, resultados) -> int:
+    agora = datetime.now(timezone.utc)
+    ops = {}
+    for item, res in zip(itens, resultados):
+        if preco_atual_do_item(item) is not None:
+            continue
+        chave = chave_item(item, modo)
+        if chave is None:
+            continue
+        id_cache = _id_cache(tabela_hash, prazo, modo, chave)
+        ops[id_cache] = UpdateOne(
+            {"_id": id_cache},
+            {"$set": {"preco": res.get("preco"), "tipo": res.get("tipo"), "created_at": agora}},
+            upsert=True,
+        )
+    if ops:
+        await db.cotacao_match_cache.bulk_write(list(ops.values()), ordered=False)
+        _estatisticas["gravados"] += len(ops)
+    return len(ops)
+
+
+def estatisticas() -> dict:
+    consultados = _estatisticas["consultados"]
+    return {
+        **_estatisticas,
+        "hit_rate": round(_estatisticas["hits"] / consultados, 4) if consultados else 0.0,
+    }
@@ -5,8 +5,11 @@ Motor de matching em 3 camadas + EAN para casamento de produtos.
 Standalone — sem classe, sem playwright, sem asyncio.
 """
 
+import os
 import re
+import time
 import unicodedata
+from functools import lru_cache
 
 try:
     from services.product_knowledge import recognize_product as _recognize_product
@@ -24,8 +27,24 @@ except ImportError:
     rfprocess = None
     _USE_RAPIDFUZZ = False
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 TAXA_SIMILARIDADE = 0.82  # era 0.75
 
+# Subir ao mudar normalização (normalizar_nome, ordenar_palavras) ou pontuação:
+# invalida os índices compilados e o cache de resultados (services.match_cache)
+MATCHER_VERSAO = 1
+
+# Matching em lote (cdist): threads do rapidfuzz e tamanho do bloco da matriz
+MATCH_WORKERS = int(os.environ.get("MATCH_WORKERS", "-1"))
+MATCH_LOTE_MIN_ITENS = 8
+MATCH_LOTE_MAX_CELULAS = 2_000_000
+CANDIDATOS_LIMITE = 40
+CANDIDATOS_SCORE_MINIMO = 55
+
 # ─────────────────────────────────────────────
 # CONSTANTES DE CATEGORIAS E TRAVAS
 # ─────────────────────────────────────────────
@@ -585,11 +604,263 @@ def ean_unidade_de_dun14(ean_limpo):
         dv = (10 - soma % 10) % 10
         return core + str(dv)
 
+# 0. SINÔNIMOS DE PREFIXO — alinha cotação com a base de preços
+# Cada tupla: (padrão regex no início do nome, substituto). Vale o primeiro
+# da lista que casar; por isso viram uma única alternância, na mesma ordem.
+_SINONIMOS_PREFIXO = [
+    # ── Papel higiênico ─────────────────────────────────────────
+    (r'^PAP\.?\s+HIG\.?',             'PAPEL HIG'),
+    (r'^PAPEL\s+ALUMINIO\b',          'PAPEL ALUM'),
+    (r'^PAPEL\s+TOALHA\b',            'TOALHA PAP'),
+    # ── Alvejante / Vanish ──────────────────────────────────────
+    (r'^VANISH\b',                    'ALV VANISH'),
+    (r'^TIRA\s+MANCHAS?\b',           'T MANCHA'),
+    # ── Saponáceo ───────────────────────────────────────────────
+    (r'^SAP[OO]LEO\b',                'SAPON SAPOLIO'),
+    (r'^SAP[OO]LIO\b',                'SAPON SAPOLIO'),
+    # ── Limpeza ─────────────────────────────────────────────────
+    (r'^LIMPA\s+FORNO',               'LIMP FORNO'),
+    (r'^LIMPA\s+ALUM',                'LIMP ALUMINIO'),
+    (r'^TIRA\s+LIM',                  'LIMP VEJA X14'),
+    # ── Desentupidor ────────────────────────────────────────────
+    (r'^DESENTUPIDOR\b',              'DESENT PIA'),
+    # ── Sabão pedra → SABAO ─────────────────────────────────────
+    (r'^SAB\.?\s+PE[DC]\.?',           'SABAO'),
+    # ── Sabão pó → LAVA ROUPA PO ────────────────────────────────
+    (r'^SAB\.?\s+P[OO]\b',             'LAVA ROUPA PO'),
+    (r'^SABAO\s+EM\s+P[OO]',           'LAVA ROUPA PO'),
+    # ── Sabão em pasta ──────────────────────────────────────────
+    (r'^SABAO\s+EM\s+PASTA',           'SABAO PASTA'),
+    (r'^SAB[OA]O\s+PASTA',             'SABAO PASTA'),
+    # ── Fralda abreviada na base ────────────────────────────────
+    (r'^FRALDA\b',                     'FRAL'),
+    # ── Amaciante concentrado ───────────────────────────────────
+    (r'^AMAC\.?\s+(COMFORT|DOWNY)',    'AMAC CONC'),
+    # ── Desinf Coala → LIMP COALA ───────────────────────────────
+    (r'^DESINF\.?\s+COALA',            'LIMP COALA'),
+    # ── Lava roupas plural ──────────────────────────────────────
+    (r'^LAVA\s+ROUPAS\b',              'LAVA ROUPA'),
+    # ── Inseticida aerosol ──────────────────────────────────────
+    (r'^INSET\.?\s+AERO\.?\s+',        'INSET '),
+    (r'^MAT\s+INSET\b',                'INSET'),
+    # ── Mistura de bolo → MIST BOLO ─────────────────────────────
+    (r'^MISTURA\s+DE\s+BOLO\b',        'MIST BOLO'),
+    (r'^CREME\s+DE\s+CEBOLA\b',         'CREME CEBOLA'),
+    (r'^EXTRATO\s+DE\s+TOMATE\b',       'EXTR TOM'),
+    (r'^EXTRATO\s+TOMATE\b',            'EXTR TOM'),
+    (r'^EXTRATO\s+ELEFANTE\b',           'EXTR TOM ELEFANTE'),
+    (r'^EXTRATO\s+FUGINI\b',             'EXTR TOM FUGINI'),
+    (r'^EXTRATO\s+QUERO\b',              'EXTR TOM QUERO'),
+    (r'^EXTRATO\s+PREDILECTA\b',         'EXTR TOM PREDILECTA'),
+    (r'^EXTRATO\s+OLE\b',                'EXTR TOM OLE'),
+    (r'^EXTRATO\s+POMAROLA\b',           'EXTR TOM POMAROLA'),
+    (r'^EXTRATO\s+SALSARETTI\b',         'EXTR TOM SALSARETTI'),
+    (r'^EXTRATO\s+SALSERETTI\b',         'EXTR TOM SALSARETTI'),
+    (r'^GELATINA\b',                   'GELATINA'),
+    (r'^PILHA\b',                      'PIL'),
+    (r'^BATERIA\b',                    'PIL'),
+    (r'^CEREAL\s+MATINAL\b',           'C.M'),
+    (r'^CEREAL\b',                     'C.M'),
+    (r'^SALGADINHO\b',                 'SALG'),
+    (r'^SARDINHA\b',                    'SARD'),
+    (r'^GUARDANAPO\b',                 'GUARD'),
+    (r'^SACO\s+LIXO\b',                'SACO LIX'),
+    (r'^LUVA\b',                       'LUVA'),
+    # ── Bombom → CHOC (coloca na categoria correta) ─────────────
+    (r'^BOMBOM\b',                     'CHOC'),
+    # ── Nectar → SUCO ───────────────────────────────────────────
+    (r'^NECTAR\b',                     'SUCO'),
+    (r'^NECTA\b',                      'SUCO'),
+    # ── Nescau → ACHOC (achocolatado pó) ────────────────────────
+    (r'^NESCAU\b',                     'ACHOC NESCAU'),
+    # ── Sustagen → SUSTAGEM ─────────────────────────────────────
+    (r'^SUSTAGEM\b',                   'SUSTAGEM'),
+    (r'^SUSTAGEN\b',                   'SUSTAGEM'),
+    (r'^ACHOC\.?\s+TODD\b',            'ACHOC TODDY'),
+    # ── Toddy sem prefixo → ACHOC TODDY ─────────────────────────
+    (r'^TODD\b',                       'ACHOC TODDY'),
+    (r'^TODDY\b',                      'ACHOC TODDY'),
+    # ── Pinga → CACHAC ──────────────────────────────────────────
+    (r'^PINGA\b',                      'CACHAC'),
+    # ── Pinho Sol → DESINF PINHOSOL ─────────────────────────────
+    (r'^PINHO[AO]\s+SOL\b',               'DESINF PINHOSOL'),
+    (r'^PINHA\s+SOL\b',                  'DESINF PINHOSOL'),
+    (r'^PINHO\s+BRIL\b',               'DESINF PINHOBRIL'),
+    # ── Polpa Pomadoro → POLPA TOM POMODORO ─────────────────────
+    (r'^POLPA\s+POMADORO',             'POLPA TOM POMODORO'),
+    # ── Pó Royal → FERMENTO ─────────────────────────────────────
+    (r'^PO\s+ROYAL\b',                 'FERMENTO D BENTA'),
+    # ── Refresco Tang (sem prefixo) ──────────────────────────────
+    (r'^REFRESCO\s+TANG\b',            'REFR TANG'),
+    # ── Maguary Concentrado → SUCO CONC MAGUARY ─────────────────
+    (r'^MAGUARY\s+CONCENTRADO',        'SUCO CONC MAGUARY'),
+    # ── Limpador Perfumado UAU → LIMP PERF ──────────────────────
+    (r'^LIMPADOR\s+PERFUMADO\s+UAU',   'LIMP PERF CASA PERF'),
+    (r'^LIM\.?\s+PERF\.?\s+UAL\b',     'LIMP PERF UAU'),
+    (r'^LIM\.?\s+PERF\.?\s+UAU\b',     'LIMP PERF UAU'),
+    (r'^LIMPADOR\s+PERF\b',            'LIMP PERF'),
+    # ── Limpador Perf Sanol → LIMP PERF ─────────────────────────
+    (r'^LIMPADOR\s+PERF\s+SANOL',      'LIMP PERF CASA PERF'),
+    # ── Veja Multiuso ────────────────────────────────────────────
+    (r'^VEJA\s+MULTIUSO\b',            'LIMP VEJA M U'),
+    # ── Vitarella sem prefixo (aceita grafia com 1 ou 2 L) ──────
+    (r'^VITARELA\b',                   'BISC VITARELLA'),
+    (r'^VITARELLA\b',                  'BISC VITARELLA'),
+    # ── Vodka Balalaika ──────────────────────────────────────────
+    (r'^VODKA\s+BALALAIKA',            'VODKA LEONOFF'),
+    # ── Queijo Ralado Vigor (40G → 50G via sinônimo) ─────────────
+    # (peso tratado pelo patch V6 — sem sinônimo aqui)
+    # ── Mostarda sem ponto ───────────────────────────────────────
+    (r'^MOSTARDA\b',                   'MOSTARDA'),
+    # ── Amac aconchego/vida macia ────────────────────────────────
+    (r'^AMAC\.?\s+',                   'AMAC '),
+    # ── Desodorante abreviado ────────────────────────────────────
+    (r'^DESOD\s+AERO\b',                 'DES AERO'),
+    (r'^DESOD\s+ROLL',                    'DES ROLL'),
+    (r'^DESOD\s+CREME\b',                'DES CREME'),
+    (r'^DESOD\s+',                        'DES '),
+    # ── Biscoito abreviado ───────────────────────────────────────
+    (r'^BISC\.?\s+RECH\.?\s+',          'BISC '),
+    (r'^BISC\.?\s+',                   'BISC '),
+    # ── Sab abreviado ────────────────────────────────────────────
+    (r'^SAB\.?\s+',                    'SAB '),
+    # ── v5.0: Prefixos adicionais para melhorar matching ────────
+    (r'^LV\s+ROUPA\s+LIQ\b',          'LAVA ROUPA LQ'),
+    (r'^LV\s+ROUPA\s+PO\b',           'LAVA ROUPA PO'),
+    (r'^LV\s+ROUPA\b',                'LAVA ROUPA'),
+    (r'^CR\s+DENTAL\b',               'CR D'),
+    (r'^COLGATE\b',                   'CR D COLGATE'),
+    (r'^SORRISO\b',                   'CR D SORRISO'),
+    (r'^ORAL\s+B\b',                  'CR D ORALB'),
+    (r'^CR\s+LEITE\b',                'CR LEITE'),
+    (r'^CR\s+PENTEAR\b',              'CR PENTE'),
+    (r'^CR\s+TRAT\b',                 'CR TRAT'),
+    (r'^ENX\s+BUC\b',                 'ENX BUC'),
+    (r'^ESC\s+BANHO\b',               'ESC BANHO'),
+    (r'^ESC\s+CABELO\b',              'ESC CAB'),
+    (r'^ESC\s+DENT\b',                'ESC DENT'),
+    (r'^ESP\s+LOUCA\b',               'ESP LOUCA'),
+    (r'^SH\+COND\b',                  'SH COND'),
+    (r'^SH\+\s+COND\b',               'SH COND'),
+    (r'^AZEITONA\b',                  'AZEITONA'),
+    (r'^APERITIVO\b',                 'APERITIVO'),
+    (r'^COQUETEL\b',                  'COQUETEL'),
+    (r'^DOCE\s+LEITE\b',              'DOCE LEITE'),
+    (r'^ACUCAR\b',                    'ACUCAR'),
+    (r'^AÇUCAR\b',                    'ACUCAR'),
+    (r'^AMIDO\b',                     'AMIDO'),
+    (r'^ANIL\b',                      'ANIL'),
+    (r'^ARROZ\b',                     'ARROZ'),
+    (r'^ALGODAO\b',                   'ALGODAO'),
+    (r'^BOMBRIL\b',                   'LA ACO BOMBRIL'),
+    (r'^VINAGRE\b',                   'VINAGRE'),
+    (r'^PALITO\s+DENTE\b',            'PALITO DENTE'),
+    (r'^RACAO\b',                     'RACAO'),
+    (r'^CERA\s+LIQ\b',               'CERA LIQ'),
+    (r'^PAPEL\s+ALUM\b',             'PAPEL ALUM'),
+    (r'^PANO\s+DE\s+CHAO\b',         'PANO CHAO'),
+    (r'^TIRA\s+FERRUGEM\b',          'TIRA FERR'),
+    (r'^SODA\s+CAUSTICA\b',          'SODA CAUSTICA'),
+    (r'^VINHO\b',                     'VIN'),
+    (r'^OLEO\s+DE\s+',               'OLEO '),
+]
+
+_RE_SINONIMOS_PREFIXO = re.compile(
+    '^(?:' + '|'.join(
+        f'(?P<s{i}>{padrao[1:]})' for i, (padrao, _sub) in enumerate(_SINONIMOS_PREFIXO)
+    ) + ')'
+)
+
+# 9. SINÔNIMOS GERAIS EXPANDIDOS (v3.0 + v4.7) — aplicados em ordem
+_SINONIMOS_GERAIS = {
+    # Lava-roupa
+    "SABAO EM PO": "LAVA ROUPA PO", "SABAO PO": "LAVA ROUPA PO",
+    "DETERGENTE EM PO": "LAVA ROUPA PO", "DETERGENTE PO": "LAVA ROUPA PO",
+    "DETERGENTE ROUPA PO": "LAVA ROUPA PO",
+    "SABAO LIQUIDO": "LAVA ROUPA LIQ", "LAVA ROUPAS": "LAVA ROUPA",
+    "LAVA ROUPA LIQUIDO": "LAVA ROUPA LIQ", "LAVA ROUPA LQ": "LAVA ROUPA LIQ", "LIQUIDO": "LIQ",
+    # Produto
+    "TRADICIONAL": "TRAD", "ORIGINAL": "ORIG", "MACARRAO": "MACAR",
+    "SHAMPOO": "SH", "SHAMP": "SH", "CONDICIONADOR": "COND",
+    "DETERGENTE": "DET", "DESINFETANTE": "DESINF",
+    # Embalagem
+    "CAIXA": "CX", "VIDRO": "VD", "SAQUINHO": "SACHE",
+    "SACHET": "SACHE", "PACOTE": "PCT", "LATA": "LT",
+    "BISNAGA": "BISNAGA", "GARRAFA": "GAR", "FRASCO": "FRASCO",
+    # Higiene / Limpeza
+    "AGUA SANITARIA": "SANITARIA", "AGUA DE COCO": "AGUA COCO",
+    "PAPEL HIGIENICO": "PAPEL HIG", "PAPEL TOALHA": "PAPEL TOALHA",
+    # Bebidas
+    "COM GAS": "CGAS", "SEM GAS": "SGAS",
+    # Bebidas - suco/refresco (PO = pó, price table não usa)
+    "REFRESCO PO": "REFR", "REFRESCO": "REFR", "SUCO PO": "REFR",
+    "CONCENTRADO": "CONC",
+    # Bebidas - vinho
+    "BEB VINHO": "VIN",
+    # Biscoito
+    "BOLACHA": "BISC", "BISCOITO": "BISC", "CREAM CRACKER": "CREAM CRACKER",
+    "RECHEADO": "RECHEADO",
+    "WAFER": "WAFER",
+    # Desodorante
+    "DESODORANTE ANTITRANSPIRANTE": "DESOD ANTITRANSP", "ANTITRANSPIRANTE": "ANTITRANSP",
+    "DESODORANTE AEROSSOL": "DESOD AEROSSOL", "DESODORANTE AEROSOL": "DESOD AEROSSOL",
+    "DESODORANTE ROLL ON": "DESOD ROLL ON", "DESODORANTE ROLL-ON": "DESOD ROLL ON",
+    "DESODORANTE SPRAY": "DESOD SPRAY", "DESODORANTE STICK": "DESOD STICK",
+    "DESODORANTE COLONIA": "DEO COLONIA", "DESODORANTE COLÔNIA": "DEO COLONIA",
+    "DEO COLONIA": "DEO COLONIA", "DEO COLOGNE": "DEO COLONIA", "BODY SPLASH": "BODY SPLASH",
+    # Azeite
+    "AZEITE DE OLIVA": "AZEITE", "AZEITE OLIVA": "AZEITE",
+    "AZEITE EXTRAVIRGEM": "AZEITE EXTRAVIGEM", "AZEITE EXTRA VIRGEM": "AZEITE EXTRAVIRGEM",
+    # v5.0: Sinônimos adicionais
+    "ACHOCOLATADO": "ACHOC", "ACHOCOLATADO PO": "ACHOC PO",
+    "DESINFETANTE": "DESINF", "AMACIANTE": "AMAC",
+    "DETERGENTE LIQUIDO": "DET LIQ", "DETERGENTE LIQ": "DET LIQ",
+    "LV LOUCA": "DET",
+    "SABONETE": "SAB", "SABONETE LIQUIDO": "SAB LIQ",
+    "PAPEL HIGIENICO": "PAPEL HIG",
+    "PAPEL TOALHA": "PAPEL TOALHA",
+    "GUARDA NAPOLITANO": "GUARDANAPO",
+    "AZEITONA VERDE": "AZEITONA VDE",
+    "ACHOC PO": "ACHOC PO",
+    "LEITE CONDENSADO": "LEITE COND", "LEITE CONDECADO": "LEITE COND",
+    "LEITE EM PO": "LEITE PO",
+    "COCO RALADO": "COCO RAL", "FLOCOS DE COCO": "COCO RAL FLOCOS",
+    "CASA E PERFUME": "LIMP PERF CASA PERF", "CASA&PERFUME": "LIMP PERF CASA PERF",
+    "CREME DENTAL": "CR D",
+    "CREME DE LEITE": "CR LEITE",
+    "CREME TRATAMENTO": "CR TRAT",
+    "CREME PENTEAR": "CR PENTE",
+    "ENXAGUE BUCAL": "ENX BUC",
+    "ESCOVA DENTAL": "ESC DENT",
+    "ESCOVA CABELO": "ESC CAB",
+    "ESPONJA LOUCA": "ESP LOUCA",
+    # Creme dental — variantes de grafia para a mesma linha
+    "TOTAL 12": "TOTAL12",
+    "NEUTRAZUCAR": "NEUTRACUCAR",
+    "SENSITIVE": "SENSIVEL",
+}
+
+# Usar word boundary para evitar QUERO dentro de QUEROSENE, etc
+_PADROES_INTELIGENCIA_MARCAS = [
+    (marca, categoria, re.compile(r'(?<![A-Za-z])' + re.escape(marca) + r'(?![A-Za-z])'))
+    for marca, categoria in inteligencia_marcas.items()
+]
+
+NORMALIZAR_CACHE_MAX = int(os.environ.get("NORMALIZAR_CACHE_MAX", "200000"))
+
 def normalizar_nome(nome):
         """Normalização completa v4.0 — Turbo + Ajustes v5.0 + HTML decode"""
-        if not nome or not nome or str(nome).lower() == 'nan':
+        if not nome:
+            return ""
+        return _normalizar_nome_cache(str(nome))
+
+@lru_cache(maxsize=NORMALIZAR_CACHE_MAX)
+def _normalizar_nome_cache(nome):
+        # Mesmo nome chega várias vezes (tabela, cotação, aprendizado): memoiza
+        # pela string original.
+        if nome.lower() == 'nan':
             return ""
-        nome = unicodedata.normalize('NFKD', str(nome)).encode('ASCII', 'ignore').decode('utf-8')
+        nome = unicodedata.normalize('NFKD', nome).encode('ASCII', 'ignore').decode('utf-8')
         nome = nome.upper().strip()
 
         # 0-pre. DECODIFICAÇÃO DE HTML ENTITIES (vindo de Excel/XML)
@@ -603,169 +874,10 @@ def normalizar_nome(nome):
         nome = nome.replace("HELMANNS", "HELLMANNS")
 
         # 0. SINÔNIMOS DE PREFIXO — alinha cotação com a base de preços
-        # Cada tupla: (padrão regex no início do nome, substituto)
-        _SINONIMOS = [
-            # ── Papel higiênico ─────────────────────────────────────────
-            (r'^PAP\.?\s+HIG\.?',             'PAPEL HIG'),
-            (r'^PAPEL\s+ALUMINIO\b',          'PAPEL ALUM'),
-            (r'^PAPEL\s+TOALHA\b',            'TOALHA PAP'),
-            # ── Alvejante / Vanish ──────────────────────────────────────
-            (r'^VANISH\b',                    'ALV VANISH'),
-            (r'^TIRA\s+MANCHAS?\b',           'T MANCHA'),
-            # ── Saponáceo ───────────────────────────────────────────────
-            (r'^SAP[OO]LEO\b',                'SAPON SAPOLIO'),
-            (r'^SAP[OO]LIO\b',                'SAPON SAPOLIO'),
-            # ── Limpeza ─────────────────────────────────────────────────
-            (r'^LIMPA\s+FORNO',               'LIMP FORNO'),
-            (r'^LIMPA\s+ALUM',                'LIMP ALUMINIO'),
-            (r'^TIRA\s+LIM',                  'LIMP VEJA X14'),
-            # ── Desentupidor ────────────────────────────────────────────
-            (r'^DESENTUPIDOR\b',              'DESENT PIA'),
-            # ── Sabão pedra → SABAO ─────────────────────────────────────
-            (r'^SAB\.?\s+PE[DC]\.?',           'SABAO'),
-            # ── Sabão pó → LAVA ROUPA PO ────────────────────────────────
-            (r'^SAB\.?\s+P[OO]\b',             'LAVA ROUPA PO'),
-            (r'^SABAO\s+EM\s+P[OO]',           'LAVA ROUPA PO'),
-            # ── Sabão em pasta ──────────────────────────────────────────
-            (r'^SABAO\s+EM\s+PASTA',           'SABAO PASTA'),
-            (r'^SAB[OA]O\s+PASTA',             'SABAO PASTA'),
-            # ── Fralda abreviada na base ────────────────────────────────
-            (r'^FRALDA\b',                     'FRAL'),
-            # ── Amaciante concentrado ───────────────────────────────────
-            (r'^AMAC\.?\s+(COMFORT|DOWNY)',    'AMAC CONC'),
-            # ── Desinf Coala → LIMP COALA ───────────────────────────────
-            (r'^DESINF\.?\s+COALA',            'LIMP COALA'),
-            # ── Lava roupas plural ──────────────────────────────────────
-            (r'^LAVA\s+ROUPAS\b',              'LAVA ROUPA'),
-            # ── Inseticida aerosol ──────────────────────────────────────
-            (r'^INSET\.?\s+AERO\.?\s+',        'INSET '),
-            (r'^MAT\s+INSET\b',                'INSET'),
-            # ── Mistura de bolo → MIST BOLO ─────────────────────────────
-            (r'^MISTURA\s+DE\s+BOLO\b',        'MIST BOLO'),
-            (r'^CREME\s+DE\s+CEBOLA\b',         'CREME CEBOLA'),
-            (r'^EXTRATO\s+DE\s+TOMATE\b',       'EXTR TOM'),
-            (r'^EXTRATO\s+TOMATE\b',            'EXTR TOM'),
-            (r'^EXTRATO\s+ELEFANTE\b',           'EXTR TOM ELEFANTE'),
-            (r'^EXTRATO\s+FUGINI\b',             'EXTR TOM FUGINI'),
-            (r'^EXTRATO\s+QUERO\b',              'EXTR TOM QUERO'),
-            (r'^EXTRATO\s+PREDILECTA\b',         'EXTR TOM PREDILECTA'),
-            (r'^EXTRATO\s+OLE\b',                'EXTR TOM OLE'),
-            (r'^EXTRATO\s+POMAROLA\b',           'EXTR TOM POMAROLA'),
-            (r'^EXTRATO\s+SALSARETTI\b',         'EXTR TOM SALSARETTI'),
-            (r'^EXTRATO\s+SALSERETTI\b',         'EXTR TOM SALSARETTI'),
-            (r'^GELATINA\b',                   'GELATINA'),
-            (r'^PILHA\b',                      'PIL'),
-            (r'^BATERIA\b',                    'PIL'),
-            (r'^CEREAL\s+MATINAL\b',           'C.M'),
-            (r'^CEREAL\b',                     'C.M'),
-            (r'^SALGADINHO\b',                 'SALG'),
-            (r'^SARDINHA\b',                    'SARD'),
-            (r'^GUARDANAPO\b',                 'GUARD'),
-            (r'^SACO\s+LIXO\b',                'SACO LIX'),
-            (r'^LUVA\b',                       'LUVA'),
-            # ── Bombom → CHOC (coloca na categoria correta) ─────────────
-            (r'^BOMBOM\b',                     'CHOC'),
-            # ── Nectar → SUCO ───────────────────────────────────────────
-            (r'^NECTAR\b',                     'SUCO'),
-            (r'^NECTA\b',                      'SUCO'),
-            # ── Nescau → ACHOC (achocolatado pó) ────────────────────────
-            (r'^NESCAU\b',                     'ACHOC NESCAU'),
-            # ── Sustagen → SUSTAGEM ─────────────────────────────────────
-            (r'^SUSTAGEM\b',                   'SUSTAGEM'),
-            (r'^SUSTAGEN\b',                   'SUSTAGEM'),
-            (r'^ACHOC\.?\s+TODD\b',            'ACHOC TODDY'),
-            # ── Toddy sem prefixo → ACHOC TODDY ─────────────────────────
-            (r'^TODD\b',                       'ACHOC TODDY'),
-            (r'^TODDY\b',                      'ACHOC TODDY'),
-            # ── Pinga → CACHAC ──────────────────────────────────────────
-            (r'^PINGA\b',                      'CACHAC'),
-            # ── Pinho Sol → DESINF PINHOSOL ─────────────────────────────
-            (r'^PINHO[AO]\s+SOL\b',               'DESINF PINHOSOL'),
-            (r'^PINHA\s+SOL\b',                  'DESINF PINHOSOL'),
-            (r'^PINHO\s+BRIL\b',               'DESINF PINHOBRIL'),
-            # ── Polpa Pomadoro → POLPA TOM POMODORO ─────────────────────
-            (r'^POLPA\s+POMADORO',             'POLPA TOM POMODORO'),
-            # ── Pó Royal → FERMENTO ─────────────────────────────────────
-            (r'^PO\s+ROYAL\b',                 'FERMENTO D BENTA'),
-            # ── Refresco Tang (sem prefixo) ──────────────────────────────
-            (r'^REFRESCO\s+TANG\b',            'REFR TANG'),
-            # ── Maguary Concentrado → SUCO CONC MAGUARY ─────────────────
-            (r'^MAGUARY\s+CONCENTRADO',        'SUCO CONC MAGUARY'),
-            # ── Limpador Perfumado UAU → LIMP PERF ──────────────────────
-            (r'^LIMPADOR\s+PERFUMADO\s+UAU',   'LIMP PERF CASA PERF'),
-            (r'^LIM\.?\s+PERF\.?\s+UAL\b',     'LIMP PERF UAU'),
-            (r'^LIM\.?\s+PERF\.?\s+UAU\b',     'LIMP PERF UAU'),
-            (r'^LIMPADOR\s+PERF\b',            'LIMP PERF'),
-            # ── Limpador Perf Sanol → LIMP PERF ─────────────────────────
-            (r'^LIMPADOR\s+PERF\s+SANOL',      'LIMP PERF CASA PERF'),
-            # ── Veja Multiuso ────────────────────────────────────────────
-            (r'^VEJA\s+MULTIUSO\b',            'LIMP VEJA M U'),
-            # ── Vitarella sem prefixo (aceita grafia com 1 ou 2 L) ──────
-            (r'^VITARELA\b',                   'BISC VITARELLA'),
-            (r'^VITARELLA\b',                  'BISC VITARELLA'),
-            # ── Vodka Balalaika ──────────────────────────────────────────
-            (r'^VODKA\s+BALALAIKA',            'VODKA LEONOFF'),
-            # ── Queijo Ralado Vigor (40G → 50G via sinônimo) ─────────────
-            # (peso tratado pelo patch V6 — sem sinônimo aqui)
-            # ── Mostarda sem ponto ───────────────────────────────────────
-            (r'^MOSTARDA\b',                   'MOSTARDA'),
-            # ── Amac aconchego/vida macia ────────────────────────────────
-            (r'^AMAC\.?\s+',                   'AMAC '),
-            # ── Desodorante abreviado ────────────────────────────────────
-            (r'^DESOD\s+AERO\b',                 'DES AERO'),
-            (r'^DESOD\s+ROLL',                    'DES ROLL'),
-            (r'^DESOD\s+CREME\b',                'DES CREME'),
-            (r'^DESOD\s+',                        'DES '),
-            # ── Biscoito abreviado ───────────────────────────────────────
-            (r'^BISC\.?\s+RECH\.?\s+',          'BISC '),
-            (r'^BISC\.?\s+',                   'BISC '),
-            # ── Sab abreviado ────────────────────────────────────────────
-            (r'^SAB\.?\s+',                    'SAB '),
-            # ── v5.0: Prefixos adicionais para melhorar matching ────────
-            (r'^LV\s+ROUPA\s+LIQ\b',          'LAVA ROUPA LQ'),
-            (r'^LV\s+ROUPA\s+PO\b',           'LAVA ROUPA PO'),
-            (r'^LV\s+ROUPA\b',                'LAVA ROUPA'),
-            (r'^CR\s+DENTAL\b',               'CR D'),
-            (r'^COLGATE\b',                   'CR D COLGATE'),
-            (r'^SORRISO\b',                   'CR D SORRISO'),
-            (r'^ORAL\s+B\b',                  'CR D ORALB'),
-            (r'^CR\s+LEITE\b',                'CR LEITE'),
-            (r'^CR\s+PENTEAR\b',              'CR PENTE'),
-            (r'^CR\s+TRAT\b',                 'CR TRAT'),
-            (r'^ENX\s+BUC\b',                 'ENX BUC'),
-            (r'^ESC\s+BANHO\b',               'ESC BANHO'),
-            (r'^ESC\s+CABELO\b',              'ESC CAB'),
-            (r'^ESC\s+DENT\b',                'ESC DENT'),
-            (r'^ESP\s+LOUCA\b',               'ESP LOUCA'),
-            (r'^SH\+COND\b',                  'SH COND'),
-            (r'^SH\+\s+COND\b',               'SH COND'),
-            (r'^AZEITONA\b',                  'AZEITONA'),
-            (r'^APERITIVO\b',                 'APERITIVO'),
-            (r'^COQUETEL\b',                  'COQUETEL'),
-            (r'^DOCE\s+LEITE\b',              'DOCE LEITE'),
-            (r'^ACUCAR\b',                    'ACUCAR'),
-            (r'^AÇUCAR\b',                    'ACUCAR'),
-            (r'^AMIDO\b',                     'AMIDO'),
-            (r'^ANIL\b',                      'ANIL'),
-            (r'^ARROZ\b',                     'ARROZ'),
-            (r'^ALGODAO\b',                   'ALGODAO'),
-            (r'^BOMBRIL\b',                   'LA ACO BOMBRIL'),
-            (r'^VINAGRE\b',                   'VINAGRE'),
-            (r'^PALITO\s+DENTE\b',            'PALITO DENTE'),
-            (r'^RACAO\b',                     'RACAO'),
-            (r'^CERA\s+LIQ\b',               'CERA LIQ'),
-            (r'^PAPEL\s+ALUM\b',             'PAPEL ALUM'),
-            (r'^PANO\s+DE\s+CHAO\b',         'PANO CHAO'),
-            (r'^TIRA\s+FERRUGEM\b',          'TIRA FERR'),
-            (r'^SODA\s+CAUSTICA\b',          'SODA CAUSTICA'),
-            (r'^VINHO\b',                     'VIN'),
-            (r'^OLEO\s+DE\s+',               'OLEO '),
-        ]
-        for _pat, _sub in _SINONIMOS:
-            if re.match(_pat, nome):
-                _resto = re.sub(_pat, '', nome).strip()
-                nome = (_sub + ' ' + _resto).strip()
-                break
+        m = _RE_SINONIMOS_PREFIXO.match(nome)
+        if m:
+            _sub = _SINONIMOS_PREFIXO[int(m.lastgroup[1:])][1]
+            nome = (_sub + ' ' + nome[m.end():].strip()).strip()
 
         # 0b. Corrige vírgulas em números decimais (46,2 → 46.2, 1,5 → 1.5)
         nome = re.sub(r'(\d+),(\d+)', r'\1.\2', nome)
@@ -946,83 +1058,15 @@ def normalizar_nome(nome):
         nome = re.sub(r'\.(\s|$)', r'\1', nome)
 
         # 9. SINÔNIMOS GERAIS EXPANDIDOS (v3.0 + v4.7)
-        sinonimos = {
-            # Lava-roupa
-            "SABAO EM PO": "LAVA ROUPA PO", "SABAO PO": "LAVA ROUPA PO",
-            "DETERGENTE EM PO": "LAVA ROUPA PO", "DETERGENTE PO": "LAVA ROUPA PO",
-            "DETERGENTE ROUPA PO": "LAVA ROUPA PO",
-            "SABAO LIQUIDO": "LAVA ROUPA LIQ", "LAVA ROUPAS": "LAVA ROUPA",
-            "LAVA ROUPA LIQUIDO": "LAVA ROUPA LIQ", "LAVA ROUPA LQ": "LAVA ROUPA LIQ", "LIQUIDO": "LIQ",
-            # Produto
-            "TRADICIONAL": "TRAD", "ORIGINAL": "ORIG", "MACARRAO": "MACAR",
-            "SHAMPOO": "SH", "SHAMP": "SH", "CONDICIONADOR": "COND",
-            "DETERGENTE": "DET", "DESINFETANTE": "DESINF",
-            # Embalagem
-            "CAIXA": "CX", "VIDRO": "VD", "SAQUINHO": "SACHE",
-            "SACHET": "SACHE", "PACOTE": "PCT", "LATA": "LT",
-            "BISNAGA": "BISNAGA", "GARRAFA": "GAR", "FRASCO": "FRASCO",
-            # Higiene / Limpeza
-            "AGUA SANITARIA": "SANITARIA", "AGUA DE COCO": "AGUA COCO",
-            "PAPEL HIGIENICO": "PAPEL HIG", "PAPEL TOALHA": "PAPEL TOALHA",
-            # Bebidas
-            "COM GAS": "CGAS", "SEM GAS": "SGAS",
-            # Bebidas - suco/refresco (PO = pó, price table não usa)
-            "REFRESCO PO": "REFR", "REFRESCO": "REFR", "SUCO PO": "REFR",
-            "CONCENTRADO": "CONC",
-            # Bebidas - vinho
-            "BEB VINHO": "VIN",
-            # Biscoito
-            "BOLACHA": "BISC", "BISCOITO": "BISC", "CREAM CRACKER": "CREAM CRACKER",
-            "RECHEADO": "RECHEADO",
-            "WAFER": "WAFER",
-            # Desodorante
-            "DESODORANTE ANTITRANSPIRANTE": "DESOD ANTITRANSP", "ANTITRANSPIRANTE": "ANTITRANSP",
-            "DESODORANTE AEROSSOL": "DESOD AEROSSOL", "DESODORANTE AEROSOL": "DESOD AEROSSOL",
-            "DESODORANTE ROLL ON": "DESOD ROLL ON", "DESODORANTE ROLL-ON": "DESOD ROLL ON",
-            "DESODORANTE SPRAY": "DESOD SPRAY", "DESODORANTE STICK": "DESOD STICK",
-            "DESODORANTE COLONIA": "DEO COLONIA", "DESODORANTE COLÔNIA": "DEO COLONIA",
-            "DEO COLONIA": "DEO COLONIA", "DEO COLOGNE": "DEO COLONIA", "BODY SPLASH": "BODY SPLASH",
-            # Azeite
-            "AZEITE DE OLIVA": "AZEITE", "AZEITE OLIVA": "AZEITE",
-            "AZEITE EXTRAVIRGEM": "AZEITE EXTRAVIGEM", "AZEITE EXTRA VIRGEM": "AZEITE EXTRAVIRGEM",
-            # v5.0: Sinônimos adicionais
-            "ACHOCOLATADO": "ACHOC", "ACHOCOLATADO PO": "ACHOC PO",
-            "DESINFETANTE": "DESINF", "AMACIANTE": "AMAC",
-            "DETERGENTE LIQUIDO": "DET LIQ", "DETERGENTE LIQ": "DET LIQ",
-            "LV LOUCA": "DET",
-            "SABONETE": "SAB", "SABONETE LIQUIDO": "SAB LIQ",
-            "PAPEL HIGIENICO": "PAPEL HIG",
-            "PAPEL TOALHA": "PAPEL TOALHA",
-            "GUARDA NAPOLITANO": "GUARDANAPO",
-            "AZEITONA VERDE": "AZEITONA VDE",
-            "ACHOC PO": "ACHOC PO",
-            "LEITE CONDENSADO": "LEITE COND", "LEITE CONDECADO": "LEITE COND",
-            "LEITE EM PO": "LEITE PO",
-            "COCO RALADO": "COCO RAL", "FLOCOS DE COCO": "COCO RAL FLOCOS",
-            "CASA E PERFUME": "LIMP PERF CASA PERF", "CASA&PERFUME": "LIMP PERF CASA PERF",
-            "CREME DENTAL": "CR D",
-            "CREME DE LEITE": "CR LEITE",
-            "CREME TRATAMENTO": "CR TRAT",
-            "CREME PENTEAR": "CR PENTE",
-            "ENXAGUE BUCAL": "ENX BUC",
-            "ESCOVA DENTAL": "ESC DENT",
-            "ESCOVA CABELO": "ESC CAB",
-            "ESPONJA LOUCA": "ESP LOUCA",
-            # Creme dental — variantes de grafia para a mesma linha
-            "TOTAL 12": "TOTAL12",
-            "NEUTRAZUCAR": "NEUTRACUCAR",
-            "SENSITIVE": "SENSIVEL",
-        }
-        for k, v in sinonimos.items():
+        for k, v in _SINONIMOS_GERAIS.items():
             nome = nome.replace(k, v)
 
         # 10. INTELIGÊNCIA DE MARCAS — expandida (v3.0)
 
         # Categorias que não devem receber injeção de categoria extra
         _nome_cat = nome.split()[0] if nome.split() else ''
-        for marca, categoria in inteligencia_marcas.items():
-            # Usar word boundary para evitar QUERO dentro de QUEROSENE, etc
-            if not re.search(r'(?<![A-Za-z])' + re.escape(marca) + r'(?![A-Za-z])', nome):
+        for marca, categoria, padrao in _PADROES_INTELIGENCIA_MARCAS:
+            if not padrao.search(nome):
                 continue
             if categoria.split()[0] not in nome:
                 # Não injetar se o nome já tem uma categoria válida diferente
@@ -1300,10 +1344,9 @@ def _conhecimento_produto_incompativel(nome1, nome2):
         """
         if _recognize_product is None:
             return False
-        try:
-            p1 = _recognize_product(nome1)
-            p2 = _recognize_product(nome2)
-        except Exception:
+        p1 = _produto_reconhecido(nome1)
+        p2 = _produto_reconhecido(nome2)
+        if p1 is None or p2 is None:
             return False
 
         if p1.get("confianca", 0) < 0.7 or p2.get("confianca", 0) < 0.7:
@@ -1346,9 +1389,9 @@ def _sabores_caldo_incompativeis(nome1, nome2):
 
 def _snack_sabor_incompativel(nome1, nome2):
         """Batata/salgadinho exige mesmo sabor/linha quando sabor aparece."""
-        cats1 = _categorias_seguras(nome1)
-        cats2 = _categorias_seguras(nome2)
-        if not (cats1 & cats2 & {'BATATA', 'SALG'}):
+        f1 = _features_nome(nome1)
+        f2 = _features_nome(nome2)
+        if not (f1['cats_seguras'] & f2['cats_seguras'] & {'BATATA', 'SALG'}):
             return False
 
         sabores_snack = {
@@ -1357,10 +1400,8 @@ def _snack_sabor_incompativel(nome1, nome2):
             'PIMENTA', 'PICANTE', 'CREME', 'CREM', 'NACHO', 'PRESUNTO',
             'BARBECUE', 'BBQ', 'RANCH', 'CREAMCHEESE',
         }
-        tokens1 = set(re.findall(r'[A-Z]{3,}', nome1))
-        tokens2 = set(re.findall(r'[A-Z]{3,}', nome2))
-        sabor1 = tokens1 & sabores_snack
-        sabor2 = tokens2 & sabores_snack
+        sabor1 = f1['tokens3'] & sabores_snack
+        sabor2 = f2['tokens3'] & sabores_snack
         return bool(sabor1 and sabor2 and not sabor1.intersection(sabor2))
 
 def _tem_sinal_categoria(nome, sinal):
@@ -1428,15 +1469,63 @@ def _marcas_para_categorias(categorias):
         for categoria in categorias:
             for chave in mapa.get(categoria, (categoria,)):
                 marcas.update(MARCAS_POR_CATEGORIA.get(chave, set()))
-        marcas.update({'CANDURA', 'ALPES', 'BARBAREX', 'HARPIC', 'UFENOL'})
+        marcas.update(_MARCAS_EXTRAS_SEGURAS)
         return marcas
 
+_MARCAS_EXTRAS_SEGURAS = {'CANDURA', 'ALPES', 'BARBAREX', 'HARPIC', 'UFENOL'}
+_MARCAS_CATEGORIAS = frozenset().union(*MARCAS_POR_CATEGORIA.values())
+_TODAS_MARCAS = _MARCAS_CATEGORIAS | _MARCAS_EXTRAS_SEGURAS
+_CATEGORIAS_DA_MARCA = {}
+for _cat, _marcas_cat in MARCAS_POR_CATEGORIA.items():
+    for _marca in _marcas_cat:
+        _CATEGORIAS_DA_MARCA.setdefault(_marca, []).append(_cat)
+del _cat, _marcas_cat, _marca
+
+@lru_cache(maxsize=4096)
+def _marcas_para_categorias_cache(categorias):
+        return frozenset(_marcas_para_categorias(categorias))
+
+def _indexar_marcas(marcas):
+        """Marcas agrupadas pela primeira palavra, mais longas primeiro."""
+        indice = {}
+        for marca in sorted(marcas, key=lambda m: (-len(m), m)):
+            palavras = marca.split()
+            if palavras:
+                indice.setdefault(palavras[0], []).append(marca)
+        return indice
+
+_INDICE_MARCAS = _indexar_marcas(_TODAS_MARCAS)
+_RE_PALAVRA = re.compile(r'\S+')
+
+def _buscar_marcas(nome, indice):
+        """
+        Uma passada pelo nome: em cada início de palavra testa só as marcas
+        que começam com aquela palavra. Mesma fronteira do padrão antigo
+        ``(?:^|(?<=\\s))MARCA(?=\\s|$)``, inclusive marcas sobrepostas.
+        """
+        achadas = set()
+        tamanho = len(nome)
+        for m in _RE_PALAVRA.finditer(nome):
+            candidatas = indice.get(m.group())
+            if not candidatas:
+                continue
+            inicio = m.start()
+            for marca in candidatas:
+                fim = inicio + len(marca)
+                if nome.startswith(marca, inicio) and (fim == tamanho or nome[fim].isspace()):
+                    achadas.add(marca)
+        return achadas
+
+def _marcas_presentes(nome):
+        """Todas as marcas conhecidas que aparecem como palavra inteira no nome."""
+        return frozenset(_buscar_marcas(nome, _INDICE_MARCAS))
+
 def _marcas_no_nome(nome, marcas):
-        encontradas = set()
-        for marca in sorted(marcas, key=len, reverse=True):
-            padrao = r'(?:^|(?<=\s))' + re.escape(marca) + r'(?=\s|$)'
-            if re.search(padrao, nome):
-                encontradas.add(marca)
+        marcas = set(marcas)
+        encontradas = marcas & _features_nome(nome)['marcas']
+        desconhecidas = marcas - _TODAS_MARCAS
+        if desconhecidas:
+            encontradas |= _buscar_marcas(nome, _indexar_marcas(desconhecidas))
         return encontradas
 
 def _fragrancias_no_nome(nome):
@@ -1464,23 +1553,84 @@ def _contagens_embalagem(nome):
             contagens.add(('PAGUE', valor))
         return contagens
 
+_CAT_EQUIV_PREFIXO = {
+        'DET': 'LV LOUCA', 'DETERGENTE': 'LV LOUCA',
+        'DESINFETANTE': 'DESINF', 'SABAO': 'SAB',
+        'BISCOITO': 'BISC', 'AGUARDENTE': 'AGUARD',
+        'CACHACA': 'CACHAC', 'SHAMPOO': 'SH',
+        'CONDICIONADOR': 'COND', 'REPELENTE': 'REPEL',
+        'MACAR': 'MAC', 'MAIONESE': 'MAION',
+        'POLPA TOM': 'MOL TOM', 'POLPA': 'MOL TOM',
+        'FRALDA': 'FRAL', 'PAPEL HIGIENICO': 'PAPEL HIG',
+        'CATCHUP': 'KETCHUP', 'T MANCHA': 'ALV',
+        'SABAO BARRA': 'SABAO', 'SABAO PASTA': 'SABAO',
+}
+
+def _subtipo_no_nome(sub, nome):
+        if ' ' in sub:
+            return sub in nome
+        return bool(re.search(r'(?<![A-Z0-9])' + re.escape(sub) + r'(?![A-Z0-9])', nome))
+
+@lru_cache(maxsize=50000)
+def _produto_reconhecido(nome):
+        # Fora do registro de features: é caro e só chega aqui quem passou
+        # pelas travas baratas.
+        try:
+            return _recognize_product(nome)
+        except Exception:
+            return None
+
+@lru_cache(maxsize=50000)
+def _features_nome(nome):
+        """
+        Tudo que as travas extraem de um nome sozinho, calculado uma vez por
+        nome normalizado (linha da tabela ou item da cotação). As travas de
+        par viram comparações de conjuntos sobre estes registros.
+        Não alterar os conjuntos devolvidos: o registro é compartilhado.
+        """
+        cats_prefixo_bruto = frozenset(
+            c for c in MARCAS_POR_CATEGORIA if c + ' ' in nome or nome == c
+        )
+        marcas = _marcas_presentes(nome)
+        marcas_categoria = marcas & _MARCAS_CATEGORIAS
+        return {
+            'tokens3': frozenset(re.findall(r'[A-Z]{3,}', nome)),
+            'cats_seguras': frozenset(_categorias_seguras(nome)),
+            'cats_prefixo_bruto': cats_prefixo_bruto,
+            'cats_prefixo': frozenset(_CAT_EQUIV_PREFIXO.get(c, c) for c in cats_prefixo_bruto),
+            'cats_aplica': frozenset(c for c in cats_prefixo_bruto if c + ' ' in nome),
+            'marcas': marcas,
+            # Marca mais longa primeiro (compostas antes de simples); empate em ordem alfabética
+            'marca': min(marcas_categoria, key=lambda m: (-len(m), m)) if marcas_categoria else "",
+            'medidas': frozenset(_extrair_medidas(nome)),
+            'dimensoes_papel': frozenset(_extrair_dimensoes_papel_alum(nome)),
+            'fragrancias': frozenset(_fragrancias_no_nome(nome)),
+            'contagens': frozenset(_contagens_embalagem(nome)),
+            'subtipos': tuple(
+                next((sub for sub in grupo if _subtipo_no_nome(sub, nome)), None)
+                for grupo in SUBTIPOS_EXCLUSIVOS
+            ),
+        }
+
 def _travas_seguras_nome(nome1, nome2):
         """
         Travas conservadoras para impedir preco de produto parecido mas diferente.
         Usada tambem no matching relaxado para nao deixar a camada 2 contornar
         categoria, marca, fragrancia ou embalagem.
         """
-        cats1 = _categorias_seguras(nome1)
-        cats2 = _categorias_seguras(nome2)
+        f1 = _features_nome(nome1)
+        f2 = _features_nome(nome2)
+        cats1 = f1['cats_seguras']
+        cats2 = f2['cats_seguras']
 
         if cats1 and cats2 and not cats1.intersection(cats2):
             return True
 
         cats_comuns = cats1.intersection(cats2)
         if cats_comuns:
-            marcas = _marcas_para_categorias(cats_comuns)
-            marcas1 = _marcas_no_nome(nome1, marcas)
-            marcas2 = _marcas_no_nome(nome2, marcas)
+            marcas = _marcas_para_categorias_cache(frozenset(cats_comuns))
+            marcas1 = marcas & f1['marcas']
+            marcas2 = marcas & f2['marcas']
             if marcas1 and marcas2 and not marcas1.intersection(marcas2):
                 return True
             cats_marca_obrigatoria = {
@@ -1502,16 +1652,16 @@ def _travas_seguras_nome(nome1, nome2):
             'LAVA ROUPA', 'LIMPADOR', 'LIMPA VIDRO', 'LUSTRA MOVEL', 'SAPONACEO',
         }
         if cats1 & cats2 & cats_variantes:
-            frag1 = _fragrancias_no_nome(nome1)
-            frag2 = _fragrancias_no_nome(nome2)
+            frag1 = f1['fragrancias']
+            frag2 = f2['fragrancias']
             if bool(frag1) != bool(frag2):
                 return True
             if frag1 and frag2 and frag1 != frag2:
                 return True
 
         if cats1 & cats2 & {'FRAL', 'INSET', 'APAR', 'COPO'}:
-            embal1 = _contagens_embalagem(nome1)
-            embal2 = _contagens_embalagem(nome2)
+            embal1 = f1['contagens']
+            embal2 = f2['contagens']
             if cats1 & cats2 & {'COPO'} and bool(embal1) != bool(embal2):
                 return True
             if embal1 and embal2 and not embal1.intersection(embal2):
@@ -1531,39 +1681,25 @@ def nomes_incompativeis_v4(nome1, nome2):
         # Se os nomes pertencem a categorias DIFERENTES → bloqueia
         # Ex: "MARG VIGOR" vs "MAIONESE VIGOR" → MARG ≠ MAIONESE → BLOQUEADO
         # Categorias equivalentes: DET↔LV LOUCA, DESINF↔DESINFETANTE, etc.
-        _CAT_EQUIV = {
-            'DET': 'LV LOUCA', 'DETERGENTE': 'LV LOUCA',
-            'DESINFETANTE': 'DESINF', 'SABAO': 'SAB',
-            'BISCOITO': 'BISC', 'AGUARDENTE': 'AGUARD',
-            'CACHACA': 'CACHAC', 'SHAMPOO': 'SH',
-            'CONDICIONADOR': 'COND', 'REPELENTE': 'REPEL',
-            'MACAR': 'MAC', 'MAIONESE': 'MAION',
-            'POLPA TOM': 'MOL TOM', 'POLPA': 'MOL TOM',
-            'FRALDA': 'FRAL', 'PAPEL HIGIENICO': 'PAPEL HIG',
-            'CATCHUP': 'KETCHUP', 'T MANCHA': 'ALV',
-            'SABAO BARRA': 'SABAO', 'SABAO PASTA': 'SABAO',
-        }
-        _cats1 = set()
-        _cats2 = set()
-        for c in MARCAS_POR_CATEGORIA:
-            if nome1.startswith(c + ' ') or c + ' ' in nome1 or nome1 == c:
-                _cats1.add(_CAT_EQUIV.get(c, c))
-            if nome2.startswith(c + ' ') or c + ' ' in nome2 or nome2 == c:
-                _cats2.add(_CAT_EQUIV.get(c, c))
+        # Categorias equivalentes (DET↔LV LOUCA etc.) ficam em _CAT_EQUIV_PREFIXO.
+        f1 = _features_nome(nome1)
+        f2 = _features_nome(nome2)
+        _cats1 = f1['cats_prefixo']
+        _cats2 = f2['cats_prefixo']
         if _cats1 and _cats2 and not _cats1.intersection(_cats2):
             return True
 
         if _azeites_incompativeis(nome1, nome2):
             return True
 
-        d1 = _extrair_dimensoes_papel_alum(nome1)
-        d2 = _extrair_dimensoes_papel_alum(nome2)
+        d1 = f1['dimensoes_papel']
+        d2 = f2['dimensoes_papel']
         if d1 and d2 and not d1.intersection(d2):
             return True
 
         # 1. TRAVA DE PESO (v5.0) — Relaxada para aceitar pesos próximos
-        c1 = _extrair_medidas(nome1)
-        c2 = _extrair_medidas(nome2)
+        c1 = f1['medidas']
+        c2 = f2['medidas']
         if c1 and c2 and not c1.intersection(c2):
             _tol_peso = _tolerancia_medida(nome1, nome2)
             pesos_proximos = False
@@ -1611,40 +1747,20 @@ def nomes_incompativeis_v4(nome1, nome2):
         # 2. TRAVA DE MARCA (v4.7 - CORRIGIDO)
         # Busca marcas DENTRO dos sets de MARCAS_POR_CATEGORIA
         # Se ambos nomes pertencem à mesma categoria mas têm marcas diferentes -> BLOQUEIO
-        for categoria, marcas_set in MARCAS_POR_CATEGORIA.items():
-            # Checar se a categoria se aplica (prefixo no nome ou marca presente)
-            cat_aplica_1 = nome1.startswith(categoria + ' ') or categoria + ' ' in nome1
-            cat_aplica_2 = nome2.startswith(categoria + ' ') or categoria + ' ' in nome2
-            
-            if not (cat_aplica_1 or cat_aplica_2):
-                continue
-            
-            # Achar marcas nos nomes usando word boundary (palavra inteira)
-            # Evita pegar FORT dentro de EXTRAFORTE, BALA dentro de BALALAIKA, etc
-            marcas1 = set()
-            marcas2 = set()
-            for marca in sorted(marcas_set, key=len, reverse=True):
-                # Usar regex word boundary para match de palavra inteira
-                padrao_marca = r'(?:^|(?<=\s))' + re.escape(marca) + r'(?=\s|$)'
-                if re.search(padrao_marca, nome1):
-                    marcas1.add(marca)
-                if re.search(padrao_marca, nome2):
-                    marcas2.add(marca)
-            
+        for categoria in f1['cats_aplica'] | f2['cats_aplica']:
+            # Categoria se aplica (prefixo no nome); marcas por palavra inteira,
+            # evita pegar FORT dentro de EXTRAFORTE, BALA dentro de BALALAIKA, etc
+            marcas_set = MARCAS_POR_CATEGORIA[categoria]
+            marcas1 = marcas_set & f1['marcas']
+            marcas2 = marcas_set & f2['marcas']
+
             # Se achou marca em ambos e são diferentes -> BLOQUEIO
             if marcas1 and marcas2 and not marcas1.intersection(marcas2):
                 return True
 
         # 3. TRAVA DE SUBTIPO (v4.7)
         # Usa word boundary para tokens curtos (evita 'PO' casar com 'COMPOTA')
-        def _match_sub(s, nome):
-            if ' ' in s:
-                return s in nome
-            return bool(re.search(r'(?<![A-Z0-9])' + re.escape(s) + r'(?![A-Z0-9])', nome))
-
-        for grupo in SUBTIPOS_EXCLUSIVOS:
-            sub1 = next((s for s in grupo if _match_sub(s, nome1)), None)
-            sub2 = next((s for s in grupo if _match_sub(s, nome2)), None)
+        for sub1, sub2 in zip(f1['subtipos'], f2['subtipos']):
             if sub1 and sub2 and sub1 != sub2:
                 return True
 
@@ -1653,8 +1769,8 @@ def nomes_incompativeis_v4(nome1, nome2):
         # Usa TOKENS_VARIANTES_COMUNS para identificar sabores/frutas
 
         # Separa nome em tokens de pelo menos 3 letras
-        tokens1 = set(re.findall(r'[A-Z]{3,}', nome1))
-        tokens2 = set(re.findall(r'[A-Z]{3,}', nome2))
+        tokens1 = f1['tokens3']
+        tokens2 = f2['tokens3']
 
         # Remove tokens genéricos e marcas — filtra apenas sabores/variantes relevantes
         marcas_conhecidas = set(MARCAS_POR_CATEGORIA.keys())
@@ -1927,15 +2043,7 @@ def _extrair_marca(nome_normalizado):
         """Extrai a marca principal do nome normalizado (inclui marcas compostas)."""
         if not nome_normalizado:
             return ""
-        todas_marcas = set()
-        for marcas in MARCAS_POR_CATEGORIA.values():
-            todas_marcas.update(marcas)
-        # Check longest brands first (multi-word before single-word)
-        for marca in sorted(todas_marcas, key=len, reverse=True):
-            padrao = r'(?:^|(?<=\s))' + re.escape(marca) + r'(?=\s|$)'
-            if re.search(padrao, nome_normalizado):
-                return marca
-        return ""
+        return _features_nome(nome_normalizado)['marca']
 
 def _travas_leves(nome1, nome2):
         """
@@ -1946,33 +2054,19 @@ def _travas_leves(nome1, nome2):
             return True
 
         # 1. TRAVA DE CATEGORIA CRUZADA
-        _CAT_EQUIV = {
-            'DET': 'LV LOUCA', 'DETERGENTE': 'LV LOUCA',
-            'DESINFETANTE': 'DESINF', 'SABAO': 'SAB',
-            'BISCOITO': 'BISC', 'AGUARDENTE': 'AGUARD',
-            'CACHACA': 'CACHAC', 'SHAMPOO': 'SH',
-            'CONDICIONADOR': 'COND', 'REPELENTE': 'REPEL',
-            'MACAR': 'MAC', 'MAIONESE': 'MAION',
-            'POLPA TOM': 'MOL TOM', 'POLPA': 'MOL TOM',
-            'FRALDA': 'FRAL', 'PAPEL HIGIENICO': 'PAPEL HIG',
-            'CATCHUP': 'KETCHUP', 'T MANCHA': 'ALV',
-            'SABAO BARRA': 'SABAO', 'SABAO PASTA': 'SABAO',
-        }
-        _cats1 = set()
-        _cats2 = set()
-        for c in MARCAS_POR_CATEGORIA:
-            if nome1.startswith(c + ' ') or c + ' ' in nome1 or nome1 == c:
-                _cats1.add(_CAT_EQUIV.get(c, c))
-            if nome2.startswith(c + ' ') or c + ' ' in nome2 or nome2 == c:
-                _cats2.add(_CAT_EQUIV.get(c, c))
+        # Categorias equivalentes (DET↔LV LOUCA etc.) ficam em _CAT_EQUIV_PREFIXO.
+        f1 = _features_nome(nome1)
+        f2 = _features_nome(nome2)
+        _cats1 = f1['cats_prefixo']
+        _cats2 = f2['cats_prefixo']
         if _cats1 and _cats2 and not _cats1.intersection(_cats2):
             return True
 
         if _azeites_incompativeis(nome1, nome2):
             return True
 
-        d1 = _extrair_dimensoes_papel_alum(nome1)
-        d2 = _extrair_dimensoes_papel_alum(nome2)
+        d1 = f1['dimensoes_papel']
+        d2 = f2['dimensoes_papel']
         if d1 and d2 and not d1.intersection(d2):
             return True
 
@@ -2014,19 +2108,12 @@ def _travas_leves(nome1, nome2):
             return True
 
         # 2. TRAVA DE MARCA + CROSS-CATEGORY SAME-BRAND
-        for categoria, marcas_set in MARCAS_POR_CATEGORIA.items():
-            cat_aplica_1 = nome1.startswith(categoria + ' ') or categoria + ' ' in nome1
-            cat_aplica_2 = nome2.startswith(categoria + ' ') or categoria + ' ' in nome2
-            if not (cat_aplica_1 or cat_aplica_2):
-                continue
-            marcas1 = set()
-            marcas2 = set()
-            for marca in sorted(marcas_set, key=len, reverse=True):
-                padrao_marca = r'(?:^|(?<=\s))' + re.escape(marca) + r'(?=\s|$)'
-                if re.search(padrao_marca, nome1):
-                    marcas1.add(marca)
-                if re.search(padrao_marca, nome2):
-                    marcas2.add(marca)
+        for categoria in f1['cats_aplica'] | f2['cats_aplica']:
+            cat_aplica_1 = categoria in f1['cats_aplica']
+            cat_aplica_2 = categoria in f2['cats_aplica']
+            marcas_set = MARCAS_POR_CATEGORIA[categoria]
+            marcas1 = marcas_set & f1['marcas']
+            marcas2 = marcas_set & f2['marcas']
             if marcas1 and marcas2 and not marcas1.intersection(marcas2):
                 return True
             # Cross-category same-brand: mesma marca mas categorias diferentes → bloqueia
@@ -2055,10 +2142,8 @@ def _travas_leves(nome1, nome2):
             'MARACUJA', 'MELANCIA', 'MORANGO', 'PESSEGO', 'TANGERINA',
             'TAMARINDO', 'UVA', 'UVAIA',
         }
-        tokens1 = set(re.findall(r'[A-Z]{3,}', nome1))
-        tokens2 = set(re.findall(r'[A-Z]{3,}', nome2))
-        sabores1 = tokens1 & _SABORES_FRUTA
-        sabores2 = tokens2 & _SABORES_FRUTA
+        sabores1 = f1['tokens3'] & _SABORES_FRUTA
+        sabores2 = f2['tokens3'] & _SABORES_FRUTA
         if sabores1 and sabores2 and not sabores1.intersection(sabores2):
             return True
 
@@ -2081,33 +2166,21 @@ def _travas_leves(nome1, nome2):
                 return True
 
         # 6. BLOQUEIO DE MARCA DESCONHECIDA NA CATEGORIA
-        todas_marcas_flat = set()
-        for marcas in MARCAS_POR_CATEGORIA.values():
-            todas_marcas_flat.update(marcas)
-        for marca in todas_marcas_flat:
-            if re.search(r'(?:^|(?<=\s))' + re.escape(marca) + r'(?=\s|$)', nome1):
-                for cat, marcas_cat in MARCAS_POR_CATEGORIA.items():
-                    if marca not in marcas_cat:
-                        continue
-                    if not (nome1.startswith(cat + ' ') or cat + ' ' in nome1 or nome1 == cat):
-                        continue
-                    # nome1 tem marca conhecida; nome2 tem OUTRA marca da mesma categoria → bloqueia
-                    for marca2 in marcas_cat:
-                        if marca2 == marca:
-                            continue
-                        if re.search(r'(?:^|(?<=\s))' + re.escape(marca2) + r'(?=\s|$)', nome2):
-                            return True
-                    # nome1 tem marca desta categoria, nome2 não tem nenhuma marca dela → bloqueia
-                    tem_marca2 = any(
-                        re.search(r'(?:^|(?<=\s))' + re.escape(m2) + r'(?=\s|$)', nome2)
-                        for m2 in marcas_cat
-                    )
-                    if not tem_marca2:
-                        return True
+        for marca in f1['marcas']:
+            for cat in _CATEGORIAS_DA_MARCA.get(marca, ()):
+                if cat not in f1['cats_prefixo_bruto']:
+                    continue
+                marcas_cat2 = MARCAS_POR_CATEGORIA[cat] & f2['marcas']
+                # nome1 tem marca conhecida; nome2 tem OUTRA marca da mesma categoria → bloqueia
+                if marcas_cat2 - {marca}:
+                    return True
+                # nome1 tem marca desta categoria, nome2 não tem nenhuma marca dela → bloqueia
+                if not marcas_cat2:
+                    return True
 
         # 7. TRAVA DE PESO — bloqueia pesos incompatíveis
-        _c1 = _extrair_medidas(nome1)
-        _c2 = _extrair_medidas(nome2)
+        _c1 = f1['medidas']
+        _c2 = f2['medidas']
         if _c1 and _c2 and not _c1.intersection(_c2):
             _tol_peso = _tolerancia_medida(nome1, nome2)
             _pesos_ok = False
@@ -2178,8 +2251,9 @@ def _travas_leves(nome1, nome2):
 
         return False
 
-def _candidatos_rapidos(n_site, n_site_ord, precos_nome_lista, norms_cache, limit=100, score_cutoff=40):
-        """Retorna lista de items da precos_nome_lista ordenados por score fuzz, acima do cutoff."""
+def _candidatos_rapidos(n_site, precos_nome_lista, norms_cache,
+                        limit=CANDIDATOS_LIMITE, score_cutoff=CANDIDATOS_SCORE_MINIMO):
+        """Retorna (item, nota token_set) da precos_nome_lista ordenados por score fuzz, acima do cutoff."""
         if _USE_RAPIDFUZZ and norms_cache is not None:
             # rfprocess.extract retorna (string, score, index) em ordem decrescente
             resultados = rfprocess.extract(
@@ -2188,43 +2262,130 @@ def _candidatos_rapidos(n_site, n_site_ord, precos_nome_lista, norms_cache, limi
                 limit=limit,
                 score_cutoff=score_cutoff
             )
-            return [precos_nome_lista[idx] for _, _, idx in resultados]
+            return [(precos_nome_lista[idx], nota) for _, nota, idx in resultados]
         # fallback: retorna tudo
-        return precos_nome_lista
+        return [(item, fuzz.token_set_ratio(n_site, item['norm'])) for item in precos_nome_lista]
 
-def encontrar_preco(ean, nome_original, precos_dict, precos_nome_lista, norms_cache):
-        """Motor de matching v5.0 — 3 camadas para maximizar acertos."""
-        # 1. Busca por EAN (Prioridade máxima)
+def _notas_candidatos(n_site_ord, candidatos_set):
+        """(item, nota) com a nota final max(token_sort, token_set) calculada uma vez."""
+        notas = []
+        for item, nota_set in candidatos_set:
+            nota_sort = fuzz.token_sort_ratio(n_site_ord, item['ord']) / 100.0
+            notas.append((item, max(nota_sort, nota_set / 100.0)))
+        return notas
+
+
+def _candidatos_em_lote(consultas, precos_nome_lista, norms_cache,
+                        limit=CANDIDATOS_LIMITE, score_cutoff=CANDIDATOS_SCORE_MINIMO, workers=None):
+        """
+        Mesmo pré-filtro de _candidatos_rapidos para várias consultas de uma vez:
+        matriz token_set_ratio via cdist (multi-thread), em blocos para limitar memória.
+        Retorna, por consulta, lista de (item, nota_set) na ordem do extract
+        (nota decrescente, índice crescente no empate).
+        """
+        workers = MATCH_WORKERS if workers is None else workers
+        saida = []
+        if not consultas:
+            return saida
+        if not norms_cache:
+            return [[] for _ in consultas]
+
+        linhas_bloco = max(1, MATCH_LOTE_MAX_CELULAS // len(norms_cache))
+        for inicio in range(0, len(consultas), linhas_bloco):
+            bloco = consultas[inicio:inicio + linhas_bloco]
+            matriz = rfprocess.cdist(
+                bloco, norms_cache,
+                scorer=fuzz.token_set_ratio,
+                score_cutoff=score_cutoff,
+                dtype=np.float64,
+                workers=workers,
+            )
+            for linha in matriz:
+                idx = np.flatnonzero(linha >= score_cutoff)
+                if len(idx) > limit:
+                    ordem = np.lexsort((idx, -linha[idx]))[:limit]
+                else:
+                    ordem = np.lexsort((idx, -linha[idx]))
+                saida.append([(precos_nome_lista[i], float(linha[i])) for i in idx[ordem]])
+        return saida
+
+
+def _preco_por_ean(ean, precos_dict):
         ean_limpo = limpar_ean(ean)
         if ean_limpo and ean_limpo in precos_dict:
-            return precos_dict[ean_limpo], "EAN"
+            return precos_dict[ean_limpo]
 
-        # 1b. Código de caixa (DUN-14) → EAN-13 da unidade
+        # Código de caixa (DUN-14) → EAN-13 da unidade
         ean_unidade = ean_unidade_de_dun14(ean_limpo)
         if ean_unidade and ean_unidade in precos_dict:
-            return precos_dict[ean_unidade], "EAN"
+            return precos_dict[ean_unidade]
+        return None
+
+
+def encontrar_preco(ean, nome_original, precos_dict, precos_nome_lista, norms_cache, metricas=None):
+        """Motor de matching v5.0 — 3 camadas para maximizar acertos."""
+        etapas = metricas.setdefault("etapas_ms", {}) if metricas is not None else None
+        inicio = time.perf_counter()
+
+        # 1. Busca por EAN (Prioridade máxima), inclusive DUN-14
+        preco_ean = _preco_por_ean(ean, precos_dict)
+        if etapas is not None:
+            inicio = _acumular_ms(etapas, "ean", inicio)
+        if preco_ean is not None:
+            _contar_resolucao(metricas, "EAN")
+            return preco_ean, "EAN"
 
         # 2. Busca por Nome — MOTOR EM 3 CAMADAS
         n_site = normalizar_nome(nome_original)
         if not n_site:
+            _contar_resolucao(metricas, None)
             return None, None
 
         n_site_ord = ordenar_palavras(n_site)
 
-        # Pré-filtro rápido: top-100 candidatos por score fuzz (O(N) com C-speed)
+        # Pré-filtro rápido: top-40 candidatos por score fuzz (O(N) com C-speed)
         # Travas são checadas só nos candidatos pré-filtrados → muito mais rápido
-        candidatos = _candidatos_rapidos(n_site, n_site_ord, precos_nome_lista, norms_cache, limit=40, score_cutoff=55)
+        candidatos_set = _candidatos_rapidos(n_site, precos_nome_lista, norms_cache)
+        candidatos = _notas_candidatos(n_site_ord, candidatos_set)
+        if etapas is not None:
+            _acumular_ms(etapas, "pre_filtro", inicio)
+        preco, tipo, camada = _melhor_por_camadas(n_site, candidatos, etapas)
+        _contar_resolucao(metricas, camada)
+        return preco, tipo
+
+
+def _acumular_ms(etapas, nome, inicio):
+        """Soma o tempo desde ``inicio`` na etapa e devolve o novo início."""
+        agora = time.perf_counter()
+        etapas[nome] = etapas.get(nome, 0.0) + (agora - inicio) * 1000
+        return agora
+
+
+def _contar_resolucao(metricas, camada, quantidade=1):
+        if metricas is None:
+            return
+        if camada is None:
+            chave = "SEM_MATCH"
+        elif camada == "EAN":
+            chave = "EAN"
+        else:
+            chave = f"CAMADA_{camada}"
+        resolucao = metricas.setdefault("resolucao", {})
+        resolucao[chave] = resolucao.get(chave, 0) + quantidade
+
 
+def _melhor_por_camadas(n_site, candidatos, etapas=None):
+        """
+        Camadas 1-3 sobre candidatos já pontuados: lista de (item, nota 0..1).
+        Retorna (preco, tipo, camada); com ``etapas`` soma o tempo de cada camada.
+        """
+        inicio = time.perf_counter() if etapas is not None else None
         # ═══════════════════════════════════════════════════════════
         # CAMADA 1: Matching padrão (75% + travas rigorosas)
         # ═══════════════════════════════════════════════════════════
         melhor_nota, preco_candidato, melhor_orig = 0, None, None
 
-        for item in candidatos:
-            nota_sort = fuzz.token_sort_ratio(n_site_ord, item['ord'])  / 100.0
-            nota_set  = fuzz.token_set_ratio(n_site, item['norm'])      / 100.0
-            nota = max(nota_sort, nota_set)
-
+        for item, nota in candidatos:
             if nota < TAXA_SIMILARIDADE or nota <= melhor_nota:
                 continue
             if nomes_incompativeis_v4(n_site, item['norm']):
@@ -2235,8 +2396,10 @@ def encontrar_preco(ean, nome_original, precos_dict, precos_nome_lista, norms_ca
                 preco_candidato = item['preco']
                 melhor_orig = item['orig']
 
+        if etapas is not None:
+            inicio = _acumular_ms(etapas, "camada_1", inicio)
         if melhor_nota >= TAXA_SIMILARIDADE:
-            return preco_candidato, f"SIMILAR {int(melhor_nota * 100)}%"
+            return preco_candidato, f"SIMILAR {int(melhor_nota * 100)}%", 1
 
         # ═══════════════════════════════════════════════════════════
         # CAMADA 2: Matching relaxado (65%) — mesma categoria + marca
@@ -2246,11 +2409,7 @@ def encontrar_preco(ean, nome_original, precos_dict, precos_nome_lista, norms_ca
         TAXA_CAMADA2 = 0.65
         melhor_nota2, preco_candidato2 = 0, None
 
-        for item in candidatos:
-            nota_sort = fuzz.token_sort_ratio(n_site_ord, item['ord'])  / 100.0
-            nota_set  = fuzz.token_set_ratio(n_site, item['norm'])      / 100.0
-            nota = max(nota_sort, nota_set)
-
+        for item, nota in candidatos:
             if nota < TAXA_CAMADA2 or nota <= melhor_nota2:
                 continue
             # Travas reduzidas: só categoria e marca
@@ -2261,8 +2420,10 @@ def encontrar_preco(ean, nome_original, precos_dict, precos_nome_lista, norms_ca
                 melhor_nota2 = nota
                 preco_candidato2 = item['preco']
 
+        if etapas is not None:
+            inicio = _acumular_ms(etapas, "camada_2", inicio)
         if melhor_nota2 >= TAXA_CAMADA2:
-            return preco_candidato2, f"SIMILAR {int(melhor_nota2 * 100)}%"
+            return preco_candidato2, f"SIMILAR {int(melhor_nota2 * 100)}%", 2
 
         # ═══════════════════════════════════════════════════════════
         # CAMADA 3: Matching por categoria + marca obrigatória
@@ -2276,7 +2437,7 @@ def encontrar_preco(ean, nome_original, precos_dict, precos_nome_lista, norms_ca
         marca_site = _extrair_marca(n_site)
 
         if cat_site:
-            for item in candidatos:
+            for item, nota in candidatos:
                 cat_item = _extrair_categoria(item['norm'])
 
                 # 1. Deve ter mesma categoria
@@ -2284,14 +2445,8 @@ def encontrar_preco(ean, nome_original, precos_dict, precos_nome_lista, norms_ca
                     continue
 
                 # 2. Se produto buscado tem marca conhecida → match DEVE ter mesma marca
-                if marca_site:
-                    padrao_marca = r'(?:^|(?<=\s))' + re.escape(marca_site) + r'(?=\s|$)'
-                    if not re.search(padrao_marca, item['norm']):
-                        continue
-
-                nota_sort = fuzz.token_sort_ratio(n_site_ord, item['ord'])  / 100.0
-                nota_set  = fuzz.token_set_ratio(n_site, item['norm'])      / 100.0
-                nota = max(nota_sort, nota_set)
+                if marca_site and marca_site not in _features_nome(item['norm'])['marcas']:
+                    continue
 
                 if nota < TAXA_CAMADA3 or nota <= melhor_nota3:
                     continue
@@ -2303,13 +2458,75 @@ def encontrar_preco(ean, nome_original, precos_dict, precos_nome_lista, norms_ca
                     melhor_nota3 = nota
                     preco_candidato3 = item['preco']
 
-            if melhor_nota3 >= TAXA_CAMADA3:
-                return preco_candidato3, f"APROX {int(melhor_nota3 * 100)}%"
+        if etapas is not None:
+            _acumular_ms(etapas, "camada_3", inicio)
+        if melhor_nota3 >= TAXA_CAMADA3:
+            return preco_candidato3, f"APROX {int(melhor_nota3 * 100)}%", 3
+
+        return None, None, None
+
+
+def _encontrar_precos_em_lote(itens_cotacao, precos_dict, precos_nome_lista, norms_cache, workers=None, metricas=None):
+    """
+    Equivalente a encontrar_preco item a item, mas pontua todos os nomes
+    pendentes de uma vez (cdist) e roda as camadas sobre notas prontas.
+    Nomes repetidos na cotação são casados uma vez só.
+    """
+    etapas = metricas.setdefault("etapas_ms", {}) if metricas is not None else None
+    inicio = time.perf_counter()
+    respostas = [None] * len(itens_cotacao)
+    pendentes = {}
+    for i, item in enumerate(itens_cotacao):
+        preco_ean = _preco_por_ean(item.get("ean", ""), precos_dict)
+        if preco_ean is not None:
+            respostas[i] = (preco_ean, "EAN")
+            _contar_resolucao(metricas, "EAN")
+            continue
+        n_site = normalizar_nome(item.get("nome", ""))
+        if not n_site:
+            respostas[i] = (None, None)
+            _contar_resolucao(metricas, None)
+            continue
+        pendentes.setdefault(n_site, []).append(i)
+    if etapas is not None:
+        inicio = _acumular_ms(etapas, "ean", inicio)
+        metricas["nomes_distintos"] = metricas.get("nomes_distintos", 0) + len(pendentes)
+
+    consultas = list(pendentes)
+    lotes = _candidatos_em_lote(consultas, precos_nome_lista, norms_cache, workers=workers)
+    if etapas is not None:
+        _acumular_ms(etapas, "pre_filtro", inicio)
+    for n_site, candidatos_set in zip(consultas, lotes):
+        inicio = time.perf_counter()
+        candidatos = _notas_candidatos(ordenar_palavras(n_site), candidatos_set)
+        if etapas is not None:
+            _acumular_ms(etapas, "pre_filtro", inicio)
+        preco, tipo, camada = _melhor_por_camadas(n_site, candidatos, etapas)
+        _contar_resolucao(metricas, camada, len(pendentes[n_site]))
+        for i in pendentes[n_site]:
+            respostas[i] = (preco, tipo)
+    return respostas
+
+
+def preco_atual_do_item(item):
+    """Preço já preenchido na cotação (``current_price``), quando é um número positivo."""
+    atual = item.get("current_price")
+    try:
+        atual = float(str(atual).replace("R$", "").replace(" ", "").replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+    return atual if atual > 0 else None
+
 
-        return None, None
+def aplicar_menor_preco(preco_novo, item):
+    if preco_novo is None:
+        return None
+    atual = preco_atual_do_item(item)
+    return min(preco_novo, atual) if atual is not None else preco_novo
 
 
-def processar_cotacao(itens_cotacao, precos_dict, precos_nome_lista, modo="ean"):
+def processar_cotacao(itens_cotacao, precos_dict, precos_nome_lista, modo="ean", norms_cache=None, lote=None,
+                      metricas=None):
     """
     Processa matching para uma lista de itens de cotacao.
 
@@ -2318,25 +2535,31 @@ def processar_cotacao(itens_cotacao, precos_dict, precos_nome_lista, modo="ean")
         precos_dict: dict ean_str -> preco_float
         precos_nome_lista: lista de {"norm", "ord", "preco", "orig"}
         modo: "ean" (so codigo de barras) ou "completo" (EAN + 3 camadas)
+        norms_cache: lista de "norm" ja montada (indice em cache); opcional
+        lote: no modo completo, casa os nomes em lote via cdist; None decide
+              pelo tamanho da cotacao
+        metricas: dict opcional preenchido com "etapas_ms" (ean, pre_filtro,
+              camada_1..3), "resolucao" (itens por EAN/CAMADA_n/SEM_MATCH) e "itens"
 
     Returns:
         lista de {"linha": int, "preco": float|None, "tipo": str|None}
     """
     results = []
     modo = str(modo or "ean").strip().lower()
-    norms_cache = [item['norm'] for item in precos_nome_lista]
-
-    def menor_preco(preco_novo, item):
-        if preco_novo is None:
-            return None
-        atual = item.get("current_price")
-        try:
-            atual = float(str(atual).replace("R$", "").replace(" ", "").replace(",", "."))
-        except (TypeError, ValueError):
-            atual = None
-        return min(preco_novo, atual) if atual is not None and atual > 0 else preco_novo
+    if norms_cache is None:
+        norms_cache = [item['norm'] for item in precos_nome_lista]
+
+    respostas_lote = None
+    if modo != "ean":
+        if lote is None:
+            lote = len(itens_cotacao) >= MATCH_LOTE_MIN_ITENS
+        if lote and _USE_RAPIDFUZZ and np is not None and norms_cache:
+            respostas_lote = _encontrar_precos_em_lote(
+                itens_cotacao, precos_dict, precos_nome_lista, norms_cache, metricas=metricas
+            )
 
-    for item in itens_cotacao:
+    inicio_ean = time.perf_counter()
+    for i, item in enumerate(itens_cotacao):
         if modo == "ean":
             ean_limpo = limpar_ean(item.get("ean", ""))
             preco = precos_dict.get(ean_limpo) if ean_limpo else None
@@ -2344,23 +2567,38 @@ def processar_cotacao(itens_cotacao, precos_dict, precos_nome_lista, modo="ean")
                 ean_unidade = ean_unidade_de_dun14(ean_limpo)
                 if ean_unidade:
                     preco = precos_dict.get(ean_unidade)
-            preco = menor_preco(preco, item)
+            _contar_resolucao(metricas, "EAN" if preco is not None else None)
+            preco = aplicar_menor_preco(preco, item)
             tipo = "EAN" if preco is not None else None
             results.append({"linha": item.get("linha", 0), "preco": preco, "tipo": tipo})
         else:
-            preco, tipo = encontrar_preco(
-                item.get("ean", ""), item.get("nome", ""),
-                precos_dict, precos_nome_lista, norms_cache
-            )
-            preco = menor_preco(preco, item)
+            if respostas_lote is not None:
+                preco, tipo = respostas_lote[i]
+            else:
+                preco, tipo = encontrar_preco(
+                    item.get("ean", ""), item.get("nome", ""),
+                    precos_dict, precos_nome_lista, norms_cache, metricas=metricas
+                )
+            preco = aplicar_menor_preco(preco, item)
             results.append({"linha": item.get("linha", 0), "preco": preco, "tipo": tipo})
 
+    if metricas is not None:
+        etapas = metricas.setdefault("etapas_ms", {})
+        if modo == "ean":
+            _acumular_ms(etapas, "ean", inicio_ean)
+        metricas["itens"] = metricas.get("itens", 0) + len(itens_cotacao)
+        metricas["lote"] = respostas_lote is not None
+        for nome in etapas:
+            etapas[nome] = round(etapas[nome], 1)
+
     return results
 
 
-def processar_cotacao_com_ia(itens_cotacao, precos_dict, precos_nome_lista, modo="ean"):
+def processar_cotacao_com_ia(itens_cotacao, precos_dict, precos_nome_lista, modo="ean", norms_cache=None, metricas=None):
     """
     Compatibilidade com chamadas antigas: executa somente o matching por codigo.
     A camada Gemini foi desativada para evitar custo de IA no processamento.
     """
-    return processar_cotacao(itens_cotacao, precos_dict, precos_nome_lista, modo=modo)
+    return processar_cotacao(
+        itens_cotacao, precos_dict, precos_nome_lista, modo=modo, norms_cache=norms_cache, metricas=metricas
+    )
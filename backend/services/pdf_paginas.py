@@ -0,0 +1,262 @@
+"""
+Extração de PDF página a página em processos separados.
+
+Catálogo de fornecedor com centenas de páginas estoura o limite do processo
+isolado de ``_extrair_linhas_pdf_isolado`` quando é lido de uma vez,
+e uma única página problemática (fonte quebrada, desenho gigante) trava a
+leitura inteira. Aqui as páginas são divididas em lotes distribuídos entre
+alguns processos; cada processo abre o arquivo uma vez por lote e avisa o pai
+antes de começar cada página. Página que passa de ``PDF_PAGINA_TIMEOUT_SECONDS``
+tem o processo encerrado, fica de fora do resultado e o resto do lote volta
+para a fila.
+
+Os resultados voltam por página (base 0); quem chama junta na ordem do PDF.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing.connection import wait
+
+logger = logging.getLogger(__name__)
+
+# Processos de extração (0 = um por núcleo)
+PDF_EXTRACAO_WORKERS = int(os.environ.get("PDF_EXTRACAO_WORKERS", "0"))
+PDF_PAGINAS_POR_LOTE = int(os.environ.get("PDF_PAGINAS_POR_LOTE", "8"))
+PDF_PAGINA_TIMEOUT_SECONDS = float(os.environ.get("PDF_PAGINA_TIMEOUT_SECONDS", "20"))
+# Orçamento da leitura inteira; fica abaixo dos 150s do processo isolado da rota
+PDF_EXTRACAO_TIMEOUT_SECONDS = float(os.environ.get("PDF_EXTRACAO_TIMEOUT_SECONDS", "120"))
+
+MODOS = ("texto_pdfminer", "texto_pdfplumber", "tabelas_pdfplumber")
+
+
+def contar_paginas(caminho, modo):
+    if modo == "texto_pdfminer":
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+
+        with open(caminho, "rb") as fp:
+            return sum(1 for _ in PDFPage.create_pages(PDFDocument(PDFParser(fp))))
+
+    import pdfplumber
+
+    with pdfplumber.open(caminho) as pdf:
+        return len(pdf.pages)
+
+
+@contextmanager
+def _abrir(caminho, modo):
+    """Abre o PDF uma vez e devolve a função que extrai uma página."""
+    if modo == "texto_pdfminer":
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+
+        # Mesmo pipeline de pdfminer.high_level.extract_text, uma página por vez
+        with open(caminho, "rb") as fp, io.StringIO() as saida:
+            paginas = list(PDFPage.create_pages(PDFDocument(PDFParser(fp))))
+            recursos = PDFResourceManager(caching=True)
+            device = TextConverter(recursos, saida, laparams=LAParams())
+            interpretador = PDFPageInterpreter(recursos, device)
+
+            def extrair(pagina):
+                saida.seek(0)
+                saida.truncate()
+                interpretador.process_page(paginas[pagina])
+                return saida.getvalue()
+
+            try:
+                yield extrair
+            finally:
+                device.close()
+        return
+
+    import pdfplumber
+
+    with pdfplumber.open(caminho) as pdf:
+        if modo == "texto_pdfplumber":
+            yield lambda pagina: pdf.pages[pagina].extract_text() or ""
+        else:
+            yield lambda pagina: pdf.pages[pagina].extract_tables()
+
+
+def _worker_paginas(conn, caminho, modo):
+    """Recebe lotes de páginas pelo pipe até receber None."""
+    try:
+        while True:
+            lote = conn.recv()
+            if lote is None:
+                break
+            try:
+                with _abrir(caminho, modo) as extrair:
+                    for pagina in lote:
+                        conn.send(("inicio", pagina))
+                        try:
+                            conn.send(("ok", pagina, extrair(pagina)))
+                        except Exception as e:
+                            conn.send(("erro", pagina, type(e).__name__))
+            except Exception as e:
+                conn.send(("falha_lote", type(e).__name__))
+            conn.send(("fim",))
+    except (EOFError, BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        conn.close()
+
+
+def _extrair_sequencial(caminho, modo, total_paginas, ao_avancar, resultados, falhas):
+    """Sem processos filhos (ex.: dentro de processo daemon): sem timeout por página."""
+    try:
+        with _abrir(caminho, modo) as extrair:
+            for pagina in range(total_paginas):
+                try:
+                    resultados[pagina] = extrair(pagina)
+                except Exception as e:
+                    falhas[pagina] = type(e).__name__
+                if ao_avancar:
+                    ao_avancar(len(resultados) + len(falhas), pagina, resultados.get(pagina))
+    except Exception as e:
+        for pagina in range(total_paginas):
+            if pagina not in resultados:
+                falhas.setdefault(pagina, type(e).__name__)
+
+
+def extrair_paginas(caminho, modo, total_paginas, ao_avancar=None, prazo_final=None):
+    """
+    Extrai ``total_paginas`` páginas no ``modo`` pedido.
+
+    Devolve ``(resultados, falhas)``: ``{pagina: valor}`` e ``{pagina: motivo}``,
+    onde o motivo é o nome da exceção, ``"timeout"`` (página travou) ou
+    ``"tempo_esgotado"`` (``prazo_final``, em ``time.monotonic()``, chegou antes).
+    ``ao_avancar(concluidas, pagina, valor)`` é chamado a cada página encerrada.
+    """
+    if modo not in MODOS:
+        raise ValueError(f"modo de extração inválido: {modo}")
+
+    resultados: dict = {}
+    falhas: dict = {}
+    if total_paginas <= 0:
+        return resultados, falhas
+
+    por_lote = max(1, PDF_PAGINAS_POR_LOTE)
+    lotes = deque(
+        list(range(inicio, min(inicio + por_lote, total_paginas)))
+        for inicio in range(0, total_paginas, por_lote)
+    )
+    n_workers = min(PDF_EXTRACAO_WORKERS or os.cpu_count() or 1, len(lotes))
+    metodo = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(metodo)
+    workers: dict = {}
+
+    def concluir(pagina, valor=None, motivo=None):
+        if pagina in resultados or pagina in falhas:
+            return
+        if motivo is None:
+            resultados[pagina] = valor
+        else:
+            falhas[pagina] = motivo
+        if ao_avancar:
+            ao_avancar(len(resultados) + len(falhas), pagina, valor)
+
+    def iniciar_worker():
+        pai, filho = ctx.Pipe()
+        processo = ctx.Process(target=_worker_paginas, args=(filho, caminho, modo), daemon=True)
+        processo.start()
+        filho.close()
+        workers[pai] = {"processo": processo, "lote": None, "pagina": None, "desde": None}
+        despachar(pai)
+
+    def despachar(conn):
+        estado = workers[conn]
+        estado["pagina"] = None
+        if lotes:
+            estado["lote"] = lotes.popleft()
+            conn.send(estado["lote"])
+        else:
+            estado["lote"] = None
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            encerrar(conn)
+
+    def encerrar(conn, matar=False):
+        estado = workers.pop(conn)
+        if matar:
+            estado["processo"].kill()
+        estado["processo"].join(5)
+        conn.close()
+
+    def descartar(conn, motivo):
+        """Encerra o worker na página atual e devolve o resto do lote para a fila."""
+        estado = workers[conn]
+        if estado["pagina"] is not None:
+            concluir(estado["pagina"], motivo=motivo)
+        resto = [p for p in estado["lote"] or [] if p not in resultados and p not in falhas]
+        encerrar(conn, matar=True)
+        if resto:
+            lotes.appendleft(resto)
+            iniciar_worker()
+
+    try:
+        for _ in range(n_workers):
+            iniciar_worker()
+    except (AssertionError, OSError) as e:
+        logger.warning("extração de PDF sem processos filhos: %s", e)
+        for conn in list(workers):
+            encerrar(conn, matar=True)
+        lotes.clear()
+        _extrair_sequencial(caminho, modo, total_paginas, ao_avancar, resultados, falhas)
+        return resultados, falhas
+
+    try:
+        while workers:
+            if prazo_final is not None and time.monotonic() >= prazo_final:
+                break
+            for conn in wait(list(workers), timeout=0.2):
+                estado = workers[conn]
+                try:
+                    mensagem = conn.recv()
+                except (EOFError, OSError):
+                    descartar(conn, "processo_encerrado")
+                    continue
+                tipo = mensagem[0]
+                if tipo == "inicio":
+                    estado["pagina"] = mensagem[1]
+                    estado["desde"] = time.monotonic()
+                elif tipo == "ok":
+                    estado["pagina"] = None
+                    concluir(mensagem[1], valor=mensagem[2])
+                elif tipo == "erro":
+                    estado["pagina"] = None
+                    concluir(mensagem[1], motivo=mensagem[2])
+                elif tipo == "falha_lote":
+                    estado["pagina"] = None
+                    for pagina in estado["lote"] or []:
+                        concluir(pagina, motivo=mensagem[1])
+                elif tipo == "fim":
+                    despachar(conn)
+
+            agora = time.monotonic()
+            for conn, estado in list(workers.items()):
+                if estado["pagina"] is not None and agora - estado["desde"] > PDF_PAGINA_TIMEOUT_SECONDS:
+                    logger.warning("página %s do PDF travou (%s); pulando", estado["pagina"] + 1, modo)
+                    descartar(conn, "timeout")
+    finally:
+        for conn in list(workers):
+            encerrar(conn, matar=True)
+
+    for pagina in range(total_paginas):
+        if pagina not in resultados:
+            falhas.setdefault(pagina, "tempo_esgotado")
+    return resultados, falhas
@@ -0,0 +1,77 @@
+"""Armazenamento das sessões da Cotação Pronta (preview -> ``/confirmar``).
+
+A planilha original vai para o GridFS uma única vez por conteúdo (SHA-256 em
+``metadata.sha256``): o mesmo arquivo reenviado reaproveita o blob. Itens e
+resultados ficam no documento da sessão como JSON + zlib, o mesmo formato
+compacto dos índices de tabela mestre, e o documento guarda só contagens e
+referências.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import zlib
+from datetime import datetime
+from io import BytesIO
+
+SESSAO_VERSAO = 1
+SESSAO_BLOB_ORIGEM = "cotacao_sessao"
+
+
+def serializar_sessao(itens, resultados) -> bytes:
+    payload = {"v": SESSAO_VERSAO, "itens": itens, "resultados": resultados}
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return zlib.compress(raw, 6)
+
+
+def desserializar_sessao(dados: bytes) -> tuple[list, list]:
+    payload = json.loads(zlib.decompress(dados).decode("utf-8"))
+    if payload.get("v") != SESSAO_VERSAO:
+        raise ValueError(f"versão de sessão não suportada: {payload.get('v')}")
+    return payload["itens"], payload["resultados"]
+
+
+async def guardar_blob_deduplicado(
+    db,
+    bucket,
+    conteudo: bytes,
+    filename: str,
+    content_type: str | None,
+    reusar_desde: datetime,
+):
+    """
+    Devolve ``(grid_id, sha256)`` do blob com este conteúdo, enviando só se
+    ainda não existe um de ``reusar_desde`` para cá (blobs mais antigos podem
+    estar prestes a sair na limpeza de órfãos).
+    """
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+    existente = await db["fs.files"].find_one(
+        {
+            "metadata.sha256": sha256,
+            "metadata.origem": SESSAO_BLOB_ORIGEM,
+            "length": len(conteudo),
+            "uploadDate": {"$gte": reusar_desde},
+        },
+        {"_id": 1},
+        sort=[("uploadDate", -1)],
+    )
+    if existente:
+        return existente["_id"], sha256
+
+    grid_id = await bucket.upload_from_stream(
+        filename,
+        BytesIO(conteudo),
+        metadata={
+            "content_type": content_type or "application/octet-stream",
+            "sha256": sha256,
+            "origem": SESSAO_BLOB_ORIGEM,
+        },
+    )
+    return grid_id, sha256
+
+
+async def baixar_blob_para_arquivo(bucket, grid_id, caminho: str):
+    """Copia o blob do GridFS para o arquivo em pedaços, sem juntar tudo em memória."""
+    with open(caminho, "wb") as destino:
+        await bucket.download_to_stream(grid_id, destino)
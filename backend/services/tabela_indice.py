@@ -0,0 +1,271 @@
+"""Índice compilado da tabela mestre da Cotação Pronta.
+
+A tabela mestre é lida uma vez (upload ou primeiro uso) para todos os
+prazos detectados: nomes/EANs compartilhados e um vetor de preços por prazo
+(``ler_tabela_mestre_prazos``). Esse resultado vai para o GridFS como um
+artefato compacto (JSON + zlib), referenciado em
+``tabelas_mestre.indices.prazos``. Os caminhos quentes (match da extensão,
+preview e vitrine) carregam o artefato e só escolhem o vetor do prazo, em vez
+de repetir download + arquivo temporário + pandas.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import zlib
+from io import BytesIO
+
+from services.excel_processor import (
+    detectar_prazos_disponiveis,
+    indice_do_prazo,
+    ler_grade_planilha,
+    ler_tabela_mestre_prazos,
+)
+from services.matching_engine import MATCHER_VERSAO
+
+logger = logging.getLogger(__name__)
+
+# Subir ao mudar o formato do artefato ou a leitura da tabela mestre
+INDICE_VERSAO = 2
+INDICE_KIND = "tabela_mestre_indice"
+# Chave em ``tabelas_mestre.indices`` do artefato com todos os prazos
+INDICE_CHAVE_PRAZOS = "prazos"
+
+
+# Índice gravado por outra versão da leitura ou do matcher é recompilado em
+# vez de devolver "norm" desatualizado. Deploys que não mexem nisso preservam
+# índices, referências em disco e o cache de resultados.
+INDICE_ASSINATURA = f"i{INDICE_VERSAO}-m{MATCHER_VERSAO}"
+
+
+def compilar_indice(caminho_arquivo, prazo, grade=None) -> dict:
+    """
+    Lê a tabela mestre no prazo pedido e devolve o índice em memória.
+    ``grade`` (de ``ler_grade_planilha``) evita reler o arquivo.
+    """
+    return selecionar_prazo(compilar_tabela_prazos(caminho_arquivo, [prazo], grade=grade), prazo)
+
+
+def compilar_tabela_prazos(caminho_arquivo, prazos=None, grade=None) -> dict:
+    """
+    Tabela colunar de todos os ``prazos`` (padrão: os detectados) numa
+    leitura só da planilha.
+    """
+    if grade is None:
+        grade = ler_grade_planilha(caminho_arquivo)
+    if prazos is None:
+        prazos = detectar_prazos_disponiveis(caminho_arquivo, grade=grade)
+    return ler_tabela_mestre_prazos(caminho_arquivo, [int(p) for p in prazos], grade=grade)
+
+
+def selecionar_prazo(tabela: dict, prazo) -> dict:
+    """Índice de um prazo da tabela colunar: só escolhe o vetor de preços."""
+    precos, precos_nome_lista, meta_por_ean = indice_do_prazo(tabela, int(prazo))
+    return {
+        "precos": precos,
+        "precos_nome_lista": precos_nome_lista,
+        "meta_por_ean": meta_por_ean,
+    }
+
+
+def serializar_tabela_prazos(tabela: dict, grid_id) -> bytes:
+    payload = {
+        "v": INDICE_VERSAO,
+        "assinatura": INDICE_ASSINATURA,
+        "grid_id": str(grid_id),
+        "prazos": [int(p) for p in tabela["prazos"]],
+        "linhas": [
+            list(linha)
+            for linha in zip(tabela["orig"], tabela["norm"], tabela["ord"], tabela["ean"], tabela["fracionamento"])
+        ],
+        "precos": {str(int(prazo)): precos for prazo, precos in tabela["precos"].items()},
+    }
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, 6)
+
+
+def desserializar_tabela_prazos(dados: bytes, grid_id=None) -> dict | None:
+    """Devolve a tabela colunar ou None quando o artefato não serve para esta versão/tabela."""
+    try:
+        payload = json.loads(zlib.decompress(dados).decode("utf-8"))
+    except (zlib.error, ValueError, UnicodeDecodeError):
+        return None
+
+    if payload.get("v") != INDICE_VERSAO or payload.get("assinatura") != INDICE_ASSINATURA:
+        return None
+    if grid_id is not None and payload.get("grid_id") != str(grid_id):
+        return None
+
+    colunas = [[], [], [], [], []]
+    for linha in payload.get("linhas") or []:
+        for coluna, valor in zip(colunas, linha):
+            coluna.append(valor)
+    orig, norm, ordenado, eans, fracionamentos = colunas
+    return {
+        "prazos": payload.get("prazos") or [],
+        "orig": orig,
+        "norm": norm,
+        "ord": ordenado,
+        "ean": eans,
+        "fracionamento": fracionamentos,
+        "precos": {int(prazo): precos for prazo, precos in (payload.get("precos") or {}).items()},
+    }
+
+
+def serializar_indice(indice: dict, grid_id, prazo) -> bytes:
+    nomes = [
+        [
+            item.get("orig"),
+            item.get("norm"),
+            item.get("ord"),
+            item.get("preco"),
+            item.get("ean"),
+            item.get("fracionamento"),
+        ]
+        for item in indice["precos_nome_lista"]
+    ]
+    payload = {
+        "v": INDICE_VERSAO,
+        "assinatura": INDICE_ASSINATURA,
+        "grid_id": str(grid_id),
+        "prazo": int(prazo),
+        "precos": indice["precos"],
+        "meta": {ean: meta.get("fracionamento") for ean, meta in indice["meta_por_ean"].items()},
+        "nomes": nomes,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, 6)
+
+
+def desserializar_indice(dados: bytes, grid_id=None, prazo=None) -> dict | None:
+    """Devolve o índice ou None quando o artefato não serve para esta versão/tabela."""
+    try:
+        payload = json.loads(zlib.decompress(dados).decode("utf-8"))
+    except (zlib.error, ValueError, UnicodeDecodeError):
+        return None
+
+    if payload.get("v") != INDICE_VERSAO or payload.get("assinatura") != INDICE_ASSINATURA:
+        return None
+    if grid_id is not None and payload.get("grid_id") != str(grid_id):
+        return None
+    if prazo is not None and payload.get("prazo") != int(prazo):
+        return None
+
+    precos_nome_lista = []
+    for orig, norm, ordenado, preco, ean, fracionamento in payload.get("nomes") or []:
+        item = {"norm": norm, "ord": ordenado, "preco": preco, "orig": orig}
+        if fracionamento:
+            item["fracionamento"] = fracionamento
+        if ean:
+            item["ean"] = ean
+        precos_nome_lista.append(item)
+
+    return {
+        "precos": payload.get("precos") or {},
+        "precos_nome_lista": precos_nome_lista,
+        "meta_por_ean": {
+            ean: {"fracionamento": fracionamento}
+            for ean, fracionamento in (payload.get("meta") or {}).items()
+            if fracionamento
+        },
+    }
+
+
+def _sufixo_tabela(doc: dict) -> str:
+    if doc.get("ext"):
+        return doc["ext"]
+    return ".xls" if str(doc.get("filename") or "").lower().endswith(".xls") else ".xlsx"
+
+
+def _compilar_de_bytes(conteudo: bytes, suffix: str, prazos) -> dict:
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    try:
+        tmp.write(conteudo)
+        tmp.close()
+        return compilar_tabela_prazos(tmp.name, prazos)
+    finally:
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+
+
+async def salvar_indice(db, bucket, doc: dict, tabela: dict):
+    """Grava a tabela de todos os prazos no GridFS e registra em ``tabelas_mestre.indices``."""
+    dados = serializar_tabela_prazos(tabela, doc["grid_id"])
+    indice_id = await bucket.upload_from_stream(
+        f"indice_{doc['grid_id']}.bin",
+        BytesIO(dados),
+        metadata={
+            "content_type": "application/octet-stream",
+            "kind": INDICE_KIND,
+            "tabela_grid_id": str(doc["grid_id"]),
+            "prazos": [int(p) for p in tabela["prazos"]],
+            "versao": INDICE_VERSAO,
+        },
+    )
+    # Substitui o mapa inteiro: some também com artefatos por prazo da versão 1.
+    anteriores = [i for i in (doc.get("indices") or {}).values() if i != indice_id]
+    result = await db.tabelas_mestre.update_one(
+        {"_id": doc["_id"], "grid_id": doc["grid_id"]},
+        {"$set": {"indices": {INDICE_CHAVE_PRAZOS: indice_id}}},
+    )
+    if not result.matched_count:
+        # Tabela excluída ou substituída durante a compilação.
+        await _excluir_arquivo(bucket, indice_id)
+        return None
+    doc["indices"] = {INDICE_CHAVE_PRAZOS: indice_id}
+    for anterior in anteriores:
+        await _excluir_arquivo(bucket, anterior)
+    return indice_id
+
+
+async def _excluir_arquivo(bucket, grid_id):
+    try:
+        await bucket.delete(grid_id)
+    except Exception:
+        pass
+
+
+async def excluir_indices(bucket, doc: dict):
+    for indice_id in (doc.get("indices") or {}).values():
+        await _excluir_arquivo(bucket, indice_id)
+
+
+async def compilar_indices_tabela(db, bucket, doc: dict, conteudo: bytes, prazos) -> dict:
+    """Compila e grava a tabela de todos os ``prazos`` a partir do XLSX já em memória."""
+    tabela = await asyncio.to_thread(_compilar_de_bytes, conteudo, _sufixo_tabela(doc), prazos)
+    try:
+        await salvar_indice(db, bucket, doc, tabela)
+    except Exception as e:
+        logger.warning("[TABELA_INDICE] falha ao gravar indice tabela=%s: %s", doc.get("_id"), type(e).__name__)
+    return tabela
+
+
+async def carregar_indice_tabela(db, bucket, doc: dict, prazo) -> dict:
+    """
+    Carrega o índice (tabela_id, prazo) do artefato com todos os prazos. Sem
+    artefato válido (ou sem esse prazo), lê o XLSX uma vez para todos os
+    prazos da tabela e grava o artefato para as próximas chamadas.
+    """
+    prazo = int(prazo)
+    indice_id = (doc.get("indices") or {}).get(INDICE_CHAVE_PRAZOS)
+    if indice_id:
+        try:
+            grid_out = await bucket.open_download_stream(indice_id)
+            dados = await grid_out.read()
+            tabela = await asyncio.to_thread(desserializar_tabela_prazos, dados, doc["grid_id"])
+            if tabela is not None and prazo in tabela["precos"]:
+                return selecionar_prazo(tabela, prazo)
+        except Exception as e:
+            logger.warning("[TABELA_INDICE] indice ilegivel tabela=%s prazo=%s: %s", doc.get("_id"), prazo, type(e).__name__)
+
+    prazos = sorted({int(p) for p in doc.get("prazos_disponiveis") or []} | {prazo})
+    grid_out = await bucket.open_download_stream(doc["grid_id"])
+    conteudo = await grid_out.read()
+    tabela = await compilar_indices_tabela(db, bucket, doc, conteudo, prazos)
+    return selecionar_prazo(tabela, prazo)
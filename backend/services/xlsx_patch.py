@@ -0,0 +1,545 @@
+"""
+Preenchimento de células direto no XML de um xlsx.
+
+Para devolver a cotação com os preços basta alterar algumas centenas de
+``<c>`` de uma ou duas abas; carregar e regravar o workbook inteiro no
+openpyxl custa muito mais em cotações grandes e formatadas. ``PlanilhaXml``
+imita a parte da API do openpyxl que ``_write_resultados_to_workbook`` usa
+(``active``, ``sheetnames``, ``wb[nome]``, ``ws.cell``, ``ws.max_column``,
+``cell.value`` e ``cell.fill``) lendo do XML só o que é consultado, e
+``salvar`` reescreve apenas as abas alteradas e, se houver preenchimento, o
+styles.xml. Os demais membros do zip são copiados comprimidos como estão.
+
+O que foge do caso comum (prefixo de namespace, linha ou célula sem ``r``,
+fórmula na célula de destino, ...) levanta ``XlsxNaoSuportado`` e quem chama
+volta para o openpyxl.
+"""
+
+import bisect
+import copy
+import html
+import io
+import math
+import posixpath
+import re
+import struct
+import zipfile
+from xml.etree import ElementTree
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.xml.functions import tostring
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_DOC_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_ATRIBUTOS = rb"((?:[^>\"']|\"[^\"]*\"|'[^']*')*?)"
+_SHEET_DATA_RE = re.compile(rb"<sheetData\b" + _ATRIBUTOS + rb"(/?)>")
+_LINHA_RE = re.compile(rb"<row\b" + _ATRIBUTOS + rb"(?:/>|>(.*?)</row>)", re.S)
+_CELULA_RE = re.compile(rb"<c\b" + _ATRIBUTOS + rb"(?:/>|>(.*?)</c>)", re.S)
+_CELULA_TAG_RE = re.compile(rb"<c[\s/>]")
+_CELULA_REF_RE = re.compile(rb'<c r="([A-Z]{1,3})\d+"')
+_MESCLA_RE = re.compile(rb'<mergeCell\b[^>]*?\sref="([A-Z]{1,3})(\d+)(?::([A-Z]{1,3})(\d+))?"')
+_DIMENSAO_RE = re.compile(rb'(<dimension\b[^>]*?\sref=")([^"]*)(")')
+_FORMULA_RE = re.compile(rb"<f[\s/>]")
+_VALOR_RE = re.compile(rb"<v>(.*?)</v>", re.S)
+_TEXTO_RE = re.compile(rb"<t\b[^>]*>(.*?)</t>", re.S)
+_FONETICA_RE = re.compile(rb"<rPh\b.*?</rPh>", re.S)
+_SPANS_RE = re.compile(rb'\sspans="[^"]*"')
+
+
+class XlsxNaoSuportado(Exception):
+    """O arquivo foge do que o preenchimento direto no XML sabe tratar."""
+
+
+def copiar_membro_comprimido(origem: bytes, item, zout):
+    """Copia o membro do zip como está (dados já comprimidos), sem recomprimir."""
+    cabecalho = origem[item.header_offset:item.header_offset + 30]
+    if cabecalho[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"cabeçalho local inválido: {item.filename}")
+    nome_len, extra_len = struct.unpack("<HH", cabecalho[26:30])
+    inicio = item.header_offset + 30 + nome_len + extra_len
+    dados = origem[inicio:inicio + item.compress_size]
+
+    copia = copy.copy(item)
+    copia.flag_bits &= ~0x08  # tamanhos e CRC vão no cabeçalho, sem data descriptor
+    copia.header_offset = zout.fp.tell()
+    zout.fp.write(copia.FileHeader())
+    zout.fp.write(dados)
+    zout.filelist.append(copia)
+    zout.NameToInfo[copia.filename] = copia
+    zout.start_dir = zout.fp.tell()
+
+
+_ATRIBUTO_RE = {
+    nome: re.compile(rb"(?:^|\s)" + nome + rb'="([^"]*)"')
+    for nome in (b"r", b"s", b"t")
+}
+
+
+def _atributo(atributos: bytes, nome: bytes):
+    m = _ATRIBUTO_RE[nome].search(atributos)
+    return m.group(1) if m else None
+
+
+def _texto_xml(trecho: bytes) -> str:
+    return html.unescape(trecho.decode("utf-8"))
+
+
+def _alvo_relacao(base: str, alvo: str) -> str:
+    if alvo.startswith("/"):
+        return alvo.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base), alvo))
+
+
+def _relacoes(zin, parte: str) -> dict:
+    """Id -> (tipo, caminho no zip) das relações de ``parte``."""
+    rels = posixpath.join(posixpath.dirname(parte), "_rels", posixpath.basename(parte) + ".rels")
+    try:
+        raiz = ElementTree.fromstring(zin.read(rels))
+    except KeyError:
+        return {}
+    return {
+        rel.get("Id"): (rel.get("Type", ""), _alvo_relacao(parte, rel.get("Target", "")))
+        for rel in raiz.iter(f"{{{NS_PKG_REL}}}Relationship")
+    }
+
+
+class CelulaXml:
+    def __init__(self, aba, row, column):
+        self.parent = aba
+        self.row = row
+        self.column = column
+        self._alterada = False
+        self._valor = None
+        self._fill = None
+
+    @property
+    def coordinate(self):
+        return f"{get_column_letter(self.column)}{self.row}"
+
+    @property
+    def value(self):
+        if self._alterada:
+            return self._valor
+        return self.parent._valor_original(self.row, self.column)
+
+    @value.setter
+    def value(self, valor):
+        if self.parent._mesclada(self.row, self.column):
+            # Mesmo erro do MergedCell do openpyxl
+            raise AttributeError("MergedCell value is read-only")
+        if isinstance(valor, bool) or not isinstance(valor, (int, float, str)):
+            raise XlsxNaoSuportado(f"valor {type(valor).__name__} em {self.coordinate}")
+        if isinstance(valor, float) and not math.isfinite(valor):
+            raise XlsxNaoSuportado(f"valor não finito em {self.coordinate}")
+        original = self.parent._celula_xml(self.row, self.column)
+        if original is not None and _FORMULA_RE.search(original[1] or b""):
+            raise XlsxNaoSuportado(f"fórmula em {self.coordinate}")
+        self._valor = valor
+        self._alterada = True
+        self.parent._alteradas[(self.row, self.column)] = self
+
+    @property
+    def fill(self):
+        return self._fill
+
+    @fill.setter
+    def fill(self, fill):
+        if self.parent._mesclada(self.row, self.column):
+            raise AttributeError("MergedCell fill is read-only")
+        self._fill = fill
+        self.parent._alteradas[(self.row, self.column)] = self
+
+
+class AbaXml:
+    def __init__(self, planilha, title, caminho):
+        self.parent = planilha
+        self.title = title
+        self.caminho = caminho
+        self._xml = None
+        self._linhas = {}
+        self._numeros_linhas = []
+        self._inicio_dados = self._fim_dados = 0
+        self._dados_vazio = False
+        self._max_coluna = 1
+        self._mesclas = []
+        self._celulas = {}
+        self._alteradas = {}
+        self._cache_linhas = {}
+
+    def _carregar(self):
+        if self._xml is not None:
+            return
+        xml = self.parent._ler(self.caminho)
+        m = _SHEET_DATA_RE.search(xml)
+        if m is None:
+            raise XlsxNaoSuportado(f"aba {self.title!r} sem sheetData")
+        inicio = m.end()
+        if m.group(2):
+            fim = inicio
+            self._dados_vazio = True
+        else:
+            fim = xml.find(b"</sheetData>", inicio)
+            if fim < 0:
+                raise XlsxNaoSuportado(f"aba {self.title!r} com sheetData aberto")
+
+        linhas = {}
+        for lm in _LINHA_RE.finditer(xml, inicio, fim):
+            numero = _atributo(lm.group(1), b"r")
+            if numero is None:
+                raise XlsxNaoSuportado(f"linha sem r na aba {self.title!r}")
+            linhas[int(numero)] = (lm.start(), lm.end())
+
+        # Mesmo max_column do openpyxl: células existentes e intervalos mesclados
+        refs = _CELULA_REF_RE.findall(xml, inicio, fim)
+        if len(refs) != len(_CELULA_TAG_RE.findall(xml, inicio, fim)):
+            raise XlsxNaoSuportado(f"célula sem r na aba {self.title!r}")
+        max_coluna = max((column_index_from_string(letras.decode()) for letras in set(refs)), default=1)
+        mesclas = []
+        for mm in _MESCLA_RE.finditer(xml, fim):
+            c1, r1 = column_index_from_string(mm.group(1).decode()), int(mm.group(2))
+            if mm.group(3):
+                c2, r2 = column_index_from_string(mm.group(3).decode()), int(mm.group(4))
+            else:
+                c2, r2 = c1, r1
+            mesclas.append((r1, c1, r2, c2))
+            if (r1, c1) != (r2, c2):
+                max_coluna = max(max_coluna, c2)
+
+        self._xml = xml
+        self._linhas = linhas
+        self._numeros_linhas = sorted(linhas)
+        self._inicio_dados, self._fim_dados = inicio, fim
+        self._max_coluna = max_coluna
+        self._mesclas = mesclas
+
+    @property
+    def max_column(self):
+        self._carregar()
+        tocadas = max((coluna for _, coluna in self._celulas), default=1)
+        return max(self._max_coluna, tocadas)
+
+    def cell(self, row, column):
+        self._carregar()
+        chave = (row, column)
+        if chave not in self._celulas:
+            self._celulas[chave] = CelulaXml(self, row, column)
+        return self._celulas[chave]
+
+    def _mesclada(self, row, column):
+        """Célula dentro de um intervalo mesclado, fora do canto superior esquerdo."""
+        for r1, c1, r2, c2 in self._mesclas:
+            if r1 <= row <= r2 and c1 <= column <= c2 and (row, column) != (r1, c1):
+                return True
+        return False
+
+    def _celulas_da_linha(self, row):
+        """coluna -> (atributos, conteúdo, trecho) das células da linha no XML original."""
+        celulas = self._cache_linhas.get(row)
+        if celulas is None:
+            celulas = {}
+            posicao = self._linhas.get(row)
+            if posicao is not None:
+                for cm in _CELULA_RE.finditer(self._xml, *posicao):
+                    letras = _atributo(cm.group(1), b"r").rstrip(b"0123456789").decode()
+                    celulas[column_index_from_string(letras)] = (cm.group(1), cm.group(2), cm.group(0))
+            self._cache_linhas[row] = celulas
+        return celulas
+
+    def _celula_xml(self, row, column):
+        """(atributos, conteúdo) da célula no XML original, ou None."""
+        achada = self._celulas_da_linha(row).get(column)
+        return achada[:2] if achada is not None else None
+
+    def _valor_original(self, row, column):
+        """O valor que o openpyxl (sem data_only) daria à célula."""
+        if self._mesclada(row, column):
+            return None
+        achada = self._celula_xml(row, column)
+        if achada is None:
+            return None
+        atributos, corpo = achada[0], achada[1] or b""
+        if _FORMULA_RE.search(corpo):
+            formula = re.search(rb"<f\b[^>]*>(.*?)</f>", corpo, re.S)
+            return "=" + (_texto_xml(formula.group(1)) if formula else "")
+        tipo = _atributo(atributos, b"t") or b"n"
+        if tipo == b"inlineStr":
+            return "".join(_texto_xml(t) for t in _TEXTO_RE.findall(_FONETICA_RE.sub(b"", corpo)))
+        valor = _VALOR_RE.search(corpo)
+        if valor is None:
+            return None
+        texto = _texto_xml(valor.group(1))
+        if tipo == b"s":
+            return self.parent._texto_compartilhado(int(texto))
+        if tipo == b"b":
+            return texto.strip() == "1"
+        if tipo == b"n":
+            return float(texto) if texto.strip() else None
+        return texto
+
+    def _xml_alterado(self, estilos_novos) -> bytes:
+        xml = self._xml
+        por_linha = {}
+        for (row, column), celula in self._alteradas.items():
+            por_linha.setdefault(row, {})[column] = celula
+
+        trechos = []
+        cursor = 0
+        insercoes = []
+        for row in sorted(por_linha):
+            posicao = self._linhas.get(row)
+            if posicao is None:
+                idx = bisect.bisect_right(self._numeros_linhas, row)
+                destino = self._linhas[self._numeros_linhas[idx]][0] if idx < len(self._numeros_linhas) else self._fim_dados
+                insercoes.append((destino, destino, self._xml_linha(row, None, por_linha[row], estilos_novos)))
+            else:
+                insercoes.append((posicao[0], posicao[1], self._xml_linha(row, posicao, por_linha[row], estilos_novos)))
+
+        insercoes.sort(key=lambda item: item[0])
+        if self._dados_vazio:
+            m = _SHEET_DATA_RE.search(xml)
+            trechos.append(xml[:m.start()])
+            trechos.append(b"<sheetData" + m.group(1) + b">")
+            trechos.extend(novo for _, _, novo in insercoes)
+            trechos.append(b"</sheetData>")
+            cursor = m.end()
+        else:
+            for inicio, fim, novo in insercoes:
+                trechos.append(xml[cursor:inicio])
+                trechos.append(novo)
+                cursor = fim
+        trechos.append(xml[cursor:])
+        return self._ajustar_dimensao(b"".join(trechos))
+
+    def _xml_linha(self, row, posicao, celulas, estilos_novos) -> bytes:
+        existentes = []
+        abertura = f'<row r="{row}">'.encode()
+        if posicao is not None:
+            lm = _LINHA_RE.match(self._xml, *posicao)
+            atributos, corpo = lm.group(1), lm.group(2) or b""
+            sobra = _CELULA_RE.sub(b"", corpo).strip()
+            if sobra:
+                raise XlsxNaoSuportado(f"conteúdo inesperado na linha {row} da aba {self.title!r}")
+            abertura = b"<row" + _SPANS_RE.sub(b"", atributos) + b">"
+            existentes = [
+                (coluna, atributos_celula, trecho)
+                for coluna, (atributos_celula, _, trecho) in self._celulas_da_linha(row).items()
+            ]
+
+        saida = {}
+        for coluna, atributos, trecho in existentes:
+            celula = celulas.get(coluna)
+            saida[coluna] = trecho if celula is None else self._xml_celula(celula, atributos, estilos_novos)
+        for coluna, celula in celulas.items():
+            if coluna not in saida:
+                saida[coluna] = self._xml_celula(celula, None, estilos_novos)
+        return abertura + b"".join(saida[coluna] for coluna in sorted(saida)) + b"</row>"
+
+    def _xml_celula(self, celula, atributos, estilos_novos) -> bytes:
+        estilo = _atributo(atributos, b"s") if atributos is not None else None
+        if celula.fill is not None:
+            estilo = str(estilos_novos[(int(estilo or 0), self.parent._xml_fill(celula.fill))]).encode()
+        ref = celula.coordinate.encode()
+        s = b' s="' + estilo + b'"' if estilo else b""
+        if not celula._alterada:
+            # Só o estilo mudou: mantém o conteúdo original
+            if atributos is None:
+                return b'<c r="' + ref + b'"' + s + b"/>"
+            corpo = self._celula_xml(celula.row, celula.column)[1]
+            outros = re.sub(rb'\s(?:r|s)="[^"]*"', b"", atributos)
+            return b'<c r="' + ref + b'"' + s + outros + (b">" + corpo + b"</c>" if corpo else b"/>")
+        valor = celula._valor
+        if isinstance(valor, str):
+            espaco = b' xml:space="preserve"' if valor != valor.strip() else b""
+            texto = html.escape(valor, quote=False).encode("utf-8")
+            return b'<c r="' + ref + b'"' + s + b' t="inlineStr"><is><t' + espaco + b">" + texto + b"</t></is></c>"
+        return b'<c r="' + ref + b'"' + s + b"><v>" + repr(valor).encode() + b"</v></c>"
+
+    def _ajustar_dimensao(self, xml: bytes) -> bytes:
+        m = _DIMENSAO_RE.search(xml)
+        if m is None:
+            return xml
+        linhas = [row for row, _ in self._alteradas]
+        colunas = [column for _, column in self._alteradas]
+        try:
+            partes = m.group(2).decode().split(":")
+            inicio = re.match(r"([A-Z]+)(\d+)$", partes[0])
+            fim = re.match(r"([A-Z]+)(\d+)$", partes[-1])
+            linhas += [int(inicio.group(2)), int(fim.group(2))]
+            colunas += [column_index_from_string(inicio.group(1)), column_index_from_string(fim.group(1))]
+        except (AttributeError, ValueError):
+            return xml
+        ref = f"{get_column_letter(min(colunas))}{min(linhas)}:{get_column_letter(max(colunas))}{max(linhas)}"
+        return xml[:m.start(2)] + ref.encode() + xml[m.end(2):]
+
+
+class PlanilhaXml:
+    def __init__(self, conteudo: bytes):
+        self._conteudo = conteudo
+        self._zip = zipfile.ZipFile(io.BytesIO(conteudo))
+        self._lidos = {}
+        self._textos = None
+        self._fills = {}
+
+        workbook = "xl/workbook.xml"
+        relacoes = _relacoes(self._zip, workbook)
+        raiz = ElementTree.fromstring(self._ler(workbook))
+        if raiz.tag != f"{{{NS_MAIN}}}workbook":
+            raise XlsxNaoSuportado("workbook.xml fora do padrão")
+
+        self._abas = []
+        for sheet in raiz.iter(f"{{{NS_MAIN}}}sheet"):
+            tipo, caminho = relacoes.get(sheet.get(f"{{{NS_DOC_REL}}}id"), ("", ""))
+            # Chartsheets entram na ordem (contam para a aba ativa), mas não recebem preço
+            aba = AbaXml(self, sheet.get("name"), caminho) if tipo.endswith("/worksheet") else None
+            self._abas.append((sheet.get("name"), aba))
+
+        ativa = 0
+        view = raiz.find(f"{{{NS_MAIN}}}bookViews/{{{NS_MAIN}}}workbookView")
+        if view is not None:
+            ativa = int(view.get("activeTab", 0))
+        if not 0 <= ativa < len(self._abas) or self._abas[ativa][1] is None:
+            raise XlsxNaoSuportado("aba ativa não é uma planilha")
+        self._ativa = ativa
+
+        self._caminho_textos = next(
+            (caminho for tipo, caminho in relacoes.values() if tipo.endswith("/sharedStrings")), None
+        )
+        self._caminho_estilos = next(
+            (caminho for tipo, caminho in relacoes.values() if tipo.endswith("/styles")), None
+        )
+
+    @property
+    def active(self):
+        return self._abas[self._ativa][1]
+
+    @property
+    def sheetnames(self):
+        return [nome for nome, _ in self._abas]
+
+    def __getitem__(self, nome):
+        for titulo, aba in self._abas:
+            if titulo == nome:
+                if aba is None:
+                    raise XlsxNaoSuportado(f"{nome!r} não é uma planilha")
+                return aba
+        raise KeyError(f"Worksheet {nome} does not exist.")
+
+    def _xml_fill(self, fill) -> bytes:
+        chave = id(fill)
+        if chave not in self._fills:
+            self._fills[chave] = (fill, tostring(fill.to_tree()))
+        return self._fills[chave][1]
+
+    def _ler(self, caminho):
+        if caminho not in self._lidos:
+            try:
+                self._lidos[caminho] = self._zip.read(caminho)
+            except KeyError:
+                raise XlsxNaoSuportado(f"parte ausente: {caminho}")
+        return self._lidos[caminho]
+
+    def _texto_compartilhado(self, indice):
+        if self._textos is None:
+            self._textos = []
+            if self._caminho_textos:
+                t, r = f"{{{NS_MAIN}}}t", f"{{{NS_MAIN}}}r"
+                for _, el in ElementTree.iterparse(io.BytesIO(self._ler(self._caminho_textos))):
+                    if el.tag != f"{{{NS_MAIN}}}si":
+                        continue
+                    partes = []
+                    for filho in el:
+                        if filho.tag == t:
+                            partes.append(filho.text or "")
+                        elif filho.tag == r:
+                            partes.extend(texto.text or "" for texto in filho.iter(t))
+                    self._textos.append("".join(partes))
+                    el.clear()
+        return self._textos[indice]
+
+    def _estilos_alterados(self, pedidos):
+        """
+        Acrescenta ao styles.xml um fill por preenchimento e um xf por
+        (estilo original, fill). Retorna (xml, {(estilo, fill): novo índice}).
+        """
+        if not self._caminho_estilos:
+            raise XlsxNaoSuportado("workbook sem styles.xml")
+        xml = self._ler(self._caminho_estilos)
+        fills = re.search(rb"(<fills\b" + _ATRIBUTOS + rb">)(.*?)</fills>", xml, re.S)
+        xfs = re.search(rb"(<cellXfs\b" + _ATRIBUTOS + rb">)(.*?)</cellXfs>", xml, re.S)
+        if fills is None or xfs is None:
+            raise XlsxNaoSuportado("styles.xml sem fills/cellXfs")
+        lista_xfs = [m.group(0) for m in re.finditer(rb"<xf\b" + _ATRIBUTOS + rb"(?:/>|>.*?</xf>)", xfs.group(3), re.S)]
+        total_fills = len(re.findall(rb"<fill\b", fills.group(3)))
+
+        novos_fills, indice_fill = [], {}
+        novos_xfs, mapa = [], {}
+        for estilo, fill in pedidos:
+            if fill not in indice_fill:
+                indice_fill[fill] = total_fills + len(novos_fills)
+                novos_fills.append(fill)
+            if estilo >= len(lista_xfs):
+                raise XlsxNaoSuportado(f"estilo {estilo} inexistente")
+            xf = lista_xfs[estilo]
+            fill_id = str(indice_fill[fill]).encode()
+            if re.search(rb'\sfillId="[^"]*"', xf):
+                xf = re.sub(rb'(\sfillId=")[^"]*(")', rb"\g<1>" + fill_id + rb"\g<2>", xf, count=1)
+            else:
+                xf = xf.replace(b"<xf", b'<xf fillId="' + fill_id + b'"', 1)
+            if re.search(rb'\sapplyFill="[^"]*"', xf):
+                xf = re.sub(rb'(\sapplyFill=")[^"]*(")', rb"\g<1>1\g<2>", xf, count=1)
+            else:
+                xf = xf.replace(b"<xf", b'<xf applyFill="1"', 1)
+            mapa[(estilo, fill)] = len(lista_xfs) + len(novos_xfs)
+            novos_xfs.append(xf)
+
+        def _com_contagem(abertura, total):
+            abertura = re.sub(rb'\scount="[^"]*"', b"", abertura)
+            return abertura[:-1] + b' count="' + str(total).encode() + b'">'
+
+        trechos = [
+            (fills.start(), fills.end(),
+             _com_contagem(fills.group(1), total_fills + len(novos_fills))
+             + fills.group(3) + b"".join(novos_fills) + b"</fills>"),
+            (xfs.start(), xfs.end(),
+             _com_contagem(xfs.group(1), len(lista_xfs) + len(novos_xfs))
+             + xfs.group(3) + b"".join(novos_xfs) + b"</cellXfs>"),
+        ]
+        trechos.sort()
+        saida, cursor = [], 0
+        for inicio, fim, novo in trechos:
+            saida.append(xml[cursor:inicio])
+            saida.append(novo)
+            cursor = fim
+        saida.append(xml[cursor:])
+        return b"".join(saida), mapa
+
+    def salvar(self) -> bytes:
+        """Bytes do xlsx com as células alteradas."""
+        abas = [aba for _, aba in self._abas if aba is not None and aba._alteradas]
+        pedidos = []
+        for aba in abas:
+            for celula in aba._alteradas.values():
+                if celula.fill is not None:
+                    achada = aba._celula_xml(celula.row, celula.column)
+                    estilo = _atributo(achada[0], b"s") if achada is not None else None
+                    pedido = (int(estilo or 0), self._xml_fill(celula.fill))
+                    if pedido not in pedidos:
+                        pedidos.append(pedido)
+
+        substituidos = {}
+        estilos_novos = {}
+        if pedidos:
+            substituidos[self._caminho_estilos], estilos_novos = self._estilos_alterados(pedidos)
+        for aba in abas:
+            substituidos[aba.caminho] = aba._xml_alterado(estilos_novos)
+
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zout:
+            for item in self._zip.infolist():
+                if item.filename in substituidos:
+                    zout.writestr(item, substituidos[item.filename], compress_type=zipfile.ZIP_DEFLATED)
+                else:
+                    copiar_membro_comprimido(self._conteudo, item, zout)
+        return buf.getvalue()
@@ -548,6 +548,19 @@ def test_admin_billing_overview_blocks_non_admin(monkeypatch):
     assert response.status_code == 403
 
 
+def test_admin_match_cache_stats_so_para_admin(monkeypatch):
+    response = _client(monkeypatch, uid="normal-uid").get(
+        "/api/admin/match-cache-stats", headers={"Authorization": "Bearer token"}
+    )
+    assert response.status_code == 403
+
+    response = _client(monkeypatch, uid="admin-uid").get(
+        "/api/admin/match-cache-stats", headers={"Authorization": "Bearer token"}
+    )
+    assert response.status_code == 200
+    assert set(response.json()) == {"consultados", "hits", "gravados", "hit_rate"}
+
+
 def test_admin_gate_usa_allowlist_quando_firestore_falha(monkeypatch):
     monkeypatch.setenv("ADMIN_ALLOWED_EMAILS", "edson854_8@hotmail.com")
     monkeypatch.setattr(admin.firebase_auth, "verify_id_token", lambda _token: {
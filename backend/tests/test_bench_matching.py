@@ -0,0 +1,29 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmarks.bench_matching import gerar_cotacao, gerar_relatorio, gerar_tabela_mestre
+
+
+def test_corpus_sintetico_e_reprodutivel():
+    tabela = gerar_tabela_mestre(200, semente=7)
+
+    assert tabela == gerar_tabela_mestre(200, semente=7)
+    assert len({linha["nome"] for linha in tabela}) == 200
+    assert len({linha["preco"] for linha in tabela}) == 200
+    assert gerar_cotacao(tabela, 30, semente=3) == gerar_cotacao(tabela, 30, semente=3)
+
+
+def test_relatorio_de_benchmark_e_json_com_tempos_e_resolucao():
+    relatorio = json.loads(json.dumps(gerar_relatorio([80], [20], semente=5)))
+
+    cenario = relatorio["cenarios"][0]
+    assert cenario["linhas_tabela"] == 80
+    assert cenario["itens_lidos"] == 20
+    assert set(cenario["tempos_s"]) == {
+        "ler_tabela_mestre", "ler_cotacao", "processar_cotacao_ean", "processar_cotacao_completo",
+    }
+    assert sum(cenario["resolucao_completo"].values()) == 20
+    assert cenario["resolucao_completo"]["EAN"] == cenario["resolucao_ean"]["EAN"]
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services import cotacao_executor, matching_engine
+from services.matching_engine import normalizar_nome, ordenar_palavras, processar_cotacao
+
+
+def _indice():
+    nomes = [("ARROZ CAMIL 5KG", "7896006716112", 24.5), ("FEIJAO KICALDO 1KG", "", 8.1)]
+    precos_nome_lista = []
+    for nome, ean, preco in nomes:
+        norm = normalizar_nome(nome)
+        item = {"norm": norm, "ord": ordenar_palavras(norm), "preco": preco, "orig": nome}
+        if ean:
+            item["ean"] = ean
+        precos_nome_lista.append(item)
+    return {
+        "precos": {"7896006716112": 24.5},
+        "precos_nome_lista": precos_nome_lista,
+        "meta_por_ean": {"7896006716112": {"fracionamento": "6"}},
+    }
+
+
+def test_tarefa_no_pool_de_processos_usa_indice_em_disco(monkeypatch, tmp_path):
+    monkeypatch.setattr(cotacao_executor, "COTACAO_EXECUTOR", "processos")
+    monkeypatch.setattr(cotacao_executor, "COTACAO_INDICES_DIR", str(tmp_path))
+    indice = _indice()
+    itens = [
+        {"ean": "7896006716112", "nome": "ARROZ", "linha": 2},
+        {"ean": "", "nome": "FEIJAO KICALDO 1 KG", "linha": 3},
+    ]
+    ref = cotacao_executor.gravar_referencia_indice(("tabela-1", "grid-1", 28), indice, "grid-1", 28)
+
+    async def run():
+        try:
+            return await cotacao_executor.executar(cotacao_executor.tarefa_match, ref, itens, "completo", True)
+        finally:
+            cotacao_executor.encerrar_executor()
+
+    (resultados, meta_por_ean, metricas), cpu_s = asyncio.run(run())
+
+    esperado = processar_cotacao(itens, indice["precos"], indice["precos_nome_lista"], modo="completo")
+    assert resultados == esperado
+    assert meta_por_ean == {"7896006716112": {"fracionamento": "6"}}
+    assert metricas["resolucao"] == {"EAN": 1, "CAMADA_1": 1}
+    assert cpu_s >= 0
+
+    cotacao_executor.remover_referencias_tabela("tabela-1")
+    assert not list(tmp_path.iterdir())
+
+
+def test_indices_de_outra_assinatura_sao_removidos(monkeypatch, tmp_path):
+    monkeypatch.setattr(cotacao_executor, "COTACAO_INDICES_DIR", str(tmp_path))
+    atual = cotacao_executor.gravar_referencia_indice(("tabela-1", "grid-1", 28), _indice(), "grid-1", 28)
+    antigo = tmp_path / "tabela-1_grid-1_28_versaoanterior.bin"
+    antigo.write_bytes(b"indice antigo")
+
+    assert cotacao_executor.remover_indices_de_outras_versoes() == 1
+    assert [p.name for p in tmp_path.iterdir()] == [os.path.basename(atual["arquivo"])]
+
+
+def test_worker_do_pool_pontua_em_uma_thread(monkeypatch):
+    monkeypatch.setattr(matching_engine, "MATCH_WORKERS", -1)
+    cotacao_executor._inicializar_worker()
+    assert matching_engine.MATCH_WORKERS == 1
+
+
+def test_fila_cheia_recusa_nova_tarefa(monkeypatch):
+    monkeypatch.setattr(cotacao_executor, "COTACAO_EXECUTOR", "threads")
+    monkeypatch.setattr(cotacao_executor, "COTACAO_EXECUTOR_FILA_MAX", 0)
+    monkeypatch.setattr(cotacao_executor, "_capacidade", 1)
+    monkeypatch.setattr(cotacao_executor, "_em_andamento", 1)
+
+    with pytest.raises(cotacao_executor.ExecutorOcupado):
+        asyncio.run(cotacao_executor.executar(sum, [1, 2]))
+
+    monkeypatch.setattr(cotacao_executor, "_em_andamento", 0)
+    assert asyncio.run(cotacao_executor.executar(sum, [1, 2]))[0] == 3
+    assert asyncio.run(cotacao_executor.executar(sum, [1, 2], limitar=False))[0] == 3
+
+
+def test_vaga_so_volta_quando_a_tarefa_termina_no_executor(monkeypatch):
+    monkeypatch.setattr(cotacao_executor, "COTACAO_EXECUTOR", "threads")
+    monkeypatch.setattr(cotacao_executor, "_em_andamento", 0)
+    liberar = threading.Event()
+
+    async def run():
+        tarefa = asyncio.ensure_future(cotacao_executor.executar(liberar.wait, 5))
+        await asyncio.sleep(0.05)
+        tarefa.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarefa
+        # Quem aguardava desistiu, mas a thread segue ocupando a vaga
+        ocupadas = cotacao_executor._em_andamento
+        liberar.set()
+        for _ in range(100):
+            if cotacao_executor._em_andamento == 0:
+                break
+            await asyncio.sleep(0.01)
+        return ocupadas
+
+    assert asyncio.run(run()) == 1
+    assert cotacao_executor._em_andamento == 0
+
+def test_cotacao_em_partes_ocupa_uma_vaga_so(monkeypatch):
+    monkeypatch.setattr(cotacao_executor, "COTACAO_EXECUTOR", "threads")
+    monkeypatch.setattr(cotacao_executor, "COTACAO_PARTE_ITENS", 1)
+    monkeypatch.setattr(cotacao_executor, "COTACAO_EXECUTOR_FILA_MAX", 0)
+    monkeypatch.setattr(cotacao_executor, "_capacidade", 3)
+    monkeypatch.setattr(cotacao_executor, "COTACAO_EXECUTOR_WORKERS", 3)
+    monkeypatch.setattr(cotacao_executor, "_em_andamento", 0)
+    monkeypatch.setattr(cotacao_executor, "_threads", None)
+    liberar = threading.Event()
+
+    def fake_tarefa_match(indice, itens, modo, com_meta=False):
+        liberar.wait(5)
+        return [{"linha": item["linha"]} for item in itens], {}, {}
+
+    monkeypatch.setattr(cotacao_executor, "tarefa_match", fake_tarefa_match)
+    itens = [{"linha": i, "nome": f"ITEM {i}", "ean": ""} for i in range(12)]
+
+    async def run():
+        job = asyncio.ensure_future(cotacao_executor.executar_em_partes({}, itens, "completo"))
+        await asyncio.sleep(0.05)
+        ocupadas = cotacao_executor._em_andamento
+        # O match rápido da extensão continua sendo aceito
+        rapido = await asyncio.wait_for(cotacao_executor.executar(sum, [1, 2]), timeout=1)
+        liberar.set()
+        (resultados, _, metricas), _ = await job
+        return ocupadas, rapido, resultados, metricas
+
+    ocupadas, rapido, resultados, metricas = asyncio.run(run())
+
+    assert ocupadas == 1
+    assert rapido[0] == 3
+    assert [r["linha"] for r in resultados] == list(range(12))
+    assert metricas["partes"] == 12
+    assert cotacao_executor._em_andamento == 0
+
+def test_matching_em_partes_preserva_ordem_e_resultado_sequencial(monkeypatch):
+    from benchmarks.bench_matching import gerar_cotacao, gerar_tabela_mestre
+
+    monkeypatch.setattr(cotacao_executor, "COTACAO_EXECUTOR", "threads")
+    monkeypatch.setattr(cotacao_executor, "COTACAO_PARTE_ITENS", 7)
+    tabela = gerar_tabela_mestre(300, semente=3)
+    precos, precos_nome_lista = {}, []
+    for linha in tabela:
+        norm = normalizar_nome(linha["nome"])
+        precos_nome_lista.append({"norm": norm, "ord": ordenar_palavras(norm), "preco": linha["preco"], "orig": linha["nome"]})
+        if linha["ean"]:
+            precos[linha["ean"]] = linha["preco"]
+    indice = {
+        "precos": precos,
+        "precos_nome_lista": precos_nome_lista,
+        "norms_cache": [item["norm"] for item in precos_nome_lista],
+        "meta_por_ean": {},
+    }
+    itens = [{"ean": i["ean"], "nome": i["nome"], "linha": i["linha"]} for i in gerar_cotacao(tabela, 40, semente=4)]
+    chamadas = []
+
+    async def progresso(*args):
+        chamadas.append(args)
+
+    (resultados, _, metricas), _ = asyncio.run(
+        cotacao_executor.executar_em_partes(indice, itens, "completo", progresso=progresso)
+    )
+
+    assert resultados == processar_cotacao(itens, precos, precos_nome_lista, modo="completo")
+    assert metricas["partes"] == 6
+    assert metricas["itens"] == 40
+    assert sum(metricas["resolucao"].values()) == 40
+    assert sorted(c[0] for c in chamadas) == [1, 2, 3, 4, 5, 6]
+    assert max(c[2] for c in chamadas) == 40
+    assert cotacao_executor.dividir_em_partes(itens, "ean") == [itens]
@@ -2,10 +2,14 @@ import asyncio
 import os
 import sys
 from datetime import datetime, timezone
+from io import BytesIO
+
+from openpyxl import load_workbook
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 from routes import cotacao
+from services import cotacao_executor, job_eventos, match_cache
 
 
 def test_segunda_tabela_so_substitui_por_preco_menor():
@@ -238,3 +242,455 @@ def test_cotacao_audit_metadata_sanitizes_to_counts():
         "aprendido": 0,
         "manual": 1,
     }
+
+
+def _indice_fake(qtd):
+    return {
+        "precos": {f"789{i:010d}": 1.0 for i in range(qtd)},
+        "precos_nome_lista": [
+            {"norm": f"PRODUTO {i}", "ord": f"{i} PRODUTO", "preco": 1.0, "orig": f"Produto {i}"}
+            for i in range(qtd)
+        ],
+        "meta_por_ean": {},
+    }
+
+
+def test_cache_de_indices_reusa_carga_e_respeita_orcamento(monkeypatch):
+    cargas = []
+
+    async def fake_carregar(database, bucket, doc, prazo):
+        cargas.append((str(doc["_id"]), prazo))
+        return _indice_fake(50)
+
+    monkeypatch.setattr(cotacao, "carregar_indice_tabela", fake_carregar)
+    monkeypatch.setattr(cotacao, "_bucket", lambda: None)
+    monkeypatch.setattr(cotacao, "_indices_cache", cotacao.OrderedDict())
+    tamanho = cotacao._estimar_bytes_indice(_indice_fake(50))
+    monkeypatch.setattr(cotacao, "COTACAO_INDICE_CACHE_MAX_BYTES", tamanho * 2)
+
+    doc_a = {"_id": "tabela-a", "grid_id": "grid-a"}
+    doc_b = {"_id": "tabela-b", "grid_id": "grid-b"}
+    doc_c = {"_id": "tabela-c", "grid_id": "grid-c"}
+
+    async def run():
+        primeiro = await cotacao._carregar_indice(doc_a, 28)
+        segundo = await cotacao._carregar_indice(doc_a, 28)
+        assert primeiro is segundo
+        assert primeiro["norms_cache"][0] == "PRODUTO 0"
+
+        await cotacao._carregar_indice(doc_b, 28)
+        await cotacao._carregar_indice(doc_a, 28)
+        await cotacao._carregar_indice(doc_c, 28)
+
+    asyncio.run(run())
+
+    assert cargas == [("tabela-a", 28), ("tabela-b", 28), ("tabela-c", 28)]
+    assert [chave[0] for chave in cotacao._indices_cache] == ["tabela-a", "tabela-c"]
+
+    assert cotacao._invalidar_cache_tabela("tabela-a") == 1
+    assert [chave[0] for chave in cotacao._indices_cache] == ["tabela-c"]
+
+
+class _ColecaoPorId:
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one(self, flt):
+        doc = self.docs.get(flt["_id"])
+        return dict(doc) if doc else None
+
+    async def update_one(self, flt, update):
+        doc = self.docs.get(flt["_id"])
+        casa = doc is not None and all(
+            doc.get(chave) == valor
+            for chave, valor in flt.items()
+            if not chave.startswith("$") and not isinstance(valor, dict)
+        )
+        if casa:
+            doc.update(update.get("$set", {}))
+        return type("Resultado", (), {"matched_count": int(casa)})()
+
+    async def find_one_and_update(self, flt, update, return_document=None):
+        await self.update_one(flt, update)
+        return await self.find_one(flt)
+
+    async def replace_one(self, flt, doc, upsert=False):
+        self.docs[flt["_id"]] = {"_id": flt["_id"], **doc}
+
+    async def delete_one(self, flt):
+        self.docs.pop(flt["_id"], None)
+
+
+class _BucketMemoria:
+    def __init__(self):
+        self.arquivos = {}
+
+    async def open_download_stream(self, grid_id):
+        dados = self.arquivos[grid_id]
+
+        class _Stream:
+            async def read(self):
+                return dados
+
+        return _Stream()
+
+    async def upload_from_stream(self, filename, fonte, metadata=None):
+        grid_id = f"grid-{len(self.arquivos)}"
+        self.arquivos[grid_id] = fonte.read()
+        return grid_id
+
+
+def test_tabela_prazos_reusa_extracao_do_mesmo_arquivo(monkeypatch):
+    db = type("DB", (), {})()
+    db.cotacao_jobs = _ColecaoPorId()
+    db.cotacao_extracoes = _ColecaoPorId()
+    bucket = _BucketMemoria()
+    bucket.arquivos["entrada"] = b"mesma planilha"
+    extracoes = []
+
+    def fake_extrair(caminho, progress_callback=None):
+        extracoes.append(caminho)
+        return [{"nome": "ARROZ 5KG", "ean": "7891234567890", "preco_base": 20.0}]
+
+    monkeypatch.setattr(cotacao, "db", db)
+    monkeypatch.setattr(cotacao, "_bucket", lambda: bucket)
+    monkeypatch.setattr(cotacao, "extrair_linhas_base", fake_extrair)
+
+    async def run():
+        for job_id, pct_7 in (("job-1", 0.0), ("job-2", 10.0)):
+            db.cotacao_jobs.docs[job_id] = {
+                "_id": job_id,
+                "input_grid_id": "entrada",
+                "ext": ".xlsx",
+                "prazos": {"7": pct_7},
+            }
+            await cotacao._processar_tabela_prazos(job_id)
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+    assert len(extracoes) == 1
+    assert len(db.cotacao_extracoes.docs) == 1
+    precos = []
+    for job_id in ("job-1", "job-2"):
+        job = db.cotacao_jobs.docs[job_id]
+        assert job["status"] == "done"
+        wb = load_workbook(BytesIO(bucket.arquivos[job["grid_id"]]))
+        precos.append(wb.active.cell(4, 3).value)
+        wb.close()
+    assert precos == [20, 22]
+
+
+def test_renomear_tabela_mantem_indice_em_disco_dos_jobs_em_curso(monkeypatch, tmp_path):
+    monkeypatch.setattr(cotacao_executor, "COTACAO_INDICES_DIR", str(tmp_path))
+    indice = {"precos": {}, "precos_nome_lista": [], "meta_por_ean": {}}
+    ref = cotacao_executor.gravar_referencia_indice(("tabela-a", "grid-a", 28), indice, "grid-a", 28)
+
+    cotacao._invalidar_cache_tabela("tabela-a")
+
+    assert os.path.exists(ref["arquivo"])
+
+def test_sse_do_job_envia_progresso_publicado_e_resultado_uma_vez(monkeypatch):
+    job_id = "job-sse"
+    leituras = []
+    estados = [
+        {"status": "processing"},
+        {"status": "done", "session_id": "sessao-1", "itens": [{"nome": "ARROZ"}]},
+    ]
+
+    async def verificar():
+        leituras.append(len(leituras))
+        return estados[min(len(leituras) - 1, 1)]
+
+    monkeypatch.setattr(cotacao, "COTACAO_SSE_VERIFICACAO_SECONDS", 60)
+
+    async def run():
+        mensagens = []
+
+        async def consumir():
+            async for mensagem in cotacao._stream_eventos_job(job_id, verificar):
+                mensagens.append(mensagem)
+
+        task = asyncio.create_task(consumir())
+        await asyncio.sleep(0.01)
+        progresso = {"stage": "matching", "chunks_done": 1, "total_chunks": 2}
+        cotacao.publicar_evento_job(job_id, {"status": "processing", "progress": progresso})
+        await asyncio.sleep(0.01)
+        cotacao.publicar_evento_job(job_id, {"status": "fim"})
+        await asyncio.wait_for(task, timeout=1)
+        return mensagens
+
+    mensagens = asyncio.run(run())
+
+    assert len(leituras) == 2
+    assert [m.split("\n", 1)[0] for m in mensagens] == ["event: progress", "event: done"]
+    assert '"chunks_done": 1' in mensagens[0]
+    assert '"session_id": "sessao-1"' in mensagens[1]
+    assert job_id not in job_eventos._assinantes
+
+
+def test_sse_do_preview_so_apaga_o_job_depois_de_entregar_o_resultado(monkeypatch):
+    db = type("DB", (), {})()
+    db.cotacao_jobs = _ColecaoPorId()
+    monkeypatch.setattr(cotacao, "db", db)
+
+    db.cotacao_jobs.docs["job-1"] = {
+        "_id": "job-1", "user_id": "user-1", "type": "preview", "status": "done",
+        "session_id": "sessao-1", "itens": [{"nome": "ARROZ"}],
+    }
+
+    async def evento_final(consumir_ate_o_fim):
+        eventos = cotacao._stream_eventos_job(
+            "job-1",
+            lambda: cotacao._evento_preview_job("job-1", "user-1"),
+            lambda _evento: cotacao._finalizar_preview_job("job-1", "user-1"),
+        )
+        mensagem = await eventos.__anext__()
+        if consumir_ate_o_fim:
+            async for _ in eventos:
+                pass
+        else:
+            # Conexão caiu antes de o frame chegar ao cliente
+            await eventos.aclose()
+        return mensagem
+
+    mensagem = asyncio.run(evento_final(False))
+    assert mensagem.startswith("event: done")
+    assert "job-1" in db.cotacao_jobs.docs
+
+    mensagem = asyncio.run(evento_final(True))
+    assert '"session_id": "sessao-1"' in mensagem
+    assert "job-1" not in db.cotacao_jobs.docs
+
+
+class _ArquivosGridFS:
+    def __init__(self):
+        self.docs = []
+
+    async def find_one(self, flt, projection=None, sort=None):
+        for doc in self.docs:
+            if (
+                doc["metadata"].get("sha256") == flt["metadata.sha256"]
+                and doc["length"] == flt["length"]
+                and doc["uploadDate"] >= flt["uploadDate"]["$gte"]
+            ):
+                return {"_id": doc["_id"]}
+        return None
+
+
+class _BucketSessao:
+    def __init__(self, arquivos):
+        self.arquivos = arquivos
+        self.blobs = {}
+
+    async def upload_from_stream(self, filename, fonte, metadata=None):
+        grid_id = f"blob-{len(self.blobs)}"
+        self.blobs[grid_id] = fonte.read()
+        self.arquivos.docs.append({
+            "_id": grid_id,
+            "length": len(self.blobs[grid_id]),
+            "metadata": metadata,
+            "uploadDate": datetime.now(timezone.utc),
+        })
+        return grid_id
+
+    async def download_to_stream(self, grid_id, destino):
+        destino.write(self.blobs[grid_id])
+
+
+class _Sessoes:
+    def __init__(self):
+        self.docs = {}
+
+    async def insert_one(self, doc):
+        self.docs[doc["_id"]] = doc
+
+    async def find_one(self, flt):
+        doc = self.docs.get(flt["_id"])
+        return doc if doc and doc["user_id"] == flt["user_id"] else None
+
+
+def test_sessao_guarda_planilha_deduplicada_e_itens_compactados(monkeypatch, tmp_path):
+    arquivos = _ArquivosGridFS()
+    bucket = _BucketSessao(arquivos)
+    db = type("DB", (dict,), {})({"fs.files": arquivos})
+    db.cotacao_sessoes = _Sessoes()
+    monkeypatch.setattr(cotacao, "db", db)
+    monkeypatch.setattr(cotacao, "_bucket", lambda: bucket)
+
+    itens = [{"linha": 2, "nome": "ARROZ 5KG", "ean": "7891234567890"}]
+    resultados = [{"linha": 2, "preco": 20.5, "tipo": "EAN"}]
+
+    async def run():
+        for session_id in ("sessao-1", "sessao-2"):
+            await cotacao._salvar_sessao_cotacao(
+                session_id, "user-1", b"planilha original", ".xlsx", itens, resultados, tabela_id="tabela-a"
+            )
+        carregada = await cotacao._carregar_sessao_cotacao("sessao-2", "user-1")
+        outro_usuario = await cotacao._carregar_sessao_cotacao("sessao-2", "user-2")
+        await cotacao.baixar_blob_para_arquivo(bucket, carregada[0]["cotacao_grid_id"], str(tmp_path / "c.xlsx"))
+        return carregada, outro_usuario
+
+    (sessao, itens_lidos, resultados_lidos), outro_usuario = asyncio.run(run())
+
+    assert len(bucket.blobs) == 1
+    assert db.cotacao_sessoes.docs["sessao-1"]["cotacao_grid_id"] == sessao["cotacao_grid_id"]
+    assert "itens" not in sessao and "cotacao_bytes" not in sessao
+    assert (sessao["total_itens"], sessao["preenchidos"]) == (1, 1)
+    assert (itens_lidos, resultados_lidos) == (itens, resultados)
+    assert outro_usuario == (None, None, None)
+    assert (tmp_path / "c.xlsx").read_bytes() == b"planilha original"
+
+
+class _AprendizadoFake:
+    def __init__(self, docs):
+        self.docs = docs
+        self.consultas = 0
+
+    def find(self, flt, projection=None):
+        self.consultas += 1
+        docs = [
+            doc for doc in self.docs
+            if doc["user_id"] == flt["user_id"] and doc["tabela_id"] == flt["tabela_id"] and doc["confirmado"]
+        ]
+
+        async def _iterar():
+            for doc in docs:
+                yield doc
+
+        return _iterar()
+
+
+def test_aprendizado_e_camada_zero_e_so_o_resto_vai_para_o_motor(monkeypatch):
+    aprendizado = _AprendizadoFake([
+        {"user_id": "user-1", "tabela_id": "tabela-a", "produto_cotacao_norm": "ARROZ TESTE 5KG",
+         "preco": 19.9, "confirmado": True},
+        {"user_id": "user-1", "tabela_id": "tabela-b", "produto_cotacao_norm": "FEIJAO TESTE 1KG",
+         "preco": 8.0, "confirmado": True},
+    ])
+    db = type("DB", (), {})()
+    db.cotacao_aprendizado = aprendizado
+    enviados = []
+
+    async def fake_em_partes(indice, itens, modo, com_meta=False, **opcoes):
+        enviados.append([item["nome"] for item in itens])
+        resultados = [{"linha": item["linha"], "preco": 5.0, "tipo": "SIMILAR 90%"} for item in itens]
+        return (resultados, {}, {}), 0.0
+
+    monkeypatch.setattr(cotacao, "db", db)
+    monkeypatch.setattr(cotacao, "executar_em_partes", fake_em_partes)
+    monkeypatch.setattr(cotacao, "_aprendizado_cache", cotacao.OrderedDict())
+
+    itens = [
+        {"linha": 2, "nome": "Arroz Teste 5kg", "ean": ""},
+        {"linha": 3, "nome": "Feijao Teste 1kg", "ean": ""},
+    ]
+
+    async def run():
+        metricas = {}
+        primeira = await cotacao._casar_com_aprendizado("user-1", "tabela-a", {}, None, itens, "completo", metricas)
+        cotacao._atualizar_cache_aprendizado(
+            "user-1", "tabela-a", itens, [primeira[0][0], primeira[0][1]], [False, True]
+        )
+        segunda = await cotacao._casar_com_aprendizado("user-1", "tabela-a", {}, None, itens, "completo", {})
+        return primeira, segunda, metricas
+
+    (primeira, _), (segunda, _), metricas = asyncio.run(run())
+
+    assert primeira == [
+        {"linha": 2, "preco": 19.9, "tipo": "APRENDIDO"},
+        {"linha": 3, "preco": 5.0, "tipo": "SIMILAR 90%"},
+    ]
+    assert metricas["aprendidos"] == 1
+    # Confirmação desfez o ARROZ e ensinou o FEIJAO sem nova consulta ao Mongo
+    assert segunda == [
+        {"linha": 2, "preco": 5.0, "tipo": "SIMILAR 90%"},
+        {"linha": 3, "preco": 5.0, "tipo": "APRENDIDO"},
+    ]
+    assert enviados == [["Feijao Teste 1kg"], ["Arroz Teste 5kg"]]
+    assert aprendizado.consultas == 1
+
+    cotacao._invalidar_cache_tabela("tabela-a")
+    assert ("user-1", "tabela-a") not in cotacao._aprendizado_cache
+
+
+class _MatchCacheFake:
+    def __init__(self):
+        self.docs = {}
+
+    def find(self, flt, projection=None):
+        docs = [self.docs[_id] for _id in flt["_id"]["$in"] if _id in self.docs]
+
+        async def _iterar():
+            for doc in docs:
+                yield doc
+
+        return _iterar()
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            _id = op._filter["_id"]
+            self.docs[_id] = {"_id": _id, **op._doc["$set"]}
+
+
+def test_cache_de_resultados_evita_motor_na_cotacao_repetida(monkeypatch):
+    db = type("DB", (), {})()
+    db.cotacao_aprendizado = _AprendizadoFake([])
+    db.cotacao_match_cache = _MatchCacheFake()
+    enviados = []
+
+    async def fake_em_partes(indice, itens, modo, com_meta=False, **opcoes):
+        enviados.append([item["nome"] for item in itens])
+        resultados = [{"linha": item["linha"], "preco": 5.0, "tipo": "SIMILAR 90%"} for item in itens]
+        return (resultados, {}, {}), 0.0
+
+    monkeypatch.setattr(cotacao, "db", db)
+    monkeypatch.setattr(cotacao, "executar_em_partes", fake_em_partes)
+    monkeypatch.setattr(cotacao, "_aprendizado_cache", cotacao.OrderedDict())
+    monkeypatch.setattr(match_cache, "_estatisticas", {"consultados": 0, "hits": 0, "gravados": 0})
+
+    tabela = {"grid_id": "grid-1", "conteudo_sha256": "abc"}
+    itens = [
+        {"linha": 2, "nome": "Arroz Teste 5kg", "ean": ""},
+        {"linha": 3, "nome": "Feijao Teste 1kg", "ean": "", "current_price": "4,00"},
+    ]
+    semana_seguinte = [
+        {"linha": 7, "nome": "ARROZ  teste 5KG", "ean": "", "current_price": 3.0},
+        {"linha": 8, "nome": "Feijao Teste 1kg", "ean": ""},
+    ]
+
+    async def run():
+        cache = (match_cache.hash_tabela(tabela), 28)
+        await cotacao._casar_com_aprendizado("user-1", "t", {}, None, itens, "completo", {}, cache=cache)
+        metricas = {}
+        repetida, _ = await cotacao._casar_com_aprendizado(
+            "user-1", "t", {}, None, semana_seguinte, "completo", metricas, cache=cache
+        )
+        outro_prazo, _ = await cotacao._casar_com_aprendizado(
+            "user-1", "t", {}, None, itens[:1], "completo", {}, cache=(cache[0], 42)
+        )
+        return repetida, outro_prazo, metricas
+
+    repetida, outro_prazo, metricas = asyncio.run(run())
+
+    # Item com preço atual não é guardado; no acerto o menor preço é reaplicado
+    assert repetida == [
+        {"linha": 7, "preco": 3.0, "tipo": "SIMILAR 90%"},
+        {"linha": 8, "preco": 5.0, "tipo": "SIMILAR 90%"},
+    ]
+    assert metricas["cache_hits"] == 1
+    assert outro_prazo == [{"linha": 2, "preco": 5.0, "tipo": "SIMILAR 90%"}]
+    assert enviados == [
+        ["Arroz Teste 5kg", "Feijao Teste 1kg"],
+        ["Feijao Teste 1kg"],
+        ["Arroz Teste 5kg"],
+    ]
+    assert match_cache.estatisticas() == {"consultados": 5, "hits": 1, "gravados": 3, "hit_rate": 0.2}
+
+    # Modo EAN é um dicionário no motor: não consulta nem grava o cache
+    itens_ean = [{"linha": 2, "nome": "Arroz Teste 5kg", "ean": "7891234567890"}]
+    asyncio.run(cotacao._casar_com_aprendizado(
+        "user-1", "t", {}, None, itens_ean, "ean", {}, cache=(tabela["conteudo_sha256"], 28)
+    ))
+    assert match_cache.estatisticas()["consultados"] == 5
+    assert len(db.cotacao_match_cache.docs) == 3
@@ -1,19 +1,24 @@
+import io
 import os
 import sys
 import tempfile
+import zipfile
 
 import pandas as pd
 from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 from services.excel_processor import (
     _append_cotacao_items_from_dataframe,
-    _gerar_excel_de_dados,
+    _xlsx_safe_bytes,
     detectar_prazos_disponiveis,
+    gerar_excel_de_dados,
     gerar_excel_resultado,
     ler_cotacao,
     ler_tabela_mestre,
+    matriz_precos_prazos,
     normalizar_coluna_preco,
 )
 from services.matching_engine import processar_cotacao
@@ -385,6 +390,54 @@ def test_cotacao_multiplas_abas_preenche_cada_loja_na_aba_correta():
             os.unlink(output)
 
 
+def test_cotacao_lida_em_streaming_descarta_catalogo_e_ignora_dimensao_errada(monkeypatch):
+    path = _xlsx_sheets({
+        "PEDIDO": [
+            ["TITULO"],
+            ["PRODUTO", "EAN", "PREÇO"],
+            ["ARROZ TESTE 5KG", "7891234567890", None],
+            [],
+            ["FEIJAO TESTE 1KG", None, None, None, None, "obs"],
+        ],
+        "CATALOGO": [["Codigo Produto", "Produto", "Comprador"]]
+        + [[i, f"ITEM {i}", "JOAO"] for i in range(600)],
+    })
+    # Dimensão gravada menor que a aba, como alguns ERPs fazem
+    with zipfile.ZipFile(path) as zin:
+        membros = {item.filename: zin.read(item.filename) for item in zin.infolist()}
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zout:
+        for nome, dados in membros.items():
+            if nome == "xl/worksheets/sheet1.xml":
+                assert b'<dimension ref="A1:F5" />' in dados
+                dados = dados.replace(b'<dimension ref="A1:F5" />', b'<dimension ref="A1:B2" />')
+            zout.writestr(nome, dados)
+
+    modos = []
+    load_workbook_original = load_workbook
+
+    def load_workbook_contado(*args, **kwargs):
+        modos.append(kwargs.get("read_only", False))
+        return load_workbook_original(*args, **kwargs)
+
+    monkeypatch.setattr("services.excel_processor.openpyxl.load_workbook", load_workbook_contado)
+    try:
+        itens, header_row = ler_cotacao(path)
+        manual, _ = ler_cotacao(path, coluna_preco="F")
+    finally:
+        os.unlink(path)
+
+    assert modos == [True, True]
+    assert header_row == 2
+    assert [(i["sheet_name"], i["linha"], i["nome"], i["col_preco"]) for i in itens] == [
+        ("PEDIDO", 3, "ARROZ TESTE 5KG", 2),
+        ("PEDIDO", 5, "FEIJAO TESTE 1KG", 2),
+    ]
+    assert [(i["linha"], i["col_preco"], i.get("current_price")) for i in manual] == [
+        (3, 5, None),
+        (5, 5, "obs"),
+    ]
+
+
 def test_coluna_manual_ignora_aba_auxiliar_sem_coluna_de_preco():
     path = _xlsx_sheets({
         "COTACAO": [
@@ -726,8 +779,93 @@ def test_detectar_prazos_ignora_data_no_titulo_antes_do_cabecalho():
         os.unlink(path)
 
 
+def test_tabela_mestre_le_planilha_uma_vez_com_titulo_e_linha_vazia(monkeypatch):
+    path = _xlsx([
+        ["TABELA VALIDA ATE 28/07"],
+        [],
+        ["DESCRICAO", "EAN", "7 DIAS", "28 DIAS", "28 DIAS"],
+        ["ARROZ CAMIL 5KG", "7896006716112", 24.5, 25.9, 99.0],
+        ["FEIJAO KICALDO 1KG", None, 8.1, 8.4, 99.0],
+    ])
+    leituras = []
+    read_excel = pd.read_excel
+
+    def read_excel_contado(*args, **kwargs):
+        leituras.append(kwargs.get("header"))
+        return read_excel(*args, **kwargs)
+
+    monkeypatch.setattr(pd, "read_excel", read_excel_contado)
+    try:
+        assert detectar_prazos_disponiveis(path) == [7, 28]
+        precos, lista = ler_tabela_mestre(path, prazo=28)
+    finally:
+        os.unlink(path)
+
+    assert leituras == [None, None]
+    assert precos == {"7896006716112": 25.9}
+    assert [(item["orig"], item["preco"]) for item in lista] == [
+        ("ARROZ CAMIL 5KG", 25.9),
+        ("FEIJAO KICALDO 1KG", 8.4),
+    ]
+
+
+def test_tabela_mestre_ean_numerico_e_precos_em_texto():
+    path = _xlsx([
+        ["DESCRICAO", "EAN", "28 DIAS"],
+        ["ARROZ CAMIL 5KG", 7896006716112, "25,90"],
+        ["FEIJAO KICALDO 1KG", None, 8.4],
+        ["SAL CISNE 1KG", 7896110005140, 0],
+        ["", 7891000100103, "R$ 3,10"],
+    ])
+    try:
+        precos, lista = ler_tabela_mestre(path, prazo=28)
+    finally:
+        os.unlink(path)
+
+    assert precos == {"7896006716112": 25.9, "7891000100103": 3.1}
+    assert [(item["orig"], item["preco"]) for item in lista] == [
+        ("ARROZ CAMIL 5KG", 25.9),
+        ("FEIJAO KICALDO 1KG", 8.4),
+    ]
+
+
+def test_xlsx_safe_bytes_so_reescreve_styles_com_indent_invalido():
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["DESCRICAO", "EAN", "28 DIAS"])
+    ws.append(["ARROZ CAMIL 5KG", "7896006716112", 25.9])
+    ws["A2"].alignment = Alignment(indent=7)
+    path = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx").name
+    wb.save(path)
+    with open(path, "rb") as f:
+        original = f.read()
+    with zipfile.ZipFile(path) as zin:
+        membros = {item.filename: zin.read(item.filename) for item in zin.infolist()}
+    estilos_invalidos = membros["xl/styles.xml"].replace(b'indent="7"', b'indent="300"')
+    quebrado = path + ".indent.xlsx"
+    with zipfile.ZipFile(quebrado, "w", zipfile.ZIP_DEFLATED) as zout:
+        for nome, dados in membros.items():
+            zout.writestr(nome, estilos_invalidos if nome == "xl/styles.xml" else dados)
+    try:
+        assert _xlsx_safe_bytes(path).getvalue() == original
+        corrigido = _xlsx_safe_bytes(quebrado)
+        precos, _ = ler_tabela_mestre(quebrado, prazo=28)
+    finally:
+        os.unlink(path)
+        os.unlink(quebrado)
+
+    with zipfile.ZipFile(io.BytesIO(corrigido.getvalue())) as zin:
+        assert zin.testzip() is None
+        for nome, dados in membros.items():
+            if nome != "xl/styles.xml":
+                assert zin.read(nome) == dados
+        assert b'indent="300"' not in zin.read("xl/styles.xml")
+        assert b'indent="255"' in zin.read("xl/styles.xml")
+    assert precos == {"7896006716112": 25.9}
+
+
 def test_gerador_de_prazos_inclui_35_e_42_dias():
-    path = _gerar_excel_de_dados(
+    path = gerar_excel_de_dados(
         [{"nome": "PRODUTO TESTE", "ean": "7891234567890", "preco_base": 10.0}],
         {7: 0, 14: 1, 21: 2, 28: 3, 35: 4, 42: 5},
     )
@@ -744,6 +882,43 @@ def test_gerador_de_prazos_inclui_35_e_42_dias():
         os.unlink(path)
 
 
+def test_matriz_de_prazos_arredonda_igual_ao_round_do_python():
+    percentuais = {7: 0, 14: 0.5, 21: 2.5, 28: 3.3, 35: 4, 42: 5.75}
+    bases = [0.285, 1.005, 2.675, 10.125, 3.121, 18.675, 19.99, 0.0] + [k / 1000 for k in range(5000)]
+    matriz = matriz_precos_prazos(bases, percentuais)
+    esperado = [[round(base * (1 + percentuais[p] / 100), 2) for p in (7, 14, 21, 28, 35, 42)] for base in bases]
+    assert matriz.shape == (len(bases), 6)
+    assert matriz.tolist() == esperado
+
+
+def test_gerador_de_prazos_em_fluxo_aceita_iteravel_e_gera_csv():
+    rows = [
+        {"nome": " LEITE & CAFÉ <1L>\x01", "ean": "7891234567890", "preco_base": 10.0},
+        {"nome": "SEM EAN", "ean": "", "preco_base": 3.33},
+    ]
+    percentuais = {7: 0, 14: 1, 21: 2, 28: 3, 35: 4, 42: 5}
+    paths = [gerar_excel_de_dados(iter(rows), percentuais, formato) for formato in ("xlsx", "csv")]
+    try:
+        workbook = load_workbook(paths[0])
+        sheet = workbook.active
+        assert sheet.title == "Tabela de Preços"
+        assert sheet.cell(4, 1).value == " LEITE & CAFÉ <1L>"
+        assert sheet.cell(5, 2).value is None
+        assert [sheet.cell(5, col).value for col in range(3, 9)] == [3.33, 3.36, 3.4, 3.43, 3.46, 3.5]
+        assert sheet.cell(5, 3).number_format == "#,##0.00"
+        assert sheet.cell(3, 1).font.b is True
+        assert sheet.max_row == 5
+        workbook.close()
+
+        with open(paths[1], encoding="utf-8-sig") as f:
+            linhas = f.read().splitlines()
+        assert linhas[0].split(";")[:3] == ["PRODUTO", "EAN", "7 dias"]
+        assert linhas[2] == "SEM EAN;;3,33;3,36;3,40;3,43;3,46;3,50"
+    finally:
+        for path in paths:
+            os.unlink(path)
+
+
 def test_cotacao_preserva_ean_com_nome_vazio():
     path = _xlsx([
         ["PRODUTO", "EAN", "PRECO"],
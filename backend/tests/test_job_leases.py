@@ -0,0 +1,179 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from routes import cotacao
+from services import job_leases
+
+
+def _casa(doc, flt):
+    for chave, esperado in flt.items():
+        if chave == "$or":
+            if not any(_casa(doc, sub) for sub in esperado):
+                return False
+            continue
+        valor = doc.get(chave)
+        if isinstance(esperado, dict):
+            for op, ref in esperado.items():
+                if op == "$lt" and not (valor is not None and valor < ref):
+                    return False
+                if op == "$ne" and valor == ref:
+                    return False
+                if op == "$exists" and (chave in doc) != ref:
+                    return False
+        elif valor != esperado:
+            return False
+    return True
+
+
+class _Resultado:
+    def __init__(self, matched_count):
+        self.matched_count = matched_count
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, campo, direcao):
+        self.docs.sort(key=lambda doc: doc[campo], reverse=direcao < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    def __aiter__(self):
+        self._it = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _Jobs:
+    def __init__(self, *docs):
+        self.docs = {doc["_id"]: doc for doc in docs}
+
+    def _aplicar(self, doc, update):
+        doc.update(update.get("$set", {}))
+        for campo, n in update.get("$inc", {}).items():
+            doc[campo] = doc.get(campo, 0) + n
+        for campo in update.get("$unset", {}):
+            doc.pop(campo, None)
+
+    def find(self, flt, projection=None):
+        return _Cursor([dict(doc) for doc in self.docs.values() if _casa(doc, flt)])
+
+    async def find_one_and_update(self, flt, update, return_document=None):
+        for doc in self.docs.values():
+            if _casa(doc, flt):
+                self._aplicar(doc, update)
+                return dict(doc)
+        return None
+
+    async def update_one(self, flt, update):
+        for doc in self.docs.values():
+            if _casa(doc, flt):
+                self._aplicar(doc, update)
+                return _Resultado(1)
+        return _Resultado(0)
+
+
+def _db(*docs):
+    db = type("DB", (), {})()
+    db.cotacao_jobs = _Jobs(*docs)
+    return db
+
+
+def test_so_uma_instancia_reivindica_e_lease_vencido_volta_a_ser_reivindicavel(monkeypatch):
+    agora = datetime.now(timezone.utc)
+    db = _db({"_id": "job-1", "status": "queued", "created_at": agora})
+
+    async def run():
+        monkeypatch.setattr(job_leases, "INSTANCIA_ID", "api-a")
+        job = await job_leases.reivindicar_job(db, "job-1", "tabela_prazos")
+        assert job["status"] == "processing"
+        assert job["lease_owner"] == "api-a"
+        assert job["tentativas"] == 1
+        assert await job_leases.reivindicar_job(db, "job-1", "preview") is None
+
+        monkeypatch.setattr(job_leases, "INSTANCIA_ID", "api-b")
+        assert await job_leases.reivindicar_job(db, "job-1", "tabela_prazos") is None
+
+        # api-a parou de renovar: o lease vence e api-b assume
+        db.cotacao_jobs.docs["job-1"]["lease_until"] = agora - timedelta(seconds=1)
+        job = await job_leases.reivindicar_job(db, "job-1", "tabela_prazos")
+        assert job["lease_owner"] == "api-b"
+        assert job["tentativas"] == 2
+
+        monkeypatch.setattr(job_leases, "INSTANCIA_ID", "api-a")
+        assert await job_leases.renovar_lease(db, "job-1") is False
+        await job_leases.liberar_lease(db, "job-1")
+        assert db.cotacao_jobs.docs["job-1"]["lease_owner"] == "api-b"
+
+    asyncio.run(run())
+
+
+def test_despacho_respeita_vagas_por_tipo_e_ignora_lease_valido(monkeypatch):
+    agora = datetime.now(timezone.utc)
+    db = _db(
+        {"_id": "prev-1", "type": "preview", "status": "queued", "created_at": agora},
+        {"_id": "prev-2", "type": "preview", "status": "queued", "created_at": agora + timedelta(seconds=1)},
+        {"_id": "tab-1", "status": "processing", "created_at": agora - timedelta(minutes=1),
+         "lease_owner": "outra", "lease_until": agora + timedelta(minutes=1)},
+        {"_id": "tab-2", "status": "processing", "created_at": agora,
+         "lease_owner": "caiu", "lease_until": agora - timedelta(minutes=1)},
+    )
+    processados = []
+
+    async def fake_processar(job_id, tipo, processar):
+        job = await job_leases.reivindicar_job(db, job_id, tipo)
+        if job:
+            processados.append(job_id)
+
+    monkeypatch.setattr(cotacao, "db", db)
+    monkeypatch.setattr(cotacao, "_processar_preview_job", lambda job_id: fake_processar(job_id, "preview", None))
+    monkeypatch.setattr(cotacao, "_processar_tabela_prazos", lambda job_id: fake_processar(job_id, "tabela_prazos", None))
+    monkeypatch.setattr(cotacao, "COTACAO_JOBS_POR_INSTANCIA", {"preview": 1, "tabela_prazos": 2})
+
+    async def run():
+        iniciados = await cotacao.despachar_cotacao_jobs_once()
+        await asyncio.sleep(0.05)
+        return iniciados
+
+    assert asyncio.run(run()) == 2
+    assert sorted(processados) == ["prev-1", "tab-2"]
+    assert db.cotacao_jobs.docs["tab-1"]["lease_owner"] == "outra"
+    assert db.cotacao_jobs.docs["prev-2"]["status"] == "queued"
+
+
+def test_lease_perdido_interrompe_o_processamento(monkeypatch):
+    db = _db({"_id": "job-1", "status": "queued", "created_at": datetime.now(timezone.utc)})
+    etapas = []
+
+    async def fake_manter_lease(db_, job_id):
+        await asyncio.sleep(0.01)
+
+    async def processar(job):
+        etapas.append("inicio")
+        try:
+            await asyncio.sleep(5)
+            etapas.append("resultado")
+        except asyncio.CancelledError:
+            etapas.append("cancelado")
+            raise
+
+    monkeypatch.setattr(cotacao, "db", db)
+    monkeypatch.setattr(cotacao, "manter_lease", fake_manter_lease)
+
+    asyncio.run(cotacao._executar_com_lease("job-1", "tabela_prazos", processar))
+
+    assert etapas == ["inicio", "cancelado"]
+    assert "lease_owner" not in db.cotacao_jobs.docs["job-1"]
@@ -1375,3 +1375,62 @@ def test_matching_mantem_preco_ervilha_e_milho_quero_quando_misto_confere():
 
     assert preco == 4.29
     assert tipo is not None
+
+def test_matching_em_lote_reproduz_matching_item_a_item():
+    from services.matching_engine import processar_cotacao
+
+    tabela = [
+        _price_item("ERVILHA QUERO LT 170G", 3.49),
+        _price_item("MILHO QUERO LT 170G", 3.79),
+        _price_item("ERVILHA E MILHO QUERO LT 170G", 4.29),
+        _price_item("CR DENT COLGATE MPA A/CARIE 90G", 5.10),
+        _price_item("CR DENT COLGATE LUMINOUS WHITE 70G", 7.90),
+        _price_item("CR DENT COLGATE LUMINOUS WHITE 70G", 7.50),
+    ]
+    itens = [
+        {"ean": "", "nome": "ERVILHA E MILHO QUERO LATA 170GR", "linha": 1},
+        {"ean": "", "nome": "MILHO VERDE QUERO 170G", "linha": 2},
+        {"ean": "", "nome": "CREME DENTAL COLGATE LUMINOUS WHITE 70G", "linha": 3},
+        {"ean": "", "nome": "CR DENT COLGATE NAT 90G COCO GENG DETOX", "linha": 4},
+        {"ean": "", "nome": "", "linha": 5},
+        {"ean": "", "nome": "CREME DENTAL COLGATE LUMINOUS WHITE 70G", "linha": 6, "current_price": 7.0},
+    ]
+
+    um_a_um = processar_cotacao(itens, {}, tabela, modo="completo", lote=False)
+    em_lote = processar_cotacao(itens, {}, tabela, modo="completo", lote=True)
+
+    assert em_lote == um_a_um
+    assert em_lote[2]["preco"] == 7.90
+    assert em_lote[5]["preco"] == 7.0
+
+def test_marcas_no_nome_respeita_fronteira_de_palavra_e_marcas_compostas():
+    from services.matching_engine import _extrair_marca, _marcas_no_nome
+
+    assert _marcas_no_nome("REFRIG COCA COLA 2L", {"COCA COLA", "COLA"}) == {"COCA COLA", "COLA"}
+    assert _marcas_no_nome("REFRIG COCACOLA 2L", {"COCA COLA"}) == set()
+    assert _marcas_no_nome("CAFE 3 CORACOES  500G", {"3 CORACOES", "MARCA FORA DA LISTA"}) == {"3 CORACOES"}
+    assert _marcas_no_nome("SAB MARCA FORA DA LISTA 90G", {"MARCA FORA DA LISTA"}) == {"MARCA FORA DA LISTA"}
+    assert _extrair_marca("CAFE 3 CORACOES 500G") == "3 CORACOES"
+
+def test_metricas_de_matching_registram_camada_de_cada_item():
+    from services.matching_engine import processar_cotacao
+
+    tabela = [
+        _price_item("ERVILHA QUERO LT 170G", 3.49),
+        _price_item("CR DENT COLGATE LUMINOUS WHITE 70G", 7.90),
+    ]
+    itens = [
+        {"ean": "7891000100103", "nome": "QUALQUER", "linha": 1},
+        {"ean": "", "nome": "CREME DENTAL COLGATE LUMINOUS WHITE 70G", "linha": 2},
+        {"ean": "", "nome": "PRODUTO QUE NAO EXISTE", "linha": 3},
+    ]
+
+    for lote in (False, True):
+        metricas = {}
+        resultados = processar_cotacao(
+            itens, {"7891000100103": 2.5}, tabela, modo="completo", lote=lote, metricas=metricas
+        )
+        assert [r["preco"] for r in resultados] == [2.5, 7.90, None]
+        assert metricas["resolucao"] == {"EAN": 1, "CAMADA_1": 1, "SEM_MATCH": 1}
+        assert metricas["itens"] == 3
+        assert {"ean", "pre_filtro", "camada_1"} <= set(metricas["etapas_ms"])
@@ -0,0 +1,113 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pdfminer.high_level import extract_text
+
+from services import pdf_paginas
+from services.excel_processor import _ler_pdf_base
+
+
+def _pdf_com_paginas(paginas):
+    """PDF mínimo com uma lista de linhas de texto por página (Helvetica)."""
+    objetos = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for linhas in paginas:
+        comandos = ["BT /F1 9 Tf 12 TL 30 800 Td"] + [f"({linha}) Tj T*" for linha in linhas] + ["ET"]
+        stream = "\n".join(comandos).encode("latin-1")
+        objetos.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objetos.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objetos)
+        )
+        kids.append(b"%d 0 R" % len(objetos))
+    objetos[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % len(kids)
+
+    saida = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for numero, corpo in enumerate(objetos, 1):
+        offsets.append(len(saida))
+        saida += b"%d 0 obj\n" % numero + corpo + b"\nendobj\n"
+    xref = len(saida)
+    saida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    for offset in offsets:
+        saida += b"%010d 00000 n \n" % offset
+    saida += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, xref)
+
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+    tmp.write(bytes(saida))
+    tmp.close()
+    return tmp.name
+
+
+class FakePage:
+    def __init__(self, text, trava=False):
+        self._text = text
+        self._trava = trava
+
+    def extract_tables(self):
+        return []
+
+    def extract_text(self):
+        if self._trava:
+            time.sleep(60)
+        return self._text
+
+
+class FakePdf:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+def test_texto_por_pagina_em_paralelo_igual_ao_extract_text(monkeypatch):
+    monkeypatch.setattr(pdf_paginas, "PDF_EXTRACAO_WORKERS", 3)
+    monkeypatch.setattr(pdf_paginas, "PDF_PAGINAS_POR_LOTE", 2)
+    paginas = [
+        [f"{p}{i:02d}-1 PRODUTO {p} ITEM {i} {7890000000000 + p * 100 + i} CX-12 1 12 {p + 1},{i:02d} 99,00" for i in range(8)]
+        for p in range(7)
+    ]
+    path = _pdf_com_paginas(paginas)
+    eventos = []
+    try:
+        resultados, falhas = pdf_paginas.extrair_paginas(path, "texto_pdfminer", 7)
+        assert falhas == {}
+        assert "".join(resultados[p] for p in range(7)) == extract_text(path)
+
+        rows = _ler_pdf_base(path, progress_callback=eventos.append)
+    finally:
+        os.unlink(path)
+
+    assert len(rows) == 56
+    assert rows[0]["nome"] == "PRODUTO 0 ITEM 0"
+    assert rows[-1] == {"nome": "PRODUTO 6 ITEM 7", "ean": "7890000000607", "preco_base": 7.07}
+    paginas_lidas = [e for e in eventos if "current_page" in e]
+    assert paginas_lidas[-1] == {"stage": "extracting_pdf_text", "current_page": 7, "total_pages": 7, "rows": 56}
+
+
+def test_pagina_travada_e_pulada_e_o_resto_sai_na_ordem(monkeypatch):
+    import pdfplumber
+
+    linha = "{0}-1 PRODUTO PAGINA {0} 789100000000{0} CX-12 1 12 {0},50 10,00"
+    pages = [FakePage(linha.format(n), trava=(n == 2)) for n in range(1, 5)]
+    monkeypatch.setattr(pdfplumber, "open", lambda _path: FakePdf(pages))
+    monkeypatch.setattr(pdf_paginas, "PDF_EXTRACAO_WORKERS", 1)
+    monkeypatch.setattr(pdf_paginas, "PDF_PAGINAS_POR_LOTE", 4)
+    monkeypatch.setattr(pdf_paginas, "PDF_PAGINA_TIMEOUT_SECONDS", 0.5)
+
+    inicio = time.monotonic()
+    resultados, falhas = pdf_paginas.extrair_paginas("catalogo.pdf", "texto_pdfplumber", 4)
+    assert falhas == {1: "timeout"}
+    assert sorted(resultados) == [0, 2, 3]
+
+    rows = _ler_pdf_base("catalogo.pdf")
+    assert time.monotonic() - inicio < 10
+    assert [row["nome"] for row in rows] == ["PRODUTO PAGINA 1", "PRODUTO PAGINA 3", "PRODUTO PAGINA 4"]
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services import tabela_indice
+from services.excel_processor import ler_tabela_mestre
+from services.tabela_indice import (
+    compilar_indice,
+    compilar_tabela_prazos,
+    desserializar_indice,
+    desserializar_tabela_prazos,
+    selecionar_prazo,
+    serializar_indice,
+    serializar_tabela_prazos,
+)
+
+
+def _xlsx(rows):
+    wb = Workbook()
+    ws = wb.active
+    for row in rows:
+        ws.append(row)
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
+    wb.save(tmp.name)
+    wb.close()
+    tmp.close()
+    return tmp.name
+
+
+def _tabela():
+    return _xlsx([
+        ["PRODUTO", "EAN", "CX", "7", "28"],
+        ["ARROZ CAMIL 5KG", "7896006716112", "CX-6", 24.5, 25.9],
+        ["FEIJAO KICALDO 1KG", None, None, 8.1, 8.4],
+        ["OLEO SOYA 900ML", "7891107101621", "12", 6.2, 6.5],
+    ])
+
+
+def test_indice_compilado_reproduz_leitura_da_tabela_mestre():
+    path = _tabela()
+    try:
+        esperado = ler_tabela_mestre(path, prazo=28, incluir_meta=True)
+        indice = compilar_indice(path, 28)
+    finally:
+        os.unlink(path)
+
+    dados = serializar_indice(indice, "grid-1", 28)
+    carregado = desserializar_indice(dados, grid_id="grid-1", prazo=28)
+
+    assert carregado["precos"] == esperado[0]
+    assert carregado["precos_nome_lista"] == esperado[1]
+    assert carregado["meta_por_ean"] == esperado[2]
+
+
+def test_indice_de_outra_tabela_ou_prazo_e_descartado():
+    path = _tabela()
+    try:
+        indice = compilar_indice(path, 7)
+    finally:
+        os.unlink(path)
+
+    dados = serializar_indice(indice, "grid-1", 7)
+
+    assert desserializar_indice(dados, grid_id="grid-2", prazo=7) is None
+    assert desserializar_indice(dados, grid_id="grid-1", prazo=28) is None
+    assert desserializar_indice(b"lixo", grid_id="grid-1", prazo=7) is None
+    assert desserializar_indice(dados, grid_id="grid-1", prazo=7)["precos"]["7896006716112"] == 24.5
+
+
+def test_assinatura_do_indice_so_muda_com_as_versoes(monkeypatch):
+    path = _tabela()
+    try:
+        dados = serializar_indice(compilar_indice(path, 7), "grid-1", 7)
+    finally:
+        os.unlink(path)
+
+    assert tabela_indice.INDICE_ASSINATURA == (
+        f"i{tabela_indice.INDICE_VERSAO}-m{tabela_indice.MATCHER_VERSAO}"
+    )
+    # Nova versão do matcher: o artefato gravado antes é recompilado
+    monkeypatch.setattr(tabela_indice, "INDICE_ASSINATURA", "i2-m999")
+    assert desserializar_indice(dados, grid_id="grid-1", prazo=7) is None
+
+
+def test_tabela_de_todos_os_prazos_seleciona_cada_prazo_sem_reler():
+    path = _xlsx([
+        ["PRODUTO", "EAN", "CX", "7", "28"],
+        ["ARROZ CAMIL 5KG", "7896006716112", "CX-6", 24.5, 25.9],
+        ["FEIJAO KICALDO 1KG", None, None, 8.1, None],
+        ["OLEO SOYA 900ML", "7891107101621", "12", None, 6.5],
+    ])
+    try:
+        esperado = {prazo: ler_tabela_mestre(path, prazo=prazo, incluir_meta=True) for prazo in (7, 28)}
+        tabela = compilar_tabela_prazos(path)
+    finally:
+        os.unlink(path)
+
+    assert tabela["prazos"] == [7, 28]
+    carregada = desserializar_tabela_prazos(serializar_tabela_prazos(tabela, "grid-1"), grid_id="grid-1")
+    assert desserializar_tabela_prazos(serializar_tabela_prazos(tabela, "grid-1"), grid_id="grid-2") is None
+    for prazo in (7, 28):
+        indice = selecionar_prazo(carregada, prazo)
+        assert (indice["precos"], indice["precos_nome_lista"], indice["meta_por_ean"]) == esperado[prazo]
+
+
+class _Bucket:
+    def __init__(self, arquivos):
+        self.arquivos = arquivos
+
+    async def open_download_stream(self, grid_id):
+        dados = self.arquivos[grid_id]
+
+        class _Stream:
+            async def read(self):
+                return dados
+
+        return _Stream()
+
+
+def test_carregar_indice_troca_de_prazo_so_escolhe_o_vetor(monkeypatch):
+    path = _tabela()
+    try:
+        tabela = compilar_tabela_prazos(path)
+    finally:
+        os.unlink(path)
+    bucket = _Bucket({"indice-1": serializar_tabela_prazos(tabela, "grid-1")})
+    doc = {"_id": "t1", "grid_id": "grid-1", "prazos_disponiveis": [7, 28], "indices": {"prazos": "indice-1"}}
+
+    def nao_rele(*args, **kwargs):
+        raise AssertionError("não deveria reler a planilha")
+
+    monkeypatch.setattr(tabela_indice, "_compilar_de_bytes", nao_rele)
+
+    async def run():
+        return [await tabela_indice.carregar_indice_tabela(None, bucket, doc, prazo) for prazo in (7, 28)]
+
+    indice_7, indice_28 = asyncio.run(run())
+
+    assert indice_7["precos"]["7896006716112"] == 24.5
+    assert indice_28["precos"]["7896006716112"] == 25.9
+    assert indice_28["meta_por_ean"]["7896006716112"] == {"fracionamento": "6"}
@@ -0,0 +1,95 @@
+import os
+import sys
+import tempfile
+import zipfile
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services import excel_processor
+from services.excel_processor import gerar_excel_resultado, ler_cotacao
+
+
+def _cotacao_formatada():
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "PEDIDO"
+    ws.append(["EAN", "DESCRICAO", "PRECO", "OBS"])
+    ws.append(["7891000379585", "ACHOC. NESCAU 200G", None, "urgente"])
+    ws.append(["7891000412855", "ACHOC. PO NESCAU LT 350G", None, None])
+    ws.append([None, "ARROZ CAMIL 5KG", "=1+1", None])
+    for row in ws.iter_rows(min_row=2, max_row=4):
+        for cell in row:
+            cell.font = Font(name="Arial", bold=True)
+    aux = wb.create_sheet("RESUMO")
+    aux.append(["TOTAL", 3])
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
+    wb.save(tmp.name)
+    tmp.close()
+    return tmp.name
+
+
+def _membros(caminho):
+    with zipfile.ZipFile(caminho) as zin:
+        return {item.filename: zin.read(item.filename) for item in zin.infolist()}
+
+
+def test_preenche_so_as_celulas_da_aba_e_mantem_o_resto_do_arquivo(monkeypatch):
+    path = _cotacao_formatada()
+    output = None
+    monkeypatch.setattr(excel_processor.openpyxl, "load_workbook", None)
+    try:
+        itens = [
+            {"linha": 2, "col_preco": 2, "ean": "7891000379585", "nome": "A"},
+            {"linha": 3, "col_preco": None, "ean": "7891000412855", "nome": "B"},
+        ]
+        resultados = [
+            {"linha": 2, "preco": 12.34, "tipo": "EAN"},
+            {"linha": 3, "preco": 7.5, "tipo": "SIMILAR (IA)"},
+        ]
+        output = gerar_excel_resultado(path, itens, resultados)
+        original, gerado = _membros(path), _membros(output)
+    finally:
+        monkeypatch.undo()
+        os.unlink(path)
+
+    try:
+        assert set(original) == set(gerado)
+        alterados = {nome for nome in original if original[nome] != gerado[nome]}
+        assert alterados == {"xl/worksheets/sheet1.xml", "xl/styles.xml"}
+
+        wb = load_workbook(output)
+        ws = wb["PEDIDO"]
+        assert ws["C2"].value == 12.34
+        assert ws["C2"].font.b is True
+        # Sem coluna de preço: primeira coluna livre à direita, com cabeçalho
+        assert ws["E1"].value == "PRECO"
+        assert ws["E3"].value == 7.5
+        assert ws["E3"].fill.fgColor.rgb == "00FFFF00"
+        assert ws["C2"].fill.fill_type is None
+        assert ws["C4"].value == "=1+1"
+        assert wb["RESUMO"]["B1"].value == 3
+        wb.close()
+    finally:
+        os.unlink(output)
+
+
+def test_formula_no_destino_volta_para_o_openpyxl():
+    path = _cotacao_formatada()
+    output = None
+    try:
+        itens, _ = ler_cotacao(path)
+        resultados = [{"linha": item["linha"], "preco": 9.9, "tipo": "EAN"} for item in itens]
+        output = gerar_excel_resultado(path, itens, resultados)
+    finally:
+        os.unlink(path)
+
+    try:
+        wb = load_workbook(output)
+        ws = wb["PEDIDO"]
+        assert [ws.cell(row, 3).value for row in (2, 3, 4)] == [9.9, 9.9, 9.9]
+        wb.close()
+    finally:
+        os.unlink(output)
@@ -38,6 +38,56 @@ async function waitForBackend(maxWaitMs = 60000) {
 
 const connectionMessage = 'Não foi possível conectar ao servidor. Aguarde alguns segundos e tente novamente.';
 
+// Acompanha o job por SSE. Devolve o evento final ({ status: 'done' | 'error', ... })
+// ou null quando o stream não está disponível — aí quem chama volta ao polling.
+async function waitJobEvents(path, headers, { signal, onServerProgress } = {}) {
+  let res;
+  try {
+    res = await fetch(apiUrl(path), {
+      headers: { ...headers, Accept: 'text/event-stream' },
+      cache: 'no-store',
+      signal,
+    });
+  } catch {
+    return null;
+  }
+  if (!res.ok || !res.body || !(res.headers.get('content-type') || '').includes('text/event-stream')) {
+    return null;
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  try {
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) return null;
+      buffer += decoder.decode(value, { stream: true });
+      let sep;
+      while ((sep = buffer.indexOf('\n\n')) >= 0) {
+        const bloco = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        const data = bloco
+          .split('\n')
+          .filter(linha => linha.startsWith('data: '))
+          .map(linha => linha.slice(6))
+          .join('\n');
+        if (!data) continue; // ping
+        const evento = JSON.parse(data);
+        if (evento.status === 'processing') {
+          if (evento.progress) onServerProgress?.(evento.progress);
+          continue;
+        }
+        return evento;
+      }
+    }
+  } catch {
+    return null;
+  } finally {
+    reader.cancel().catch(() => {});
+  }
+}
+
 export const listarTabelas = () => api.get('/cotacao/tabelas');
 
 export const uploadTabela = (arquivo, nome) => {
@@ -155,15 +205,33 @@ export const gerarTabelaPrazos = async (arquivo, percentuais, onProgress, option
   };
 
   const pollJob = async (jobId, retryOffsetSeconds = 0) => {
+    // Progresso por SSE; o polling fica de reserva e baixa o arquivo no fim
+    const sseStart = Date.now();
+    const sseElapsed = () => Math.round((Date.now() - sseStart) / 1000);
+    const ticker = setInterval(() => onProgress?.(retryOffsetSeconds + sseElapsed()), 3000);
+    let evento;
+    try {
+      evento = await waitJobEvents(`/cotacao/jobs/${jobId}/events`, headers, {
+        signal: options.signal,
+        onServerProgress: options.onServerProgress,
+      });
+    } finally {
+      clearInterval(ticker);
+    }
+    if (evento?.status === 'error' && evento.code !== 404) {
+      throw new Error(evento.detail || 'Erro desconhecido');
+    }
+    const offsetSeconds = retryOffsetSeconds + sseElapsed();
+
     // Poll for result (up to 20 minutes)
     const maxAttempts = 400;
     let notFoundAttempts = 0;
     for (let i = 0; i < maxAttempts; i++) {
-      await new Promise(r => setTimeout(r, 3000));
+      await new Promise(r => setTimeout(r, i === 0 && evento?.status === 'done' ? 0 : 3000));
       if (options.signal?.aborted) {
         throw new DOMException('Processamento cancelado', 'AbortError');
       }
-      onProgress?.(retryOffsetSeconds + ((i + 1) * 3));
+      onProgress?.(offsetSeconds + ((i + 1) * 3));
 
       let pollRes;
       try {
@@ -317,6 +385,19 @@ export const previewCotacao = async (arquivo, tabelaId, modo = 'completo', prazo
   let pollWithSimpleApi = useSimplePreviewApi;
   let pollNetworkErrors = 0;
 
+  if (!pollWithSimpleApi) {
+    const evento = await waitJobEvents(`/cotacao/preview-jobs/${jobId}/events`, headers, {
+      signal: options.signal,
+      onServerProgress: options.onServerProgress,
+    });
+    if (evento?.status === 'done') {
+      return { session_id: evento.session_id, itens: evento.itens };
+    }
+    if (evento?.status === 'error' && evento.code !== 404) {
+      throw new Error(evento.detail || `Erro ${evento.code}`);
+    }
+  }
+
   for (let i = 0; i < maxAttempts; i += 1) {
     await new Promise(r => setTimeout(r, 3000));
     if (options.signal?.aborted) {
@@ -360,7 +441,10 @@ export const previewCotacao = async (arquivo, tabelaId, modo = 'completo', prazo
     }
 
     const data = await pollRes.json();
-    if (data.status === 'processing') continue;
+    if (data.status === 'processing') {
+      if (data.progress) options.onServerProgress?.(data.progress);
+      continue;
+    }
     return data; // { session_id, itens }
   }
 